@@ -1,85 +1,106 @@
 from spade.agent import Agent
-from spade.behaviour import CyclicBehaviour
 import asyncio
 import json
-from common.config import RobotStatus
-from typing import List, Dict
-import paho.mqtt.client as mqtt
-import threading
+import logging
+import time
+from common.config import LOW_BATTERY_THRESHOLD
+from services.goalService import goal_tracker, GOAL_SUCCEEDED
+from services.energyModel import energy_model
+from services.fleetState import fleet_state
+from services.locationService import location_service
+from services.chargerSlots import ChargerSlots
+from services.conversationService import ConversationBehaviour, bare_jid
+from typing import List
 
-CHARGING_STATION_LOCATION = {"x": 1.43, "y": -11.21}
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the robots the station drives itself
+BATTERY_CHECK_INTERVAL = 10
 
 class BatteryStationAgent(Agent):
+    """Books the chargers (every one in locations.txt) as timed slots for the whole fleet.
+
+    Robot agents ask for a slot ("charge_request") and are told which charger to use and how long
+    to wait before leaving ("charge_slot"), then report "charge_done" when they unplug. Robots in
+    peer_robots without an agent of their own (no fleet-state entry) are sent to charge by the
+    station when their battery runs low; each of those trips runs as its own task, so a robot
+    driving to a charger never holds up the others.
+    """
+
     def __init__(self, jid, password, peer_robots: List[str]):
         super().__init__(jid, password)
         self.peer_robots = peer_robots
-        # Track status and battery for each robot
-        self.robot_status: Dict[str, RobotStatus] = {r: RobotStatus.AVAILABLE for r in peer_robots}
-        self.battery_level: Dict[str, int] = {r: 100 for r in peer_robots}
-        self.mqtt_goal_succeeded: Dict[str, threading.Event] = {r: threading.Event() for r in peer_robots}
-
-        # MQTT setup
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_client.on_message = self._on_mqtt_message
-        self.mqtt_client.connect("broker.hivemq.com", 1883, 60)
-
-        # Subscribe to status updates for each robot
-        for robot in self.peer_robots:
-            status_topic = f"123/meia/{robot.lower()}/status"
-            self.mqtt_client.subscribe(status_topic)
-        self.mqtt_client.loop_start()
-
-    def _on_mqtt_message(self, client, userdata, msg):
-        payload = msg.payload.decode()
-        print(f"[{self.name}] MQTT {msg.topic} → {payload}")
-        try:
-            data = json.loads(payload)
-        except Exception:
-            data = payload
-
-        # Check which robot this message is for
-        for robot in self.peer_robots:
-            topic_check = f"123/meia/{robot.lower()}/status"
-            if msg.topic == topic_check:
-                # You could parse and update battery level if your robots send it!
-                if isinstance(data, dict) and "battery" in data:
-                    self.battery_level[robot] = int(data["battery"])
-                # Confirm charging finished
-                if (isinstance(data, dict) and data.get("status") == "goal_succeeded") or \
-                   (isinstance(data, str) and data == "goal_succeeded"):
-                    self.mqtt_goal_succeeded[robot].set()
-                    self.robot_status[robot] = RobotStatus.AVAILABLE
-                    self.battery_level[robot] = 100
-                    print(f"[{self.name}] {robot} chegou à estação de carregamento.")
+        self.slots = ChargerSlots()
+        self.charging = {}  # robot name -> asyncio task of a charging trip the station drives
 
     async def setup(self):
-        print(f"[{self.name}] Battery Station setup.")
+        logger.info("[%s] Battery Station setup with %d chargers.", self.name, len(self.slots.chargers))
+        energy_model.start()
         self.add_behaviour(self.BatteryBehaviour())
 
-    class BatteryBehaviour(CyclicBehaviour):
+    class BatteryBehaviour(ConversationBehaviour):
+        async def on_start(self):
+            self.last_check = 0.0
+
         async def run(self):
-            agent = self.agent
-            # Check each robot's battery
-            for robot in agent.peer_robots:
-                if agent.battery_level[robot] < 20 and agent.robot_status[robot] != RobotStatus.CHARGING:
-                    print(f"[{agent.name}] {robot}: Battery low ({agent.battery_level[robot]}%). Sending to charging station.")
-                    agent.robot_status[robot] = RobotStatus.CHARGING
-                    await agent.send_robot_to_charging(robot)
-            await asyncio.sleep(10)
+            msg = await self.receive(timeout=1)
+            if msg:
+                task_type = msg.get_metadata("task_type")
+                if task_type == "charge_request":
+                    await self.handle_charge_request(msg)
+                elif task_type == "charge_done":
+                    self.agent.slots.release(json.loads(msg.body).get("slot_id"))
+            if time.monotonic() - self.last_check >= BATTERY_CHECK_INTERVAL:
+                self.last_check = time.monotonic()
+                self.agent.check_unmanaged_robots()
 
-    async def send_robot_to_charging(self, robot_name: str):
-        print(f"[{self.name}] {robot_name}: Sending goal to charging station...")
-        topic = f"123/meia/{robot_name.lower()}/goal"
-        self.mqtt_goal_succeeded[robot_name].clear()
-        self.mqtt_client.publish(topic, json.dumps(CHARGING_STATION_LOCATION))
-        print(f"[{self.name}] {robot_name}: Published goal to {topic}: {CHARGING_STATION_LOCATION}")
+        async def handle_charge_request(self, msg):
+            data = json.loads(msg.body)
+            robot = bare_jid(msg.sender).split("@")[0]
+            position = (data["x"], data["y"]) if data.get("x") is not None else None
+            slot = self.agent.slots.book(robot, data.get("battery", 0), data.get("target", 100), position,
+                                         max_wait=data.get("max_wait"))
+            reply = msg.make_reply()
+            reply.set_metadata("task_type", "charge_slot")
+            if slot is None:
+                reply.set_metadata("performative", "refuse")
+                reply.body = json.dumps(self.agent.slots.stats())
+            else:
+                reply.set_metadata("performative", "agree")
+                reply.body = json.dumps({"slot_id": slot["slot_id"], "charger": slot["charger"], "x": slot["x"],
+                                         "y": slot["y"], "wait": slot["wait"], "duration": slot["end"] - slot["start"]})
+                logger.info("[%s] %s: charger %s in %.0fs for %.0fs", self.agent.name, robot, slot["charger"],
+                            slot["wait"], slot["end"] - slot["start"])
+            await self.send(reply)
 
-        print(f"[{self.name}] {robot_name}: Waiting for goal_succeeded MQTT message...")
-        await asyncio.get_event_loop().run_in_executor(None, self.mqtt_goal_succeeded[robot_name].wait)
+    def check_unmanaged_robots(self):
+        """Send every low robot that no agent drives to its booked charger, all at once."""
+        for robot in self.peer_robots:
+            trip = self.charging.get(robot)
+            if trip is not None and not trip.done():
+                continue
+            if fleet_state.get(robot) is not None:
+                continue  # its MedicationRobotAgent books its own slot
+            battery = energy_model.battery(robot)
+            if battery is None or battery >= LOW_BATTERY_THRESHOLD:
+                continue
+            logger.info("[%s] %s: Battery low (%.0f%%). Sending to charging station.", self.name, robot, battery)
+            slot = self.slots.book(robot, battery, 100, location_service.get(robot))
+            if slot is not None:
+                self.charging[robot] = asyncio.ensure_future(self.send_robot_to_charging(robot, slot))
 
-        if self.mqtt_goal_succeeded[robot_name].is_set():
-            print(f"[{self.name}] {robot_name}: Charging complete. Battery set to 100%.")
-            self.battery_level[robot_name] = 100
-            self.robot_status[robot_name] = RobotStatus.AVAILABLE
-        else:
-            print(f"[{self.name}] {robot_name}: Did not receive goal_succeeded MQTT message in time.")
+    async def send_robot_to_charging(self, robot_name: str, slot):
+        try:
+            if slot["wait"] > 0:
+                await asyncio.sleep(slot["wait"])
+            logger.info("[%s] %s: Sending goal to charger %s...", self.name, robot_name, slot["charger"])
+            result = await goal_tracker.run(robot_name, {"x": slot["x"], "y": slot["y"]})
+            if result["status"] != GOAL_SUCCEEDED:
+                logger.warning("[%s] %s: Did not reach the charging station (%s).", self.name, robot_name, result["status"])
+                return
+            # Parked until full or the slot is over, whichever comes first
+            while (energy_model.battery(robot_name) or 0) < 100 and time.monotonic() < slot["end"]:
+                await asyncio.sleep(1)
+            logger.info("[%s] %s: Charging complete (%s%%).", self.name, robot_name, energy_model.battery(robot_name))
+        finally:
+            self.slots.release(slot["slot_id"])
@@ -1,180 +1,174 @@
 from spade.agent import Agent
-from spade.behaviour import CyclicBehaviour
 from spade.message import Message
+from spade.behaviour import PeriodicBehaviour
 import asyncio
 import json
-from common.config import ROBOT_MAX_MEDICATION, RobotStatus
+import logging
+import numpy as np
+import time
+from common.config import ROBOT_MAX_MEDICATION, RobotStatus, LOW_BATTERY_THRESHOLD, CHARGING_STATION_LOCATION, FLEET_STATE_HEARTBEAT, ROBOT_LEASE_DURATION, TOP_UP_TARGET, TOP_UP_MAX_WAIT, WAREHOUSES, RESTOCK_DURATION
 from typing import List
-import paho.mqtt.client as mqtt
-import threading
-from services.locationService import get_location, distance_between_points
-
-CHARGING_STATION_LOCATION = {"x": 1.43, "y": -11.21}
-
-# ---- ROOM COORDS PER ROBOT ----
-ROBOT_LOCATIONS = {
-    "robot1": {
-        "Room A-101": {"x": -9.0, "y": 0.5},
-        "Room B-202": {"x": 9.0, "y": -5.0},
-        "Room C-303": {"x": -9.0, "y": -16.0}
-    },
-    "robot2": {
-        "Room A-101": {"x": -9.0, "y": -2.0},
-        "Room B-202": {"x": 9.0, "y": -3.0},
-        "Room C-303": {"x": -9.0, "y": -18.0}
-    },
-    "robot3": {
-        "Room A-101": {"x": -9.0, "y": -4.0},
-        "Room B-202": {"x": 9.0, "y": -8.0},
-        "Room C-303": {"x": -9.0, "y": -20.0}
-    }
-}
-
-
-# ROBOT_LOCATIONS = {
-#     "robot1": {
-#         "Room A-101": {"x": 3.0, "y": 2.0},
-#         "Room B-202": {"x": 9.0, "y": -5.0},
-#         "Room C-303": {"x": -9.0, "y": -16.0}
-#     },
-#     "robot2": {
-#         "Room A-101": {"x": -9.0, "y": -2.0},
-#         "Room B-202": {"x": -3.0, "y": 1.0},
-#         "Room C-303": {"x": -9.0, "y": -18.0}
-#     },
-#     "robot3": {
-#         "Room A-101": {"x": -9.0, "y": -4.0},
-#         "Room B-202": {"x": 9.0, "y": -8.0},
-#         "Room C-303": {"x": 0.0, "y": 2.0}
-#     }
-# }
-
+from services.locationService import location_service
+from services.mapService import facility_map
+from services.routePlanner import order_stops, route_cost
+from services.stockVector import to_vector, demand_vector, to_dict, pack, unpack, stock_matrix, covers
+from services.splitPlanner import plan_split
+from services.allocator import UNKNOWN_DISTANCE
+from services.goalService import goal_tracker, GOAL_SUCCEEDED
+from services.conversationService import ConversationBehaviour, Lease, bare_jid
+from services.fleetState import fleet_state
+from services.energyModel import energy_model, distance_to_charger
+from services.chargeScheduler import charge_time
+
+logger = logging.getLogger(__name__)
 
 class MedicationRobotAgent(Agent):
-    def __init__(self, jid, password, peer_robots: List[str], robot_name: str, battery_level: int):
+    def __init__(self, jid, password, peer_robots: List[str], robot_name: str, battery_level: int, station_jid=None):
         super().__init__(jid, password)
+        self._publishing = False  # state goes to the fleet table once setup() ran
         self.robot_name = robot_name
-        self.stock = ROBOT_MAX_MEDICATION.copy()
+        self.stock = to_vector(ROBOT_MAX_MEDICATION)  # indexed by MEDICATION_TYPES
         self.peer_robots = peer_robots
-        self.battery_level = battery_level
+        self.battery_level = battery_level  # replaced by the robot's own reports once they arrive
+        self.charges = {"top_up": 0, "emergency": 0}
+        self.restocks = {"planned": 0, "empty": 0}
+        self.repositions = 0
+        self.station_jid = station_jid  # BatteryStationAgent that books chargers; None: nearest charger
         self.robot_status = RobotStatus.AVAILABLE
-        self.room_locations = ROBOT_LOCATIONS[robot_name]
+        self.room_locations = facility_map.rooms_for(robot_name)
         self.location = None  # Updated per task
-
-        # --- MQTT ---
-        self.mqtt_goal_succeeded = threading.Event()
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_client.on_message = self._on_mqtt_message
-        self.mqtt_client.connect("broker.hivemq.com", 1883, 60)
-        status_topic = f"123/meia/{self.robot_name.lower()}/status"
-        self.mqtt_client.subscribe(status_topic)
-        self.mqtt_client.loop_start()
-
-    def _on_mqtt_message(self, client, userdata, msg):
-        payload = msg.payload.decode()
-        print(f"[{self.robot_name}] MQTT {msg.topic} → {payload}")
-        try:
-            data = json.loads(payload)
-        except Exception:
-            data = payload
-
-        if (isinstance(data, dict) and data.get("status") == "goal_succeeded") or \
-        (isinstance(data, str) and data == "goal_succeeded"):
-            self.mqtt_goal_succeeded.set()
-            self.robot_status = RobotStatus.AVAILABLE
-            print(f"[{self.robot_name}] Estado atualizado para AVAILABLE após goal_succeeded.")
-
-        elif (isinstance(data, dict) and data.get("status") == "goal_aborted") or \
-            (isinstance(data, str) and data == "goal_aborted"):
-            self.mqtt_goal_succeeded.set() 
-            self.robot_status = RobotStatus.AVAILABLE
-            print(f"[{self.robot_name}] Estado atualizado para AVAILABLE após goal_aborted.")
-
+        self.lease = Lease()  # reservation granted to a dispatcher (TaskManager or a peer)
+
+    # Status and stock changes are published to the fleet-state table as they happen
+    @property
+    def robot_status(self):
+        return self._robot_status
+
+    @robot_status.setter
+    def robot_status(self, status):
+        changed = getattr(self, "_robot_status", None) != status
+        self._robot_status = status
+        if changed:
+            self.publish_state()
+
+    @property
+    def stock(self):
+        return self._stock
+
+    @stock.setter
+    def stock(self, stock):
+        self._stock = stock
+        self.publish_state()
+
+    def publish_state(self):
+        if not self._publishing:
+            return
+        pose = location_service.get(self.robot_name)
+        fleet_state.publish(
+            self.robot_name,
+            jid=bare_jid(self.jid),
+            status=self.robot_status.value,
+            stock=pack(self.stock),
+            battery=self.battery_level,
+            x=pose[0] if pose else None,
+            y=pose[1] if pose else None,
+            eta=goal_tracker.eta(self.robot_name),
+        )
+
+    def refresh_battery(self):
+        """Take the battery level last reported by the robot over MQTT, if any. Returns it."""
+        live = energy_model.battery(self.robot_name)
+        if live is not None:
+            self.battery_level = live
+        return self.battery_level
 
     async def setup(self):
-        print(f"[{self.name}] MedicationRobotAgent setup.")
+        logger.info("[%s] MedicationRobotAgent setup.", self.name)
+        self._publishing = True
+        self.publish_state()
+        self.add_behaviour(self.StateHeartbeatBehaviour(period=FLEET_STATE_HEARTBEAT))
         self.add_behaviour(self.MessageReceiverBehaviour())
 
-    class MessageReceiverBehaviour(CyclicBehaviour):
+    class StateHeartbeatBehaviour(PeriodicBehaviour):
+        """Refreshes this robot's fleet-state entry (pose, battery, ETA) even when nothing else changes."""
+
+        def match(self, message):
+            # Without a template SPADE would queue every message here too, and nothing reads them
+            return False
+
+        async def run(self):
+            self.agent.refresh_battery()
+            self.agent.publish_state()
+
+    class MessageReceiverBehaviour(ConversationBehaviour):
         async def on_start(self):
-            print(f"[{self.agent.name}] Ready to receive tasks. Current stock: {self.agent.stock}")
+            logger.info("[%s] Ready to receive tasks. Current stock: %s", self.agent.name, to_dict(self.agent.stock))
 
         async def run(self):
             try:
-                #print(f"[{self.agent.name}] [DEBUG] Ciclo de run está ativo! Estado atual: {self.agent.robot_status}")
-                msg = await self.receive(timeout=10)
+                msg = await self.next_message(timeout=10)
+                if self.agent.robot_status == RobotStatus.RESERVED and not self.agent.lease.active():
+                    logger.info("[%s] Reservation expired without work. Status → AVAILABLE", self.agent.name)
+                    self.agent.lease.release()
+                    self.agent.robot_status = RobotStatus.AVAILABLE
+                # Top-ups are planned by the TaskManager in quiet spells; this is the fallback when idle and nearly empty
+                if msg is None and self.agent.robot_status == RobotStatus.AVAILABLE \
+                        and self.agent.refresh_battery() < LOW_BATTERY_THRESHOLD:
+                    logger.info("[%s] Battery low (%.0f%%), going to charge.", self.agent.name, self.agent.battery_level)
+                    await self.go_to_charging_station()
+                # Restocks are planned from the demand forecast too; an idle robot out of a type refills on its own
+                elif msg is None and self.agent.robot_status == RobotStatus.AVAILABLE \
+                        and (self.agent.stock == 0).any():
+                    empty = [med for med, amount in to_dict(self.agent.stock).items() if amount == 0]
+                    logger.info("[%s] Out of %s, restocking.", self.agent.name, empty)
+                    await self.go_to_warehouse()
                 if msg:
                     performative = msg.get_metadata("performative")
                     task_type = msg.get_metadata("task_type")
 
                     if performative == "inform" and task_type == "delivery":
-                        print(f"[{self.agent.name}] Received task via message.")
-                        try:
-                            task = json.loads(msg.body)
-                            print(f"[{self.agent.name}] Task details: {task}")
-                            room = task.get("room")
-
-                            if not room:
-                                print(f"[{self.agent.name}] No 'room' in task, can't set location!")
-
-                            peer_data = await self.ask_peers_about_location_and_status(room)
-
-                            loc = get_location(self.agent.robot_name)
-                            if loc is None:
-                                print("[ERRO] Localização do robô é None! Não posso calcular distância.")
-                                return
-                            self_distance = distance_between_points(
-                                loc[0], loc[1],
-                                self.agent.room_locations[room]['x'], self.agent.room_locations[room]['y']
-                            )
-
-                            peer_candidates = [
-                                p for p in peer_data
-                                if p["status"] == "available"
-                                and self.can_peer_fulfill(p["stock"], task["medications"])
-                                and "distance_to_target" in p
-                            ]
-
-                            if peer_candidates:
-                                closest = min(peer_candidates, key=lambda p: p["distance_to_target"])
-                                
-                                if closest["distance_to_target"] < self_distance:
-                                    delegate_msg = Message(to=closest["jid"])
-                                    delegate_msg.set_metadata("performative", "help_confirm")
-                                    delegate_msg.body = json.dumps(task)
-                                    await self.send(delegate_msg)
-                                    print(f"[{self.agent.name}] Delegou a tarefa {task['ID']} para o robô mais próximo: {closest['jid']}")
-                                    
-                                    notice = Message(to="taskmanager@localhost")
-                                    notice.set_metadata("performative", "inform")
-                                    notice.set_metadata("task_type", "delegation_notice")
-                                    notice.body = json.dumps({
-                                        "robot": str(self.agent.jid).split("/")[0],
-                                        "delegated_to": closest["jid"],
-                                        "task_id": task["ID"]
-                                    })
-                                    await self.send(notice)
-                                    return
-                            if await self.can_fulfill(task["medications"]):
-                                self.agent.robot_status = RobotStatus.DELIVERING
-                                await self.deliver_medication(task, room)
-                                print(f"[{self.agent.name}] Executou sozinho a tarefa {task['ID']}")
-
-                            success = await self.ask_peers_for_help(task, room)
-                            if success:
-                                print(f"[{self.agent.name}] Dividiu a tarefa {task['ID']} com peers.")
-                                return
-
-                            print(f"[{self.agent.name}] Impossível cumprir a tarefa {task['ID']}, nem com ajuda. A devolver.")
-                            fail_msg = Message(to="taskmanager@localhost")
-                            fail_msg.set_metadata("performative", "inform")
-                            fail_msg.set_metadata("task_type", "delivery_failed")
-                            fail_msg.body = json.dumps(task)
-                            await self.send(fail_msg)
-                            print(f"[{self.agent.name}] Enviou devolução da tarefa {task['ID']} ao gestor.")
-
-                        except Exception as e:
-                            print(f"[{self.agent.name}] Error handling task message: {e}")
+                        task = json.loads(msg.body)
+                        logger.debug("[%s] Received task %s", self.agent.name, task)
+                        if await self.accept_work(msg, [task]):
+                            await self.handle_delivery(task)
+
+                    elif performative == "inform" and task_type == "delivery_route":
+                        tasks = json.loads(msg.body)["tasks"]
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("[%s] Received route with %d tasks: %s", self.agent.name, len(tasks), [t["ID"] for t in tasks])
+                        if await self.accept_work(msg, tasks):
+                            try:
+                                await self.deliver_route(tasks)
+                            finally:
+                                if self.agent.robot_status == RobotStatus.DELIVERING:
+                                    self.agent.robot_status = RobotStatus.AVAILABLE
+
+                    elif performative == "inform" and task_type == "charge":
+                        # Top-up planned by the TaskManager, sent under the lease it reserved us with
+                        if self.agent.lease.matches(msg.get_metadata("lease_id")):
+                            self.agent.lease.release()
+                            data = json.loads(msg.body)
+                            await self.go_to_charging_station({"x": data["x"], "y": data["y"]},
+                                                              data.get("target", TOP_UP_TARGET), reason="top_up")
+
+                    elif performative == "inform" and task_type == "restock":
+                        if self.agent.lease.matches(msg.get_metadata("lease_id")):
+                            self.agent.lease.release()
+                            await self.go_to_warehouse(json.loads(msg.body), reason="planned")
+
+                    elif performative == "inform" and task_type == "reposition":
+                        if self.agent.lease.matches(msg.get_metadata("lease_id")):
+                            self.agent.lease.release()
+                            self.agent.robot_status = RobotStatus.AVAILABLE
+                            self.reposition(json.loads(msg.body))
+
+                    elif performative == "propose" and task_type == "reservation":
+                        await self.handle_reservation(msg)
+                    elif performative == "cancel" and task_type == "reservation":
+                        lease_id = json.loads(msg.body).get("lease_id")
+                        if self.agent.lease.matches(lease_id):
+                            self.agent.lease.release(lease_id)
+                            self.agent.robot_status = RobotStatus.AVAILABLE
 
                     elif performative == "help_request":
                         await self.handle_help_request(msg)
@@ -183,119 +177,305 @@ class MedicationRobotAgent(Agent):
                     elif performative == "inform" and task_type == "availability_check":
                         await self.respond_to_availability_check(msg)
                     else:
-                        print(f"[{self.agent.name}] Ignored unrelated message: performative={performative}, task_type={task_type}")
+                        logger.debug("[%s] Ignored unrelated message: performative=%s, task_type=%s", self.agent.name, performative, task_type)
             except Exception as e:
-                print(f"[{self.agent.name}] [FATAL ERROR no run()] {e}")
+                logger.exception("[%s] Error in run(): %s", self.agent.name, e)
 
 
-        async def can_fulfill(self, meds_required):
-            if self.agent.battery_level < 20:
-                print(f"[{self.agent.name}] Bateria baixa, não pode cumprir a tarefa.")
-                await self.go_to_charging_station()
-                return False
-            return all(self.agent.stock.get(med, 0) >= amount for med, amount in meds_required.items())
+        async def handle_delivery(self, task):
+            """Deliver an accepted task, or hand it to a peer. On any other way out, an exception
+            included, the task goes back to the TaskManager and the robot is available again."""
+            settled = False  # delivered, delegated, split or already returned
+            try:
+                settled = await self.place_task(task)
+            except Exception as e:
+                logger.exception("[%s] Error handling task %s: %s", self.agent.name, task.get("ID"), e)
+            finally:
+                if self.agent.robot_status == RobotStatus.DELIVERING:
+                    self.agent.robot_status = RobotStatus.AVAILABLE
+                if not settled:
+                    await self.return_task(task)
+
+        async def place_task(self, task):
+            """Delegate, deliver or split a task. Returns False if nobody took it on."""
+            room = task.get("room")
 
-        def can_peer_fulfill(self, stock, meds_required):
-            return all(stock.get(m, 0) >= qtd for m, qtd in meds_required.items())
+            if not room:
+                logger.warning("[%s] No 'room' in task %s, can't set location!", self.agent.name, task["ID"])
 
+            peer_data = await self.ask_peers_about_location_and_status(room)
 
-        async def deliver_medication(self, task, room):
-            try:
-                self.agent.robot_status = RobotStatus.DELIVERING
-                
-                
-                current_location = get_location(self.agent.robot_name)
-                print(f"[{self.agent.name}] Current location: {current_location}")
-                
-                
-                room_coords = self.agent.room_locations.get(room)
-                print(f"[{self.agent.name}] New Status: Delivering. Heading to {room} at {room_coords}")
-
+            loc = await location_service.aget(self.agent.robot_name)
+            if loc is None:
+                logger.warning("[%s] Own location unknown, can't compare distances for task %s. Returning it.", self.agent.name, task["ID"])
+                return False
+            self_distance = facility_map.distance(loc, facility_map.room_point(self.agent.robot_name, room))
+
+            # One comparison over all peers' stock vectors
+            peer_fits = covers(stock_matrix([p.get("stock") for p in peer_data]),
+                               demand_vector(task["medications"]))
+            peer_candidates = [
+                p for p, fits in zip(peer_data, peer_fits)
+                if p["status"] == "available"
+                and fits
+                and "distance_to_target" in p
+                and self.peer_can_afford(p, room)
+            ]
+
+            if peer_candidates:
+                closest = min(peer_candidates, key=lambda p: p["distance_to_target"])
                 
-                topic = f"123/meia/{self.agent.robot_name.lower()}/goal"
-                self.agent.mqtt_goal_succeeded.clear()
-                self.agent.mqtt_client.publish(topic, json.dumps(room_coords))
-                print(f"[{self.agent.name}] Published goal to {topic}: {room_coords}")
+                # The peer is only used if it grants us a lease first
+                leases = await self.reserve([closest["jid"]]) if closest["distance_to_target"] < self_distance else {}
+                if closest["jid"] in leases:
+                    delegate_msg = Message(to=closest["jid"])
+                    delegate_msg.set_metadata("performative", "help_confirm")
+                    delegate_msg.set_metadata("lease_id", leases[closest["jid"]])
+                    delegate_msg.body = json.dumps(task)
+                    await self.send(delegate_msg)
+                    logger.info("[%s] Delegated task %s to the closest robot: %s", self.agent.name, task["ID"], closest["jid"])
+                    
+                    notice = Message(to="taskmanager@localhost")
+                    notice.set_metadata("performative", "inform")
+                    notice.set_metadata("task_type", "delegation_notice")
+                    notice.body = json.dumps({
+                        "robot": str(self.agent.jid).split("/")[0],
+                        "delegated_to": closest["jid"],
+                        "task_id": task["ID"]
+                    })
+                    await self.send(notice)
+                    self.agent.robot_status = RobotStatus.AVAILABLE
+                    return True
+            if await self.can_fulfill(task["medications"], [room]):
+                self.agent.robot_status = RobotStatus.DELIVERING
+                if await self.deliver_medication(task, room):
+                    logger.info("[%s] Delivered task %s on its own", self.agent.name, task["ID"])
+                # On failure deliver_medication already returned the task to the manager
+                return True
+
+            if await self.ask_peers_for_help(task, room):
+                logger.info("[%s] Split task %s with peers.", self.agent.name, task["ID"])
+                return True
+
+            logger.warning("[%s] Can't fulfil task %s, not even with help. Returning it.", self.agent.name, task["ID"])
+            return False
+
+        async def handle_reservation(self, msg):
+            """Grant a lease if free (or extend the same lease); reply accept/reject-proposal."""
+            data = json.loads(msg.body)
+            requester = bare_jid(msg.sender)
+            reply = msg.make_reply()
+            reply.set_metadata("task_type", "reservation")
+            free = self.agent.robot_status == RobotStatus.AVAILABLE or \
+                (self.agent.robot_status == RobotStatus.RESERVED and self.agent.lease.matches(data["lease_id"]))
+            if free and self.agent.lease.grant(requester, data["lease_id"], data.get("duration", ROBOT_LEASE_DURATION)):
+                self.agent.robot_status = RobotStatus.RESERVED
+                reply.set_metadata("performative", "accept-proposal")
+            else:
+                reply.set_metadata("performative", "reject-proposal")
+            reply.body = json.dumps({"lease_id": data["lease_id"], "status": self.agent.robot_status.value})
+            await self.send(reply)
 
-                print(f"[{self.agent.name}] Waiting for goal_succeeded MQTT message...")
-                await asyncio.get_event_loop().run_in_executor(None, self.agent.mqtt_goal_succeeded.wait)
+        async def accept_work(self, msg, tasks):
+            """Take work sent under our lease, or without one while nobody holds a lease.
 
-                if self.agent.mqtt_goal_succeeded.is_set():
-                    print(f"[{self.agent.name}] goal_succeeded received!")
-                else:
-                    print(f"[{self.agent.name}] MQTT goal_succeeded NOT received in time!")
+            Anything else was double-booked (the lease expired or belongs to another dispatcher):
+            the tasks go back to the TaskManager.
+            """
+            lease_id = msg.get_metadata("lease_id")
+            if lease_id is not None:
+                accepted = self.agent.lease.matches(lease_id)
+            else:
+                accepted = not self.agent.lease.active() and self.agent.robot_status == RobotStatus.AVAILABLE
+            if not accepted:
+                logger.warning("[%s] Work from %s without a valid reservation, returning %s.", self.agent.name,
+                               bare_jid(msg.sender), [t["ID"] for t in tasks])
+                for task in tasks:
+                    await self.return_task(task)
+                return False
+            self.agent.lease.release()
+            self.agent.robot_status = RobotStatus.DELIVERING
+            return True
 
-                for med_type, amount in task["medications"].items():
-                    self.agent.stock[med_type] -= amount
+        async def can_fulfill(self, meds_required, rooms=()):
+            """Stock covers meds_required and the battery lasts the trip through `rooms` (in order)
+            and on to the nearest charger. A robot short on battery turns the work down instead of
+            leaving for a charger halfway through it."""
+            battery = self.agent.refresh_battery()
+            if battery < LOW_BATTERY_THRESHOLD:
+                logger.info("[%s] Battery low, can't take the task.", self.agent.name)
+                return False
+            points = [facility_map.room_point(self.agent.robot_name, room) for room in rooms]
+            start = location_service.get(self.agent.robot_name)
+            if points and start is not None and all(p in facility_map.index for p in points):
+                metres = route_cost(start, points)
+                if not energy_model.can_afford(self.agent.robot_name, battery, metres, distance_to_charger(points[-1])):
+                    logger.info("[%s] Battery (%.0f%%) won't last %.1f m and the drive back to a charger.", self.agent.name, battery, metres)
+                    return False
+            return bool(covers(self.agent.stock, demand_vector(meds_required)))
+
+
+        def peer_can_afford(self, peer, room):
+            """Whether a peer's reported battery lasts the drive to `room` and on to a charger."""
+            name = peer["jid"].split("@")[0]
+            point = facility_map.room_point(name, room)
+            if peer.get("battery") is None or point not in facility_map.index:
+                return True
+            return energy_model.can_afford(name, peer["battery"], peer["distance_to_target"], distance_to_charger(point))
+
+        async def return_task(self, task):
+            fail_msg = Message(to="taskmanager@localhost")
+            fail_msg.set_metadata("performative", "inform")
+            fail_msg.set_metadata("task_type", "delivery_failed")
+            fail_msg.body = json.dumps(task)
+            await self.send(fail_msg)
+            logger.info("[%s] Returned task %s to the TaskManager.", self.agent.name, task["ID"])
+
+        async def deliver_route(self, tasks):
+            """Deliver several tasks in one trip, visiting the rooms in planned order.
+
+            Each stop is a separate goal and completes its own task; if a stop fails, it and every
+            stop after it go back to the TaskManager, as does the whole route if planning it fails.
+            """
+            remaining = list(tasks)  # neither delivered nor returned yet
+            try:
+                known = [t for t in tasks if self.agent.room_locations.get(t.get("room")) is not None]
+                for task in tasks:
+                    if task not in known:
+                        remaining.remove(task)
+                        await self.return_task(task)
+                total = {}
+                for task in known:
+                    for med, amount in task["medications"].items():
+                        total[med] = total.get(med, 0) + amount
+                # Re-plan from where the robot actually is now
+                points = [facility_map.room_point(self.agent.robot_name, t["room"]) for t in known]
+                order = order_stops(location_service.get(self.agent.robot_name), points)
+                if not known or not await self.can_fulfill(total, [known[i]["room"] for i in order]):
+                    logger.warning("[%s] Can't complete the route, returning %d tasks.", self.agent.name, len(known))
+                    return
+                for k, i in enumerate(order):
+                    task = known[i]
+                    remaining.remove(task)  # deliver_medication completes or returns it
+                    # Busy until the last stop: an "available" robot mid-route would be offered work it can't answer
+                    if not await self.deliver_medication(task, task["room"], final=k == len(order) - 1):
+                        return
+                logger.info("[%s] Route completed: %s", self.agent.name, [known[i]["ID"] for i in order])
+            except Exception as e:
+                logger.exception("[%s] Error on route: %s", self.agent.name, e)
+            finally:
+                for task in remaining:
+                    await self.return_task(task)
+
+        async def deliver_medication(self, task, room, final=True):
+            """Drive to the room and hand over the medication. Returns True if it was delivered;
+            otherwise stock is untouched and the task goes back to the TaskManager. The robot is
+            available again afterwards unless more stops follow (final=False) or it failed."""
+            reported = False  # delivery_complete sent: the task must not be returned as well
+            try:
+                self.agent.robot_status = RobotStatus.DELIVERING
+                room_coords = self.agent.room_locations.get(room)
+                if room_coords is None:
+                    logger.warning("[%s] Unknown room %s, returning task %s.", self.agent.name, room, task["ID"])
+                    self.agent.robot_status = RobotStatus.AVAILABLE
+                    await self.return_task(task)
+                    return False
+                logger.debug("[%s] Heading to %s at %s", self.agent.name, room, room_coords)
+                result = await goal_tracker.run(self.agent.robot_name, room_coords)
+                if "battery" in result:
+                    self.agent.battery_level = int(result["battery"])
+
+                if result["status"] != GOAL_SUCCEEDED:
+                    # Aborted, timed out or preempted: nothing was delivered, let the manager re-plan now
+                    logger.warning("[%s] Goal for task %s ended with %s, returning it.", self.agent.name, task["ID"], result["status"])
+                    self.agent.robot_status = RobotStatus.AVAILABLE
+                    await self.return_task(task)
+                    return False
+
+                self.agent.stock = self.agent.stock - to_vector(task["medications"])
 
                 
                 msg = Message(to="taskmanager@localhost")
                 msg.set_metadata("performative", "inform")
                 msg.set_metadata("task_type", "delivery_complete")
-                msg.body = json.dumps({"robot": str(self.agent.jid).split("/")[0]})
+                msg.body = json.dumps({
+                    "robot": str(self.agent.jid).split("/")[0],
+                    "task_id": task["ID"],
+                    "completed_at": time.time()
+                })
                 await self.send(msg)
-                print(f"[{self.agent.name}] Sent delivery_complete for task {task['ID']} to TaskManager.")
+                reported = True
 
-                self.agent.robot_status = RobotStatus.AVAILABLE
-                print(f"[{self.agent.name}] Delivery complete. New stock: {self.agent.stock}. New Status: Available")
+                if final:
+                    self.agent.robot_status = RobotStatus.AVAILABLE
+                logger.info("[%s] Delivered task %s. New stock: %s", self.agent.name, task["ID"], to_dict(self.agent.stock))
                 await asyncio.sleep(0.5)
+                return True
 
             except Exception as e:
-                print(f"[{self.agent.name}] [ERRO NO DELIVER_MEDICATION] {e}")
+                logger.exception("[%s] Error delivering task %s: %s", self.agent.name, task.get("ID"), e)
+                if reported:
+                    return True
+                self.agent.robot_status = RobotStatus.AVAILABLE
+                await self.return_task(task)
+                return False
 
 
         async def ask_peers_for_help(self, task, room):
-            meds_needed = task["medications"]
+            demand = demand_vector(task["medications"])
+            if demand is None:
+                logger.warning("[%s] Task %s asks for a medication no robot stocks.", self.agent.name, task["ID"])
+                return False
             responses = []
 
-            for peer in self.agent.peer_robots:
+            def help_request(peer):
                 msg = Message(to=peer)
                 msg.set_metadata("performative", "help_request")
-                msg.body = json.dumps({"medications": meds_needed, "room": room})
-                await self.send(msg)
+                msg.body = json.dumps({"demand": pack(demand), "room": room})
+                return msg
 
-            for _ in self.agent.peer_robots:
-                res = await self.receive(timeout=3)
-                if res and res.metadata.get("performative") == "help_response":
-                    available = json.loads(res.body)
-                    responses.append((str(res.sender), available))
+            replies = await self.request_all(self.agent.peer_robots, help_request, timeout=3)
+            for sender, res in replies.items():
+                if res.get_metadata("performative") == "help_response":
+                    responses.append((sender, json.loads(res.body)))
 
             if not responses:
-                print(f"[{self.agent.name}] No peer responded to help request.")
+                logger.info("[%s] No peer responded to help request.", self.agent.name)
                 return False
 
             task_id = task["ID"]
-            remaining = meds_needed.copy()
-            assignments = {}
-
-            for sender, offer in responses:
-                contribution = {}
-                for med, amount in remaining.items():
-                    if med in offer and offer[med] > 0:
-                        give = min(offer[med], remaining[med])
-                        if give > 0:
-                            contribution[med] = give
-                            remaining[med] -= give
-                if contribution:
-                    assignments[sender] = contribution
-
-                if all(v == 0 for v in remaining.values()):
-                    break
-
-            if not all(v == 0 for v in remaining.values()):
-                print(f"[{self.agent.name}] Not enough peer capacity to split task {task_id}.")
+            # Fewest peers first, then the least total travel to the room
+            names = [sender.split("@")[0] for sender, _ in responses]
+            poses = await location_service.aget_many(names, timeout=1)
+            travel = [facility_map.distance(poses[name], facility_map.room_point(name, room))
+                      if poses.get(name) is not None and facility_map.room_point(name, room) in facility_map.index
+                      else UNKNOWN_DISTANCE for name in names]
+            contributions = plan_split(stock_matrix([offer for _, offer in responses]), demand, travel)
+            if contributions is None:
+                logger.info("[%s] Not enough peer capacity to split task %s.", self.agent.name, task_id)
+                return False
+            assignments = {sender: to_dict(row, skip_zero=True)
+                           for (sender, _), row in zip(responses, contributions) if row.any()}
+
+            # All or nothing: every helper must be reserved before any part is handed out
+            leases = await self.reserve(list(assignments))
+            if len(leases) < len(assignments):
+                logger.info("[%s] Only %d/%d helpers reserved for task %s.", self.agent.name, len(leases), len(assignments), task_id)
+                for peer, lease_id in leases.items():
+                    await self.release(peer, lease_id)
                 return False
 
             for peer, partial_task in assignments.items():
                 msg = Message(to=peer)
                 msg.set_metadata("performative", "help_confirm")
+                msg.set_metadata("lease_id", leases[peer])
                 msg.body = json.dumps({
                     "ID": task_id,
                     "room": room,
                     "medications": partial_task
                 })
                 await self.send(msg)
-                print(f"[{self.agent.name}] Assigned part of task {task_id} to {peer} → {partial_task}")
+                logger.info("[%s] Assigned part of task %s to %s → %s", self.agent.name, task_id, peer, partial_task)
             return True
 
         async def ask_peers_about_location_and_status(self, room):
@@ -304,91 +484,208 @@ class MedicationRobotAgent(Agent):
             if not target_coords:
                 return responses
 
+            # Peers with a fresh fleet-state entry need no round-trip
+            states = fleet_state.snapshot([bare_jid(peer).split("@")[0] for peer in self.agent.peer_robots])
+            missing = []
             for peer in self.agent.peer_robots:
+                peer_name = bare_jid(peer).split("@")[0]
+                state = states.get(peer_name)
+                if state is None:
+                    missing.append(peer)
+                    continue
+                data = {"jid": bare_jid(peer), "status": state["status"], "stock": state["stock"],
+                        "battery": state["battery"], "eta": state.get("eta")}
+                if state.get("x") is not None:
+                    data["distance_to_target"] = facility_map.distance((state["x"], state["y"]), facility_map.room_point(peer_name, room))
+                else:
+                    data["distance_to_target"] = float('inf')
+                responses.append(data)
+            if not missing:
+                return responses
+
+            def availability_check(peer):
                 msg = Message(to=peer)
                 msg.set_metadata("performative", "inform")
                 msg.set_metadata("task_type", "availability_check")
                 msg.body = room
-                await self.send(msg)
+                return msg
 
-            for peer in self.agent.peer_robots:
-                reply = await self.receive(timeout=3)
-                if reply and reply.get_metadata("task_type") == "availability_response":
+            replies = []
+            for sender, reply in (await self.request_all(missing, availability_check, timeout=3)).items():
+                if reply.get_metadata("task_type") == "availability_response":
                     try:
                         data = json.loads(reply.body)
-                        data["jid"] = str(reply.sender)
-
-                        location = get_location(data["jid"].split("@")[0]) 
-                        if location:
-                            dist = distance_between_points(location[0], location[1],
-                                                          target_coords["x"], target_coords["y"])
-                            data["distance_to_target"] = dist
-                        else:
-                            data["distance_to_target"] = float('inf')
-                        responses.append(data)
+                        data["jid"] = sender
+                        replies.append(data)
                     except Exception as e:
-                        print(f"[{self.agent.name}] Erro ao analisar resposta de localização: {e}")
+                        logger.warning("[%s] Invalid availability reply from %s: %s", self.agent.name, sender, e)
+
+            # All peer poses are fetched at once instead of one lookup per reply
+            locations = await location_service.aget_many(data["jid"].split("@")[0] for data in replies)
+            for data in replies:
+                peer_name = data["jid"].split("@")[0]
+                location = locations.get(peer_name)
+                if location:
+                    # Each peer is measured to its own coordinates for the room
+                    data["distance_to_target"] = facility_map.distance(location, facility_map.room_point(peer_name, room))
+                else:
+                    data["distance_to_target"] = float('inf')
+                responses.append(data)
             return responses
 
         async def handle_help_request(self, msg):
-            try:
-                data = json.loads(msg.body)
-                meds = data.get("medications", {})
-            except Exception:
-                meds = json.loads(msg.body)
-            offer = {}
-            for med, amount in meds.items():
-                available = self.agent.stock.get(med, 0)
-                if available > 0:
-                    offer[med] = available
-            reply = Message(to=str(msg.sender))
+            data = json.loads(msg.body)
+            if "demand" in data:
+                demand = unpack(data["demand"])
+            else:  # older peers send {"medications": {type: amount}}
+                demand = to_vector(data.get("medications", data))
+            # Offer everything held of each requested type
+            offer = np.where(demand > 0, self.agent.stock, 0)
+            reply = msg.make_reply()
             reply.set_metadata("performative", "help_response")
-            reply.body = json.dumps(offer)
+            reply.body = json.dumps(pack(offer))
             await self.send(reply)
 
         async def handle_help_confirm(self, msg):
             task = json.loads(msg.body)
             room = task.get("room")
+            if not await self.accept_work(msg, [task]):
+                return
 
-            self.agent.robot_status = RobotStatus.DELIVERING
-            print(f"[{self.agent.name}] Reservou tarefa {task['ID']} via peer. Estado → DELIVERING")
+            logger.info("[%s] Took task %s from a peer. Status → DELIVERING", self.agent.name, task["ID"])
 
-            if await self.can_fulfill(task["medications"]):
+            if await self.can_fulfill(task["medications"], [room]):
                 await self.deliver_medication(task, room)
             else:
-                print(f"[{self.agent.name}] Foi escolhido para a tarefa {task['ID']} mas não consegue cumprir.")
+                logger.warning("[%s] Picked for task %s but can't fulfil it.", self.agent.name, task["ID"])
                 self.agent.robot_status = RobotStatus.AVAILABLE
+                await self.return_task(task)
 
         async def respond_to_availability_check(self, msg):
             room = msg.body
-            #print(f"[{self.agent.name}] [DEBUG] Mensagem de availability_check recebida de {msg.sender}")
-            #print(f"[{self.agent.name}] [DEBUG] Pedido de availability_check recebido. Estado atual: {self.agent.robot_status}")
             reply = msg.make_reply()
             reply.set_metadata("performative", "inform")
             reply.set_metadata("task_type", "availability_response")
             reply.body = json.dumps({
                 "room": self.agent.room_locations.get(room),
                 "status": self.agent.robot_status.value,
-                "stock": self.agent.stock,
-                "battery": self.agent.battery_level
+                "stock": pack(self.agent.stock),
+                "battery": self.agent.battery_level,
+                # Seconds until the current trip ends (from the robot's goal_active updates), None when idle
+                "eta": goal_tracker.eta(self.agent.robot_name)
             })
-            #print(f"[{self.agent.name}] Responding with status: {self.agent.robot_status.value}")
             await self.send(reply)
 
-        async def go_to_charging_station(self):
+        async def go_to_charging_station(self, charging_coords=None, target=100, reason="emergency"):
+            """Drive to a charger and stay there until the battery reaches `target`.
+
+            With a station the charger and departure time come from its slot booking (a top-up the
+            station can't fit within TOP_UP_MAX_WAIT is skipped); otherwise charging_coords or the
+            nearest charger is used.
+            """
             self.agent.robot_status = RobotStatus.CHARGING
-            charging_coords = CHARGING_STATION_LOCATION
-            topic = f"123/meia/{self.agent.robot_name.lower()}/goal"
-            self.agent.mqtt_goal_succeeded.clear()
-            self.agent.mqtt_client.publish(topic, json.dumps(charging_coords))
-            print(f"[{self.agent.robot_name}] Indo para estação de carregamento em {charging_coords}...")
+            slot = None
+            if self.agent.station_jid:
+                slot = await self.request_charge_slot(target, TOP_UP_MAX_WAIT if reason == "top_up" else None)
+                if slot is False:
+                    logger.info("[%s] No charger free in time, top-up postponed.", self.agent.robot_name)
+                    self.agent.robot_status = RobotStatus.AVAILABLE
+                    return
+            self.agent.charges[reason] += 1
+            if slot:
+                charging_coords = {"x": slot["x"], "y": slot["y"]}
+                if slot["wait"] > 0:
+                    logger.info("[%s] Waiting %.0fs for charger %s.", self.agent.robot_name, slot["wait"], slot["charger"])
+                    await asyncio.sleep(slot["wait"])
+            elif charging_coords is None:
+                pose = location_service.get(self.agent.robot_name)
+                nearest = facility_map.nearest_free_charger(pose) if pose is not None else None
+                charging_coords = nearest[1] if nearest is not None else CHARGING_STATION_LOCATION
+            logger.info("[%s] Heading to the charging station at %s...", self.agent.robot_name, charging_coords)
 
-            print(f"[{self.agent.robot_name}] Esperando goal_succeeded para carregamento...")
-            await asyncio.get_event_loop().run_in_executor(None, self.agent.mqtt_goal_succeeded.wait)
+            try:
+                result = await goal_tracker.run(self.agent.robot_name, charging_coords)
 
-            if self.agent.mqtt_goal_succeeded.is_set():
-                print(f"[{self.agent.robot_name}] Chegou à estação de carregamento!")
-                self.agent.robot_status = RobotStatus.AVAILABLE
-                self.agent.battery_level = 100
+                if result["status"] == GOAL_SUCCEEDED:
+                    logger.debug("[%s] Reached the charging station.", self.agent.robot_name)
+                    await self.wait_for_charge(target)
+                    logger.info("[%s] Charged to %.0f%%.", self.agent.robot_name, self.agent.battery_level)
+                else:
+                    logger.warning("[%s] Did not reach the charging station (%s)", self.agent.robot_name, result["status"])
+            finally:
+                if slot:
+                    done = Message(to=self.agent.station_jid)
+                    done.set_metadata("performative", "inform")
+                    done.set_metadata("task_type", "charge_done")
+                    done.body = json.dumps({"slot_id": slot["slot_id"]})
+                    await self.send(done)
+            self.agent.robot_status = RobotStatus.AVAILABLE
+
+        async def request_charge_slot(self, target, max_wait=None):
+            """Book a charger with the BatteryStationAgent. Returns the slot {"slot_id", "charger", "x",
+            "y", "wait", "duration"}, False if the station refused, or None if it didn't answer."""
+            pose = location_service.get(self.agent.robot_name)
+
+            def charge_request(jid):
+                msg = Message(to=jid)
+                msg.set_metadata("performative", "request")
+                msg.set_metadata("task_type", "charge_request")
+                msg.body = json.dumps({"battery": self.agent.refresh_battery(), "target": target,
+                                       "x": pose[0] if pose else None, "y": pose[1] if pose else None,
+                                       "max_wait": max_wait})
+                return msg
+
+            replies = await self.request_all([self.agent.station_jid], charge_request, timeout=2)
+            reply = replies.get(bare_jid(self.agent.station_jid))
+            if reply is None:
+                return None
+            if reply.get_metadata("performative") != "agree":
+                return False
+            return json.loads(reply.body)
+
+        def reposition(self, spot):
+            """Drive to a staging spot while staying available: the next task's goal simply replaces this one."""
+            pose = location_service.get(self.agent.robot_name)
+            if pose is None:
+                return
+            point = facility_map.nearest_point(spot)
+            metres = facility_map.distance(pose, point)
+            if not energy_model.can_afford(self.agent.robot_name, self.agent.refresh_battery(), metres, distance_to_charger(point)):
+                return
+            self.agent.repositions += 1
+            logger.info("[%s] Waiting for work at %s (%.1f m away).", self.agent.name, spot, metres)
+            asyncio.ensure_future(goal_tracker.run(self.agent.robot_name, spot))
+
+        async def go_to_warehouse(self, warehouse_coords=None, reason="empty"):
+            """Drive to a warehouse (default: the nearest) and refill every type to ROBOT_MAX_MEDICATION."""
+            pose = location_service.get(self.agent.robot_name)
+            nearest = facility_map.nearest_warehouse(pose) if pose is not None else None
+            if nearest is not None and not energy_model.can_afford(
+                    self.agent.robot_name, self.agent.refresh_battery(), nearest[2],
+                    distance_to_charger(f"warehouse:{nearest[0]}")):
+                logger.info("[%s] Battery too low to reach the warehouse, charging first.", self.agent.name)
+                # Planned ahead of the restock, not forced by a flat battery (that is the idle low-battery check)
+                await self.go_to_charging_station(reason="top_up")
+                return
+            self.agent.robot_status = RobotStatus.RESTOCKING
+            self.agent.restocks[reason] += 1
+            if warehouse_coords is None:
+                warehouse_coords = nearest[1] if nearest is not None else WAREHOUSES[0]
+            logger.info("[%s] Heading to the warehouse at %s to restock.", self.agent.name, warehouse_coords)
+            result = await goal_tracker.run(self.agent.robot_name, warehouse_coords)
+            if result["status"] == GOAL_SUCCEEDED:
+                await asyncio.sleep(RESTOCK_DURATION)
+                self.agent.stock = to_vector(ROBOT_MAX_MEDICATION)
+                logger.info("[%s] Restocked: %s", self.agent.name, to_dict(self.agent.stock))
             else:
-                print(f"[{self.agent.robot_name}] Não chegou à estação de carregamento (timeout?)")
+                logger.warning("[%s] Did not reach the warehouse (%s)", self.agent.name, result["status"])
+            self.agent.robot_status = RobotStatus.AVAILABLE
+
+        async def wait_for_charge(self, target):
+            if energy_model.battery(self.agent.robot_name) is None:
+                self.agent.battery_level = 100  # the robot doesn't report its battery, assume a full charge
+                return
+            # Twice the expected charge time, in case the charger is slower than CHARGE_RATE
+            deadline = time.monotonic() + 2 * charge_time(self.agent.refresh_battery(), target) + 10
+            while self.agent.refresh_battery() < target and time.monotonic() < deadline:
+                await asyncio.sleep(1)
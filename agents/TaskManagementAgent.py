@@ -1,111 +1,469 @@
 from spade.agent import Agent
-from spade.behaviour import CyclicBehaviour
 from spade.message import Message
 import asyncio
 import requests
 import json
-from common.config import APP_API_URL
+import logging
+import time
+from collections import deque, OrderedDict
+from itertools import islice
+from functools import partial
+from common.config import APP_API_URL, TASKS_TOPIC, TASK_RECONCILE_INTERVAL, TASK_CLAIM_LIMIT, MANAGER_TASK_LOG_PATH, DISPATCH_WINDOW, MAX_PARALLEL_DISPATCHES, ROBOT_LEASE_DURATION, CHARGE_PLAN_INTERVAL, RESTOCK_PLAN_INTERVAL, STAGING_PLAN_INTERVAL
+from services.taskLog import TaskLog
+from services.taskScheduler import TaskScheduler, percentile, task_error
+from services.mqttService import hub
+from services.conversationService import ConversationBehaviour
 from agents.MedicationRobotAgent import MedicationRobotAgent
+from services.locationService import location_service
+from services.fleetState import fleet_state
+from services.allocator import allocate
+from services.routePlanner import plan_routes
+from services.chargeScheduler import ArrivalRate, plan_top_ups
+from services.restockPlanner import plan_restocks
+from services.demandForecast import RoomDemandForecast
+from services.stagingPlanner import plan_staging
+from services.stockVector import to_vector
+from services.metrics import metrics
 
-print("A iniciar os agentes...")
+logger = logging.getLogger(__name__)
+
+DISPATCH_DECISION = metrics.histogram("dispatch_decision_seconds",
+                                      "Time to choose robots and routes for a window of tasks")
+DISPATCHES_IN_FLIGHT = metrics.gauge("dispatches_in_flight", "Task windows being dispatched concurrently")
+TASKS_DISPATCHED = metrics.counter("tasks_dispatched_total", "Tasks leaving a dispatch pass", ("outcome",))
+QUEUE_DEPTH = metrics.gauge("task_queue_depth", "Tasks queued in the TaskManager", ("state",))
+INTAKE_LATENCY = metrics.histogram("task_intake_latency_seconds", "Time from a task's creation to its intake")
+TASKS_DEAD_LETTERED = metrics.counter("tasks_dead_lettered_total", "Tasks given up on after MAX_TASK_ATTEMPTS failures")
 
 class TaskManagerAgent(Agent):
-    def __init__(self, jid, password, robot_ids):
+    def __init__(self, jid, password, robot_ids, journal_path=MANAGER_TASK_LOG_PATH):
         super().__init__(jid, password)
         self.robot_ids = robot_ids
-        self.reserved_robots = set()
-        self.pending = [] 
+        self.reserved_robots = {}  # robot jid -> time.monotonic() until which a dispatch in flight holds it
+        # Tasks waiting for dispatch or a retry are journaled so they survive a restart of this agent
+        self.journal = TaskLog(journal_path) if journal_path else None
+        recovered = list(self.journal.replay().values()) if self.journal is not None else []
+        if recovered:
+            logger.info("[%s] Recovered %d pending tasks from %s", jid, len(recovered), journal_path)
+        self.scheduler = TaskScheduler(recovered, journal=self.journal)
+        self.incoming = asyncio.Queue()  # tasks pushed by main.py over MQTT
+        # Push and poll can both deliver the same task; recovered ones may still be claimable from the API.
+        # IDs taken in and not delivered yet, oldest first: once delivered, an ID may be submitted again
+        self.active_task_ids = OrderedDict((task["ID"], None) for task in recovered)
+        self.active_task_limit = max(1000, len(recovered))
+        self.intake_latencies_ms = deque(maxlen=1000)
+        # task ID -> {"created_at", "assigned_at", "completed_at"} (time.time()), newest last
+        self.task_timings = OrderedDict()
+        self.last_reconcile = 0.0
+        self.arrivals = ArrivalRate()  # forecast load, for scheduling top-ups into quiet spells
+        self.last_charge_plan = 0.0
+        self.medication_demand = ArrivalRate()  # units per second of each type, for restocking ahead of need
+        self.last_restock_plan = 0.0
+        self.room_demand = RoomDemandForecast()  # where requests come from, to wait near them
+        self.last_staging_plan = 0.0
+        self.http = requests.Session()  # keeps the connection to the API alive between calls
 
     async def setup(self):
-        print(f"[{self.name}] TaskManagerAgent setup.")
+        logger.info("[%s] TaskManagerAgent setup.", self.name)
+        self.loop = asyncio.get_running_loop()
+        hub.subscribe(TASKS_TOPIC, self._on_mqtt_message)
+        fleet_state.add_listener(self._on_robot_state)
         self.add_behaviour(self.TaskFetcherAndDispatcherBehaviour())
 
-    class TaskFetcherAndDispatcherBehaviour(CyclicBehaviour):
+    def _on_mqtt_message(self, msg):
+        try:
+            task = json.loads(msg.payload.decode())
+        except Exception as e:
+            logger.warning("[%s] Invalid task on %s: %s", self.name, msg.topic, e)
+            return
+        # Anyone can publish on the topic; a malformed task must never reach the dispatcher
+        error = task_error(task)
+        if error:
+            logger.warning("[%s] Dropped task on %s: %s", self.name, msg.topic, error)
+            return
+        self.loop.call_soon_threadsafe(self.incoming.put_nowait, task)
+
+    def _on_robot_state(self, state, previous):
+        # A robot turning available is what tasks deferred for lack of one wait for
+        if state.get("status") == "available" and (previous is None or previous.get("status") != "available"):
+            self.loop.call_soon_threadsafe(self.scheduler.wake)
+
+    def requeue(self, task):
+        """Put back a task a robot returned or none could take at all; it is retried after a backoff,
+        or dropped into the scheduler's dead letters once it has failed too often."""
+        if not self.scheduler.retry(task):
+            TASKS_DEAD_LETTERED.inc()
+            # No longer in flight: the same ID may be submitted again
+            self.active_task_ids.pop(task["ID"], None)
+            logger.error("[%s] Task %s failed %d times, giving up on it: %s", self.name, task["ID"], task["attempts"], task)
+
+    def service_time(self, recent=100, default=60.0):
+        """Median seconds a robot spends on a task, from assignment to completion of the last `recent`."""
+        durations = []
+        for timings in islice(reversed(self.task_timings.values()), recent):
+            if "completed_at" in timings and "assigned_at" in timings:
+                durations.append(timings["completed_at"] - timings["assigned_at"])
+        return percentile(durations, 50) if durations else default
+
+    def record_timing(self, task_id, event, when=None, created_at=None):
+        timings = self.task_timings.get(task_id)
+        if timings is None:
+            timings = self.task_timings[task_id] = {}
+            if len(self.task_timings) > 10000:
+                self.task_timings.popitem(last=False)
+        if created_at is not None:
+            timings.setdefault("created_at", created_at)
+        # First assignment and last completion (split tasks complete once per robot)
+        if event == "assigned_at":
+            timings.setdefault(event, when or time.time())
+        else:
+            timings[event] = when or time.time()
+
+
+    class TaskFetcherAndDispatcherBehaviour(ConversationBehaviour):
         async def on_start(self):
-            print(f"[{self.agent.name}] Task dispatcher started. Polling API at {APP_API_URL}")
-            await asyncio.sleep(5)
+            logger.info("[%s] Task dispatcher started. Listening on %s, reconciling with %s every %ss",
+                        self.agent.name, TASKS_TOPIC, APP_API_URL, TASK_RECONCILE_INTERVAL)
+
+        def __init__(self):
+            super().__init__()
+            self.in_flight = set()  # dispatch_window tasks running concurrently
 
         async def run(self):
-            msg = await self.receive(timeout=1)
-            if msg and msg.get_metadata("task_type") == "delivery_failed":
-                failed_task = json.loads(msg.body)
-                print(f"[{self.agent.name}] Tarefa devolvida recebida: {failed_task['ID']}. Reenfileirada.")
-                self.agent.pending.append(failed_task)
+            msg = await self.next_message()
+            while msg:
+                try:
+                    self.handle_message(msg)
+                except Exception as e:
+                    logger.exception("[%s] Error handling %s from %s: %s", self.agent.name,
+                                     msg.get_metadata("task_type"), msg.sender, e)
+                msg = await self.next_message()
 
-            if self.agent.pending:
-                task = self.agent.pending.pop(0)
-                await self.dispatch_task(task)
+            # Before any early return below: under steady intake there is a window to dispatch every cycle
+            await self.run_periodic()
+
+            if len(self.in_flight) >= MAX_PARALLEL_DISPATCHES:
+                await asyncio.wait(self.in_flight, timeout=1, return_when=asyncio.FIRST_COMPLETED)
                 return
 
+            scheduler = self.agent.scheduler
+            fresh = []
+            if not scheduler.has_ready():
+                # Sleep until a task arrives or the next retry is due, whichever is first
+                due = scheduler.next_due_in()
+                try:
+                    fresh.append(await asyncio.wait_for(self.agent.incoming.get(), timeout=min(1, due) if due is not None else 1))
+                except asyncio.TimeoutError:
+                    pass
+            while not self.agent.incoming.empty():
+                fresh.append(self.agent.incoming.get_nowait())
+
+            # New tasks go through the heap too, so a STAT task overtakes queued routine ones
+            for task in self.intake(fresh):
+                scheduler.push(task)
+            window = scheduler.pop_ready(DISPATCH_WINDOW)
+            for state, depth in scheduler.depth().items():
+                QUEUE_DEPTH.set(depth, state=state)
+            if window or fresh:
+                # Runs alongside further windows; robot leases keep them from booking the same robot
+                dispatch = asyncio.ensure_future(self.dispatch_window(window, fresh))
+                self.in_flight.add(dispatch)
+                dispatch.add_done_callback(self.dispatch_done)
+                DISPATCHES_IN_FLIGHT.set(len(self.in_flight))
+
+        async def run_periodic(self):
+            """Reconcile with the API and run the planners, each once its interval is up.
+
+            This is the manager's only behaviour: a failing job is logged and the others still run.
+            """
+            jobs = ((self.agent.last_reconcile, TASK_RECONCILE_INTERVAL, self.reconcile),
+                    (self.agent.last_charge_plan, CHARGE_PLAN_INTERVAL, self.plan_charging),
+                    (self.agent.last_restock_plan, RESTOCK_PLAN_INTERVAL, self.plan_restocking),
+                    (self.agent.last_staging_plan, STAGING_PLAN_INTERVAL, self.plan_staging))
+            for last, interval, job in jobs:
+                if time.monotonic() - last < interval:
+                    continue
+                try:
+                    await job()
+                except Exception as e:
+                    logger.exception("[%s] Error in %s: %s", self.agent.name, job.__name__, e)
+
+        def dispatch_done(self, dispatch):
+            self.in_flight.discard(dispatch)
+            DISPATCHES_IN_FLIGHT.set(len(self.in_flight))
+
+        async def dispatch_window(self, window, fresh):
+            settled = set()
+            try:
+                if window:
+                    await self.dispatch_batch(window, settled)
+            except Exception as e:
+                logger.exception("[%s] Error dispatching %s: %s", self.agent.name, [task["ID"] for task in window], e)
+                # Already popped and journaled as removed: whatever was neither sent nor queued again would be lost
+                for task in window:
+                    if task["ID"] not in settled:
+                        self.agent.requeue(task)
+            if fresh:
+                await self.ack([task["ID"] for task in fresh])
+
+        def handle_message(self, msg):
+            task_type = msg.get_metadata("task_type")
+            if task_type == "delivery_failed":
+                failed_task = json.loads(msg.body)
+                logger.info("[%s] Task %s returned by a robot, queued for retry.", self.agent.name, failed_task["ID"])
+                self.agent.requeue(failed_task)
+            elif task_type == "delivery_complete":
+                self.agent.scheduler.wake()
+                data = json.loads(msg.body)
+                if "task_id" in data:
+                    self.agent.active_task_ids.pop(data["task_id"], None)
+                    self.agent.record_timing(data["task_id"], "completed_at", data.get("completed_at"))
+
+        def intake(self, tasks):
+            """Drop malformed tasks and tasks already in flight (push and poll can both deliver one),
+            and record intake latency. One bad task never stops the others."""
+            new_tasks = []
+            for task in tasks:
+                error = task_error(task)
+                if error:
+                    logger.warning("[%s] Dropped task %r: %s", self.agent.name, task, error)
+                    continue
+                if task["ID"] in self.agent.active_task_ids:
+                    continue
+                self.agent.active_task_ids[task["ID"]] = None
+                if len(self.agent.active_task_ids) > self.agent.active_task_limit:
+                    self.agent.active_task_ids.popitem(last=False)
+                new_tasks.append(task)
+                # Statistics only: a failure here must not cost the task or stop the dispatcher
+                try:
+                    if "created_at" in task:
+                        latency = time.time() - task["created_at"]
+                        self.agent.intake_latencies_ms.append(latency * 1000)
+                        INTAKE_LATENCY.observe(latency)
+                        logger.debug("[%s] Task %s intake latency: %.1f ms", self.agent.name, task["ID"], latency * 1000)
+                    self.agent.medication_demand.record(to_vector(task["medications"]))
+                    self.agent.room_demand.record(task)
+                except Exception as e:
+                    logger.exception("[%s] Error recording intake of task %s: %s", self.agent.name, task["ID"], e)
+            self.agent.arrivals.record(len(new_tasks))
+            return new_tasks
+
+        async def http_call(self, method, path, **kwargs):
+            loop = asyncio.get_running_loop()
+            call = partial(self.agent.http.request, method, f"{APP_API_URL}{path}", **kwargs)
+            return await loop.run_in_executor(None, call)
+
+        async def ack(self, task_ids):
+            # One request for the whole batch instead of a DELETE per task
+            try:
+                response = await self.http_call("POST", "/pending_tasks/ack", json={"ids": task_ids})
+                if response.status_code != 200:
+                    logger.warning("[%s] Failed to ack tasks: %s", self.agent.name, response.status_code)
+            except Exception as e:
+                logger.warning("[%s] Error acking tasks: %s", self.agent.name, e)
+
+        async def reconcile(self):
+            self.agent.last_reconcile = time.monotonic()
+            if len(self.agent.scheduler):
+                logger.info("[%s] Queue: %s", self.agent.name, self.agent.scheduler.stats())
             try:
-                response = requests.get(f"{APP_API_URL}/pending_tasks")
+                response = await self.http_call("POST", "/pending_tasks/claim", params={"limit": TASK_CLAIM_LIMIT})
                 if response.status_code == 200:
-                    tasks = response.json().get("pending_tasks", [])
-                    for task in tasks:
-                        await self.dispatch_task(task)
-                        requests.delete(f"{APP_API_URL}/pending_tasks/{task['ID']}")
+                    tasks = response.json().get("tasks", [])
+                    if tasks:
+                        # Queued by priority with everything else; acked once the scheduler holds them
+                        for task in self.intake(tasks):
+                            self.agent.scheduler.push(task)
+                        # Malformed ones are acked too, or they would be handed out again on every claim
+                        await self.ack([task["ID"] for task in tasks if isinstance(task, dict) and "ID" in task])
+                    if len(tasks) >= TASK_CLAIM_LIMIT:
+                        self.agent.last_reconcile = 0.0  # more may be waiting, claim again next cycle
                 else:
-                    print(f"[{self.agent.name}] Failed to fetch tasks: {response.status_code}")
+                    logger.warning("[%s] Failed to claim tasks: %s", self.agent.name, response.status_code)
             except Exception as e:
-                print(f"[{self.agent.name}] Error fetching tasks: {e}")
+                logger.warning("[%s] Error claiming tasks: %s", self.agent.name, e)
+
+        async def plan_charging(self):
+            """Send idle robots with a low battery to top up while the demand forecast can spare them."""
+            self.agent.last_charge_plan = time.monotonic()
+            reserved = self.agent.reserved_robots
+            jids = {jid.split("@")[0]: jid for jid in self.agent.robot_ids if jid not in reserved}
+            # Tasks backing off after a failed delivery don't count: a charge may be what they are waiting for
+            depth = self.agent.scheduler.depth()
+            plan = plan_top_ups(fleet_state.snapshot(list(jids)), self.agent.arrivals.rate(),
+                                self.agent.service_time(), backlog=depth["ready"] + depth["waiting"])
+            orders = {jids[name]: {"x": charger["x"], "y": charger["y"], "target": target} for name, charger, target in plan}
+            for robot_jid in await self.send_leased("charge", orders):
+                logger.info("[%s] %s tops up to %s%% (low forecast demand)", self.agent.name, robot_jid, orders[robot_jid]["target"])
+
+        async def plan_restocking(self):
+            """Send idle robots to a warehouse before the demand forecast empties one of their types."""
+            self.agent.last_restock_plan = time.monotonic()
+            jids = {jid.split("@")[0]: jid for jid in self.agent.robot_ids if jid not in self.agent.reserved_robots}
+            plan = plan_restocks(fleet_state.snapshot(list(jids)), self.agent.medication_demand.rate(), len(self.agent.robot_ids))
+            orders = {jids[name]: warehouse for name, warehouse in plan}
+            for robot_jid in await self.send_leased("restock", orders):
+                logger.info("[%s] %s restocks at %s", self.agent.name, robot_jid, orders[robot_jid])
 
-            await asyncio.sleep(5)
+        async def plan_staging(self):
+            """Move idle robots to the spots that put them closest to where requests are forecast to come from."""
+            self.agent.last_staging_plan = time.monotonic()
+            if self.agent.scheduler.has_ready() or self.agent.scheduler.depth()["waiting"]:
+                return  # not idle: the robots are about to get work
+            jids = {jid.split("@")[0]: jid for jid in self.agent.robot_ids if jid not in self.agent.reserved_robots}
+            idle = {name: (state["x"], state["y"]) for name, state in fleet_state.snapshot(list(jids)).items()
+                    if state.get("status") == "available" and state.get("x") is not None and state.get("eta") is None}
+            plan = plan_staging(idle, self.agent.room_demand.room_weights())
+            orders = {jids[name]: spot for name, spot in plan}
+            for robot_jid in await self.send_leased("reposition", orders):
+                logger.info("[%s] %s waits for work at %s", self.agent.name, robot_jid, orders[robot_jid])
+
+        async def send_leased(self, task_type, orders):
+            """Reserve the robots in orders ({jid: body}) and send each its order under the lease.
+            Returns the jids that got theirs."""
+            if not orders:
+                return []
+            reserved = self.agent.reserved_robots
+            for robot_jid in orders:
+                reserved[robot_jid] = time.monotonic() + ROBOT_LEASE_DURATION
+            try:
+                leases = await self.reserve(list(orders), duration=ROBOT_LEASE_DURATION, timeout=2)
+                for robot_jid in leases:
+                    msg = Message(to=robot_jid)
+                    msg.set_metadata("performative", "inform")
+                    msg.set_metadata("task_type", task_type)
+                    msg.set_metadata("lease_id", leases[robot_jid])
+                    msg.body = json.dumps(orders[robot_jid])
+                    await self.send(msg)
+                return list(leases)
+            finally:
+                for robot_jid in orders:
+                    reserved.pop(robot_jid, None)
 
-        async def dispatch_task(self, task):
+        def availability_check(self, robot_jid, room):
+            msg = Message(to=robot_jid)
+            msg.set_metadata("performative", "inform")
+            msg.set_metadata("task_type", "availability_check")
+            msg.body = room
+            return msg
+
+        async def collect_availability(self, robot_ids, timeout, rooms=None):
+            """Ask robots for their state at once. Returns the parsed replies, each with its "jid"."""
+            rooms = rooms or {}
+            replies = await self.request_all(robot_ids, lambda jid: self.availability_check(jid, rooms.get(jid, "")), timeout)
             respostas = []
+            for jid, response in replies.items():
+                if response.get_metadata("task_type") != "availability_response":
+                    continue
+                try:
+                    data = json.loads(response.body)
+                    data["jid"] = jid
+                    respostas.append(data)
+                except Exception as e:
+                    logger.warning("[%s] Invalid availability reply from %s: %s", self.agent.name, jid, e)
+            return respostas
+
+        async def fleet_availability(self, robot_ids):
+            """Robot states from the fleet-state table; only robots without a fresh entry are asked.
+
+            Returns (availability replies, {robot name: (x, y)} for robots whose state had a pose).
+            """
+            states = fleet_state.snapshot([jid.split("@")[0] for jid in robot_ids])
+            respostas, poses, ask = [], {}, []
+            for jid in robot_ids:
+                name = jid.split("@")[0]
+                state = states.get(name)
+                if state is None:
+                    ask.append(jid)
+                    continue
+                respostas.append({"jid": jid, "status": state["status"], "stock": state["stock"],
+                                  "battery": state["battery"], "eta": state.get("eta")})
+                if state.get("x") is not None:
+                    poses[name] = (state["x"], state["y"])
+            if ask:
+                # Asked at once; returns when the last one answers or after 3 s overall
+                respostas += await self.collect_availability(ask, timeout=3)
+            return respostas, poses
 
-            
-            for robot_jid in self.agent.robot_ids:
+        async def send_routes(self, routes, leases, assigned_ids):
+            """Send each reserved robot its route under its lease; assigned task IDs go into assigned_ids."""
+            for robot_jid, route in routes.items():
+                route_ids = [task["ID"] for task in route]
+                if robot_jid not in leases:
+                    logger.info("[%s] Robot %s could not be reserved. Added %s to the task pile again", self.agent.name, robot_jid, route_ids)
+                    continue
                 msg = Message(to=robot_jid)
                 msg.set_metadata("performative", "inform")
-                msg.set_metadata("task_type", "availability_check")
-                msg.body = task.get("room", "")  
+                msg.set_metadata("lease_id", leases[robot_jid])
+                if len(route) == 1:
+                    msg.set_metadata("task_type", "delivery")
+                    msg.body = json.dumps(route[0])
+                else:
+                    msg.set_metadata("task_type", "delivery_route")
+                    msg.body = json.dumps({"tasks": route})
                 await self.send(msg)
+                for task in route:
+                    assigned_ids.add(task["ID"])
+                    self.agent.record_timing(task["ID"], "assigned_at", created_at=task.get("created_at"))
+                logger.info("[%s] Assigned tasks %s to %s", self.agent.name, route_ids, robot_jid)
 
-            
-            for _ in self.agent.robot_ids:
-                response = await self.receive(timeout=3)
-                if response and response.get_metadata("task_type") == "availability_response":
-                    try:
-                        data = json.loads(response.body)
-                        data["jid"] = str(response.sender)
-                        respostas.append(data)
-                    except Exception as e:
-                        print(f"[{self.agent.name}] Erro ao processar disponibilidade: {e}")
-
-            
-            respostas_disponiveis = [r for r in respostas if r.get("status") == "available" and r["jid"] not in self.agent.reserved_robots]
-
-            if not respostas_disponiveis:
-                print(f"[{self.agent.name}] No robot is available for task {task['ID']}. Added {task['ID']} to the task pile again.")
-                self.agent.pending.append(task)
-                return
+        async def dispatch_batch(self, tasks, settled=None):
+            """Assign a window of tasks in one pass: one availability lookup, one cost matrix, one reservation round.
 
-            
-            melhor = max(respostas_disponiveis, key=lambda r: r.get("battery", 0))
-            robot_jid = melhor["jid"]
-
-           
-            confirm_msg = Message(to=robot_jid)
-            confirm_msg.set_metadata("performative", "inform")
-            confirm_msg.set_metadata("task_type", "availability_check")
-            confirm_msg.body = task.get("room", "")
-            await self.send(confirm_msg)
-
-            confirm_response = await self.receive(timeout=2)
-            if confirm_response and confirm_response.get_metadata("task_type") == "availability_response":
-                confirm_data = json.loads(confirm_response.body)
-                if confirm_data.get("status") == "available":
-                    msg = Message(to=robot_jid)
-                    msg.set_metadata("performative", "inform")
-                    msg.set_metadata("task_type", "delivery")
-                    msg.body = json.dumps(task)
-                    await self.send(msg)
-                    print(f"[{self.agent.name}] Atribuiu a tarefa {task['ID']} ao robô {robot_jid}")
-                    return
+            settled collects the IDs of the tasks sent to a robot or queued again, so after an
+            exception the caller knows which ones were neither.
+            """
+            settled = set() if settled is None else settled
+            start = time.perf_counter()
+            now = time.monotonic()
+            wakes = self.agent.scheduler.wakes
+            reserved = self.agent.reserved_robots
+            for jid in [jid for jid, until in reserved.items() if until <= now]:
+                del reserved[jid]
+            respostas, poses = await self.fleet_availability([jid for jid in self.agent.robot_ids if jid not in reserved])
+            respostas_disponiveis = [r for r in respostas if r.get("status") == "available" and r["jid"] not in reserved]
 
-            
-            print(f"[{self.agent.name}] Robot {robot_jid} became unavailable. Added {task['ID']} to the task pile again")
-            self.agent.pending.append(task)
+            routes, infeasible = {}, []
+            if respostas_disponiveis:
+                names = [r["jid"].split("@")[0] for r in respostas_disponiveis]
+                missing = [name for name in names if name not in poses]
+                if missing:
+                    poses.update(await location_service.aget_many(missing, timeout=1))
+                assignments, infeasible = allocate(tasks, respostas_disponiveis, poses)
+                # Robots with stock to spare pick up more rooms on the same trip
+                assigned = {task["ID"] for task, _ in assignments}
+                routes, _ = plan_routes(assignments, [t for t in tasks if t["ID"] not in assigned], poses)
+            DISPATCH_DECISION.observe(time.perf_counter() - start)
 
+            assigned_ids = set()
+            if routes:
+                # Other windows in flight skip these robots until their leases are settled
+                for robot_jid in routes:
+                    reserved[robot_jid] = time.monotonic() + ROBOT_LEASE_DURATION
+                try:
+                    leases = await self.reserve(list(routes), duration=ROBOT_LEASE_DURATION, timeout=2)
+                    await self.send_routes(routes, leases, assigned_ids)
+                finally:
+                    settled |= assigned_ids
+                    for robot_jid in routes:
+                        reserved.pop(robot_jid, None)
 
+            tried_ids = {task["ID"] for route in routes.values() for task in route}
+            infeasible_ids = {task["ID"] for task in infeasible}
+            TASKS_DISPATCHED.inc(len(assigned_ids), outcome="assigned")
+            TASKS_DISPATCHED.inc(len(infeasible_ids), outcome="requeued")
+            TASKS_DISPATCHED.inc(len(tasks) - len(assigned_ids) - len(infeasible_ids), outcome="deferred")
+            for task in tasks:
+                if task["ID"] in assigned_ids:
+                    continue
+                if task["ID"] in infeasible_ids:
+                    # Stock, battery or an unknown room: offering it again straight away would spin
+                    logger.info("[%s] No available robot can take task %s. Retrying it later.", self.agent.name, task["ID"])
+                    self.agent.requeue(task)
+                    settled.add(task["ID"])
+                    continue
+                if task["ID"] not in tried_ids:
+                    logger.info("[%s] No robot is available for task %s. Added it to the task pile again.", self.agent.name, task["ID"])
+                # Only short of a free robot: ready again as soon as one is
+                self.agent.scheduler.defer(task, since=wakes)
+                settled.add(task["ID"])
@@ -0,0 +1,219 @@
+"""End-to-end benchmark of the dispatch pipeline: main.py API -> TaskManagerAgent -> MedicationRobotAgents.
+
+Run from the repository root:
+
+    python -m benchmarks.dispatch_benchmark --tasks 200 --rate 2 --robots 10 --embedded-xmpp
+
+Everything runs in this process: the Flask API on a background thread, the in-process MQTT broker,
+the simulated fleet (services.robotSimulator) and the agents. Results are written as JSON
+(--output) so runs can be compared between commits.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dispatch pipeline benchmark")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=2.0, help="mean task arrivals per second (Poisson)")
+    parser.add_argument("--robots", type=int, default=5)
+    parser.add_argument("--speed", type=float, default=2.0, help="simulated robot speed, metres per second")
+    parser.add_argument("--drain", type=float, default=0.5, help="simulated battery use, percent per metre")
+    parser.add_argument("--port", type=int, default=5055, help="port for the task API")
+    parser.add_argument("--timeout", type=float, default=600.0, help="give up waiting for completions after this")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stat-share", type=float, default=0.0, help="fraction of tasks submitted with priority 'stat'")
+    parser.add_argument("--hot-room", type=float, default=0.0, help="fraction of tasks sent to the first room (the rest uniform)")
+    parser.add_argument("--log-level", default="WARNING", help="agent log level (INFO logs every assignment)")
+    parser.add_argument("--embedded-xmpp", action="store_true", help="start SPADE's embedded XMPP server")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--label", default="")
+    return parser.parse_args()
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": values[-1],
+    }
+
+
+def git_commit():
+    try:
+        # The repository this file is in, wherever the benchmark is started from
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL,
+                                       cwd=repo).strip()
+    except Exception:
+        return None
+
+
+def count_messages(agent, counter):
+    """Count every XMPP message an agent receives, by performative/task_type."""
+    dispatch = agent.dispatch
+
+    def counting_dispatch(msg):
+        counter[f"{msg.get_metadata('performative')}/{msg.get_metadata('task_type')}"] += 1
+        return dispatch(msg)
+
+    agent.dispatch = counting_dispatch
+
+
+def start_api(port):
+    from werkzeug.serving import make_server
+    import main as api
+
+    api.pending_tasks.clear()  # drop the demo tasks
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # a line per request is noise at benchmark rates
+    api.start_task_publisher()
+    server = make_server("127.0.0.1", port, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="TaskAPI", daemon=True).start()
+    return server
+
+
+async def submit_tasks(args, rooms, medications):
+    """POST the benchmark tasks with Poisson arrivals. Returns the IDs submitted as STAT."""
+    import requests
+
+    rng = random.Random(args.seed)
+    session = requests.Session()
+    loop = asyncio.get_running_loop()
+    url = f"http://127.0.0.1:{args.port}/pending_tasks"
+    stat_ids = set()
+    for i in range(args.tasks):
+        task = {
+            "ID": f"bench_{i:06d}",
+            "room": rooms[0] if args.hot_room and rng.random() < args.hot_room else rng.choice(rooms),
+            "medications": {m: rng.randint(1, 3) for m in rng.sample(medications, rng.randint(1, 2))},
+            "created_at": time.time(),
+        }
+        if args.stat_share and rng.random() < args.stat_share:  # no extra draw by default, same tasks per seed
+            task["priority"] = "stat"
+        await loop.run_in_executor(None, lambda: session.post(url, json=task))
+        if task.get("priority") == "stat":
+            stat_ids.add(task["ID"])
+        await asyncio.sleep(rng.expovariate(args.rate))
+    return stat_ids
+
+
+async def run(args):
+    from agents.TaskManagementAgent import TaskManagerAgent
+    from agents.MedicationRobotAgent import MedicationRobotAgent
+    from agents.BatteryStation import BatteryStationAgent
+    from common.config import ROBOT_MAX_MEDICATION, BATTERY_STATION_JID
+    from services.fakeBroker import broker
+    from services.mapService import facility_map
+    from services.robotSimulator import FleetSimulator
+    from services.energyModel import energy_model
+
+    # A deployment configures ENERGY_DRAIN_PER_METRE for its robots; here that is the simulated drain
+    energy_model.default_drain = args.drain
+
+    server = start_api(args.port)
+    robot_names = [f"robot{i}" for i in range(1, args.robots + 1)]
+    simulator = FleetSimulator(robot_names, speed=args.speed, drain_per_metre=args.drain, seed=args.seed)
+    simulator.start()
+
+    all_ids = [f"{name}@localhost" for name in robot_names]
+    manager = TaskManagerAgent("taskmanager@localhost", "managerpassword", all_ids)
+    station = BatteryStationAgent(BATTERY_STATION_JID, "stationpassword", robot_names)
+    robots = [MedicationRobotAgent(jid, "robotpassword", [p for p in all_ids if p != jid], name, 100, BATTERY_STATION_JID)
+              for name, jid in zip(robot_names, all_ids)]
+    messages = Counter()
+    for agent in [manager, station] + robots:
+        count_messages(agent, messages)
+    await asyncio.gather(manager.start(), station.start(), *(robot.start() for robot in robots))
+
+    mqtt_before = broker.published
+    start = time.time()
+    stat_ids = await submit_tasks(args, list(facility_map.rooms_for(robot_names[0])), list(ROBOT_MAX_MEDICATION))
+
+    task_ids = {f"bench_{i:06d}" for i in range(args.tasks)}
+    while time.time() - start < args.timeout:
+        done = [t for t in task_ids if "completed_at" in manager.task_timings.get(t, {})]
+        if len(done) == len(task_ids):
+            break
+        await asyncio.sleep(1)
+    elapsed = time.time() - start
+
+    timings = [manager.task_timings.get(t, {}) for t in task_ids]
+    to_assignment = [(t["assigned_at"] - t["created_at"]) * 1000 for t in timings if "assigned_at" in t and "created_at" in t]
+    stat_to_assignment = [(t["assigned_at"] - t["created_at"]) * 1000 for t in (manager.task_timings.get(i, {}) for i in stat_ids)
+                          if "assigned_at" in t and "created_at" in t]
+    to_completion = [t["completed_at"] - t["assigned_at"] for t in timings if "completed_at" in t and "assigned_at" in t]
+    completed = sum(1 for t in timings if "completed_at" in t)
+    xmpp_messages = sum(messages.values())
+    mqtt_messages = broker.published - mqtt_before
+    trips = messages["inform/delivery"] + messages["inform/delivery_route"]
+
+    result = {
+        "label": args.label,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "label")},
+        "elapsed_s": elapsed,
+        "tasks_completed": completed,
+        "tasks_per_minute": completed / elapsed * 60 if elapsed > 0 else 0.0,
+        "intake_to_assignment_ms": percentiles(to_assignment),
+        "stat_intake_to_assignment_ms": percentiles(stat_to_assignment),
+        "assignment_to_completion_s": percentiles(to_completion),
+        "intake_latency_ms": percentiles(list(manager.intake_latencies_ms)),
+        "xmpp_messages_per_task": xmpp_messages / args.tasks if args.tasks else 0.0,
+        "mqtt_messages_per_task": mqtt_messages / args.tasks if args.tasks else 0.0,
+        # A trip is one dispatch from the TaskManager: a single delivery or a multi-stop route
+        "trips_per_task": trips / completed if completed else 0.0,
+        # Multi-stop trips (services.routePlanner); they only form when a window holds more tasks than free robots
+        "route_trips": messages["inform/delivery_route"],
+        "goals_per_task": simulator.goals_received / completed if completed else 0.0,
+        "xmpp_messages_by_type": dict(messages),
+        "queue": manager.scheduler.stats(),
+        # Top-ups are planned into lulls; emergency charges are robots that ran low regardless
+        "charges": {kind: sum(robot.charges[kind] for robot in robots) for kind in ("top_up", "emergency")},
+        "goals_aborted": simulator.goals_aborted,
+        # Planned restocks come from the demand forecast; "empty" ones from a robot that ran out of a type
+        "restocks": {kind: sum(robot.restocks[kind] for robot in robots) for kind in ("planned", "empty")},
+        "repositions": sum(robot.repositions for robot in robots),
+        "help_confirms": messages["help_confirm/None"],  # delegated or split tasks
+        "charger_slots": station.slots.stats(),
+    }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps({k: result[k] for k in ("tasks_completed", "tasks_per_minute",
+                                              "intake_to_assignment_ms", "assignment_to_completion_s",
+                                              "xmpp_messages_per_task")}, indent=2))
+    print(f"Results written to {args.output}")
+
+    for agent in [manager, station] + robots:
+        await agent.stop()
+    simulator.stop()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Everything talks through the in-process broker and the local API started above
+    os.environ["MQTT_BROKER"] = "inprocess"
+    os.environ["APP_API_URL"] = f"http://127.0.0.1:{args.port}"
+    from common.config import LOG_FORMAT
+    logging.basicConfig(level=args.log_level, format=LOG_FORMAT)
+    import spade
+    spade.run(run(args), embedded_xmpp_server=args.embedded_xmpp)
@@ -1,7 +1,157 @@
+import os
 from enum import Enum
 
 ROBOT_MAX_MEDICATION = {"Type1": 20, "Type2": 20, "Type3": 20, "Type4": 20}
-APP_API_URL = "http://localhost:5001"
+# Fixed index of every medication type in stock/demand vectors (services.stockVector)
+MEDICATION_TYPES = list(ROBOT_MAX_MEDICATION)
+APP_API_URL = os.environ.get("APP_API_URL", "http://localhost:5001")
+# Below this battery percentage a robot goes to charge instead of taking tasks
+LOW_BATTERY_THRESHOLD = 20
+
+# ---- MQTT ----
+# Override with the MQTT_BROKER / MQTT_PORT environment variables, e.g. MQTT_BROKER=localhost
+# or MQTT_BROKER=inprocess to use services.fakeBroker for offline runs
+MQTT_BROKER = os.environ.get("MQTT_BROKER", "broker.hivemq.com")
+MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
+# QoS for everything published through services.mqttService.hub
+MQTT_QOS = int(os.environ.get("MQTT_QOS", 0))
+LOCATION_TOPIC = "123/meia/+/location"
+# Poses older than this (seconds) are considered stale
+LOCATION_MAX_AGE = 10.0
+# Seconds a robot gets to reach a navigation goal before the goal is given up
+GOAL_TIMEOUT = 300.0
+# Every robot publishes its versioned state (status, stock, battery, pose) here, on change and on a heartbeat
+FLEET_STATE_TOPIC = "123/meia/+/state"
+FLEET_STATE_HEARTBEAT = 5.0
+# Entries not refreshed for this long (seconds, ~3 missed heartbeats) are ignored
+FLEET_STATE_MAX_AGE = 15.0
+# main.py publishes every new task here so the TaskManager doesn't have to poll
+TASKS_TOPIC = "123/meia/tasks/new"
+
+# Fallback poll of GET /pending_tasks for tasks missed on TASKS_TOPIC (seconds)
+TASK_RECONCILE_INTERVAL = 30.0
+# POST /pending_tasks/claim: max tasks per call and how long (seconds) a claim holds before the task is handed out again
+TASK_CLAIM_LIMIT = 20
+TASK_CLAIM_LEASE = 60.0
+# Max tasks the TaskManager assigns together in one allocation pass
+DISPATCH_WINDOW = 20
+# Max rooms one robot visits in a single multi-stop trip
+MAX_ROUTE_STOPS = 4
+# Up to this many offering peers a split task is solved exactly, above it greedily
+SPLIT_EXACT_MAX_PEERS = 12
+# Seconds a robot stays reserved for a dispatcher that hasn't sent the work yet
+ROBOT_LEASE_DURATION = 10.0
+# Task windows the TaskManager dispatches concurrently
+MAX_PARALLEL_DISPATCHES = 4
+
+# ---- Task scheduling ----
+# POST /pending_tasks "priority" values, most urgent first; tasks without one are routine
+TASK_PRIORITIES = {"stat": 0, "urgent": 1, "routine": 2}
+DEFAULT_TASK_PRIORITY = "routine"
+# Seconds of waiting worth one priority level, so routine tasks can't starve behind STAT ones
+PRIORITY_AGING = 120.0
+# A task with a "deadline" (epoch seconds) ranks at least as if it had arrived this long before it
+DEADLINE_LEAD = 300.0
+# Retry delay after a failed dispatch: base * 2^(attempts - 1) seconds, capped
+RETRY_BACKOFF_BASE = 2.0
+RETRY_BACKOFF_MAX = 60.0
+# Failed attempts after which a task is dead-lettered instead of retried (~5 minutes of backoff)
+MAX_TASK_ATTEMPTS = 10
+
+# ---- Energy and charging ----
+# Battery percent a robot uses per metre until its own reports refine it (services.energyModel)
+ENERGY_DRAIN_PER_METRE = 0.5
+# Weight of each new per-metre sample in a robot's drain estimate
+ENERGY_SMOOTHING = 0.2
+# Percent a robot must still have after a trip and the drive on to the nearest charger
+BATTERY_RESERVE = 10
+# Idle robots below this percent top up during forecast lulls, to this percent
+TOP_UP_THRESHOLD = 60
+TOP_UP_TARGET = 95
+# Percent per second a charger adds
+CHARGE_RATE = 5.0
+# How often (seconds) the TaskManager plans top-ups, and robots kept free beyond the forecast need
+CHARGE_PLAN_INTERVAL = 15.0
+CHARGE_SPARE_ROBOTS = 1
+# Metres per second robots are assumed to drive at, for travel-time estimates
+NAV_SPEED = 0.5
+# BatteryStationAgent that books charger slots; robots started without it pick the nearest charger
+BATTERY_STATION_JID = "batterystation@localhost"
+# A top-up is skipped instead of queued when the robot would wait longer than this (seconds) for a charger
+TOP_UP_MAX_WAIT = 30.0
+# Time constant (seconds) of the task arrival-rate forecast
+DEMAND_HORIZON = 300.0
+
+# ---- Restocking ----
+# Robots refill at a warehouse before their stock of a type won't cover this many seconds of forecast demand
+RESTOCK_HORIZON = 300.0
+# How often (seconds) the TaskManager plans restocks, and seconds spent loading at the warehouse
+RESTOCK_PLAN_INTERVAL = 15.0
+RESTOCK_DURATION = 5.0
+
+# ---- Demand forecast and staging ----
+# Weight of each new day in the per-room, per-hour demand EWMA (services.demandForecast)
+FORECAST_SMOOTHING = 0.3
+# How often (seconds) the TaskManager sends idle robots to staging spots, and the smallest move worth
+# making (metres; the robots' own points for one room lie up to ~2.5 m apart)
+STAGING_PLAN_INTERVAL = 30.0
+STAGING_MIN_MOVE = 3.0
+
+# ---- Logging and metrics ----
+# Level of the agents' and services' logs (DEBUG also logs every message, goal and lookup)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# start_agents.py serves Prometheus metrics (services.metrics) on this port at /metrics; 0 disables it.
+# main.py serves its own at /metrics on the API port.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+
+# Append-only journals so queued tasks survive a restart (None keeps them in memory only)
+TASK_LOG_PATH = None          # e.g. "pending_tasks.log", used by main.py
+MANAGER_TASK_LOG_PATH = None  # e.g. "taskmanager_pending.log", used by TaskManagerAgent
+
+# ---- FIXED POINTS (see locations.txt) ----
+CHARGING_STATIONS = [{"x": 1.43, "y": -11.21}, {"x": -1.84, "y": -11.07}]
+CHARGING_STATION_LOCATION = CHARGING_STATIONS[0]
+WAREHOUSES = [{"x": 1.14, "y": -19.19}, {"x": -2.29, "y": -19.07}]
+
+# ---- ROOM COORDS PER ROBOT ----
+ROBOT_LOCATIONS = {
+    "robot1": {
+        "Room A-101": {"x": -9.0, "y": 0.5},
+        "Room B-202": {"x": 9.0, "y": -5.0},
+        "Room C-303": {"x": -9.0, "y": -16.0}
+    },
+    "robot2": {
+        "Room A-101": {"x": -9.0, "y": -2.0},
+        "Room B-202": {"x": 9.0, "y": -3.0},
+        "Room C-303": {"x": -9.0, "y": -18.0}
+    },
+    "robot3": {
+        "Room A-101": {"x": -9.0, "y": -4.0},
+        "Room B-202": {"x": 9.0, "y": -8.0},
+        "Room C-303": {"x": -9.0, "y": -20.0}
+    }
+}
+
+
+# ROBOT_LOCATIONS = {
+#     "robot1": {
+#         "Room A-101": {"x": 3.0, "y": 2.0},
+#         "Room B-202": {"x": 9.0, "y": -5.0},
+#         "Room C-303": {"x": -9.0, "y": -16.0}
+#     },
+#     "robot2": {
+#         "Room A-101": {"x": -9.0, "y": -2.0},
+#         "Room B-202": {"x": -3.0, "y": 1.0},
+#         "Room C-303": {"x": -9.0, "y": -18.0}
+#     },
+#     "robot3": {
+#         "Room A-101": {"x": -9.0, "y": -4.0},
+#         "Room B-202": {"x": 9.0, "y": -8.0},
+#         "Room C-303": {"x": 0.0, "y": 2.0}
+#     }
+# }
+
 
 class TaskStatus(Enum):
     PENDING = "pending"
@@ -12,4 +162,6 @@ class TaskStatus(Enum):
 class RobotStatus(Enum):
     AVAILABLE = "available"
     DELIVERING = "delivering"
-    CHARGING = "charging"
\ No newline at end of file
+    CHARGING = "charging"
+    RESERVED = "reserved"  # leased to a dispatcher, work on its way
+    RESTOCKING = "restocking"
@@ -1,8 +1,20 @@
-from flask import Flask, request
+from flask import Flask, Response, g, request
+import logging
+import time
+from common.config import TASKS_TOPIC, TASK_CLAIM_LEASE, TASK_LOG_PATH, LOG_LEVEL, LOG_FORMAT
+from services.taskStore import TaskStore
+from services.taskLog import TaskLog
+from services.taskScheduler import task_error
+from services.mqttService import hub
+from services.metrics import metrics, CONTENT_TYPE
 
 app = Flask(__name__)
 
-pending_tasks = [
+# Labelled by route pattern (not the raw path), so task IDs don't add series
+HTTP_LATENCY = metrics.histogram("http_request_duration_seconds", "Time spent in the API's handlers",
+                                 ("method", "endpoint", "status"))
+
+initial_tasks = [
     {"medications": {"Type1": 5, "Type2": 3}, "room": "Room B-202", "ID": "task_002"},
     {"medications": {"Type1": 1, "Type2": 1, "Type3": 1, "Type4": 1}, "room": "Room A-101", "ID": "task_001"},
     {"medications": {"Type3": 1, "Type4": 1}, "room": "Room C-303", "ID": "task_003"},
@@ -11,6 +23,12 @@ pending_tasks = [
 
 ]
 
+if TASK_LOG_PATH:
+    # The journal already holds whatever was queued before the restart
+    pending_tasks = TaskStore(journal=TaskLog(TASK_LOG_PATH))
+else:
+    pending_tasks = TaskStore(initial_tasks)
+
 # pending_tasks = [
 #     {"medications": {"Type1": 5, "Type2": 3}, "room": "Room C-303", "ID": "task_001"}
 # ]
@@ -46,36 +64,85 @@ pending_tasks = [
 # ]
 
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    if "request_start" in g:
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - g.request_start, method=request.method,
+                             endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
 @app.route('/pending_tasks', methods=['GET'])
 def get_pending_tasks():
-    return {'pending_tasks': pending_tasks}, 200
+    tasks = pending_tasks.list(room=request.args.get('room'), medication=request.args.get('medication'))
+    return {'pending_tasks': tasks}, 200
+
+@app.route('/pending_tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    task = pending_tasks.get(task_id)
+    if task is None:
+        return {"error": f"Task '{task_id}' not found."}, 404
+    return task, 200
 
 @app.route('/pending_tasks/<task_id>', methods=['DELETE'])
 def delete_task(task_id):
-    global pending_tasks
-    original_length = len(pending_tasks)
-    pending_tasks = [task for task in pending_tasks if task['ID'] != task_id]
-    if len(pending_tasks) < original_length:
+    if pending_tasks.remove(task_id) is not None:
         return {"message": f"Task '{task_id}' deleted successfully."}, 200
     else:
         return {"error": f"Task '{task_id}' not found."}, 404
     
 @app.route('/pending_tasks/', methods=['DELETE'])
 def delete_all_tasks():
-    global pending_tasks
-    pending_tasks.clear()  # Empties the list in-place
+    pending_tasks.clear()
     return {"message": "All pending tasks deleted successfully."}, 200
 
 
+@app.route('/pending_tasks/claim', methods=['POST'])
+def claim_tasks():
+    """Hand out up to `limit` unclaimed tasks and lease them for `lease` seconds. Ack them with /pending_tasks/ack."""
+    limit = request.args.get('limit', default=10, type=int)
+    lease = request.args.get('lease', default=TASK_CLAIM_LEASE, type=float)
+    claimed = pending_tasks.claim(limit, lease)
+    return {'tasks': claimed, 'lease_expires_at': time.time() + lease}, 200
+
+@app.route('/pending_tasks/ack', methods=['POST'])
+def ack_tasks():
+    body = request.get_json(silent=True) or {}
+    task_ids = body.get('ids')
+    if not isinstance(task_ids, list):
+        return {"error": "Invalid ack format. Required: ids (list of task IDs)."}, 400
+    acked, missing = pending_tasks.ack(task_ids)
+    return {'acked': acked, 'missing': missing}, 200
+
+
 @app.route('/pending_tasks', methods=['POST'])
 def add_task():
-    new_task = request.get_json()
-    if not new_task or 'ID' not in new_task or 'medications' not in new_task or 'room' not in new_task:
-        return {"error": "Invalid task format. Required: ID, medications, room."}, 400
-    if any(task['ID'] == new_task['ID'] for task in pending_tasks):
+    new_task = request.get_json(silent=True)
+    # Optional: priority (stat, urgent or routine), deadline and created_at (epoch seconds)
+    error = task_error(new_task)
+    if error:
+        return {"error": error}, 400
+    new_task.setdefault('created_at', time.time())
+    if not pending_tasks.add(new_task):
         return {"error": f"Task with ID '{new_task['ID']}' already exists."}, 400
-    pending_tasks.append(new_task)
+    # Push the task to the TaskManager; if this is lost the reconciliation poll still finds it
+    hub.publish(TASKS_TOPIC, new_task)
     return {"message": f"Task '{new_task['ID']}' added successfully."}, 201
 
+def start_task_publisher():
+    # Connects in the background; while the broker is unreachable tasks are only found by polling
+    hub.start()
+
 if __name__ == '__main__':
-    app.run(port=5001)
\ No newline at end of file
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+    start_task_publisher()
+    app.run(port=5001)
@@ -0,0 +1,101 @@
+import numpy as np
+from common.config import MEDICATION_TYPES, LOW_BATTERY_THRESHOLD, BATTERY_RESERVE
+from services.mapService import facility_map
+from services.stockVector import demand_vector, stock_matrix, covers
+from services.energyModel import energy_model
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy is optional, fall back to the greedy assignment
+    linear_sum_assignment = None
+
+# Distance used when a robot's pose is unknown, so it can still be picked (just not preferred)
+UNKNOWN_DISTANCE = 1000.0
+# Extra cost per missing battery percent, in metres: 80% less battery ~ 4 m further away
+BATTERY_WEIGHT = 0.05
+_INFEASIBLE_COST = 1e9
+
+
+def cost_matrix(tasks, robots, poses, fmap=facility_map, energy=energy_model):
+    """Cost of giving each task to each robot: tasks x robots array, np.inf where impossible.
+
+    robots: availability replies ({"jid", "stock", "battery", ...}), stock packed or as a dict.
+    poses: robot name -> (x, y) or None, as returned by location_service.aget_many.
+    fmap: FacilityMap giving each robot's own room points and the travel cost to them.
+    energy: EnergyModel; a robot with a known pose must be able to drive to the room and on to
+    the nearest charger at its own drain rate and still keep BATTERY_RESERVE.
+    """
+    names = [r["jid"].split("@")[0] for r in robots]
+
+    demands = [demand_vector(task["medications"]) for task in tasks]
+    stocked = np.array([d is not None for d in demands], dtype=bool)  # False: asks for an unknown type
+    demand = np.array([d if d is not None else np.zeros(len(MEDICATION_TYPES)) for d in demands],
+                      dtype=int).reshape(len(tasks), len(MEDICATION_TYPES))
+    stock = stock_matrix([r.get("stock") for r in robots])
+    battery = np.array([r.get("battery", 0) for r in robots], dtype=float)
+    pose = np.array([poses.get(name) or (np.nan, np.nan) for name in names], dtype=float).reshape(-1, 2)
+
+    # Room coordinates differ per robot, so each (task, robot) pair has its own map point
+    target = np.array([[fmap.index.get(fmap.room_point(name, task.get("room")), -1) for name in names]
+                       for task in tasks], dtype=int).reshape(len(tasks), len(robots))
+
+    known = ~np.isnan(pose).any(axis=1)
+    to_points = np.full((len(robots), len(fmap.names)), UNKNOWN_DISTANCE)
+    if known.any():
+        to_points[known] = fmap.distances_from_many(pose[known])
+    distance = to_points[np.arange(len(robots))[None, :], np.maximum(target, 0)]
+
+    cost = distance + BATTERY_WEIGHT * (100 - battery)[None, :]
+    feasible = covers(stock[None, :, :], demand[:, None, :]) & stocked[:, None]
+    feasible &= target >= 0
+    feasible &= np.isfinite(distance)
+    feasible &= (battery >= LOW_BATTERY_THRESHOLD)[None, :]
+
+    if len(fmap.chargers):
+        to_charger = fmap.cost[np.maximum(target, 0)][:, :, fmap.chargers].min(axis=2)
+    else:
+        to_charger = np.zeros_like(distance)
+    drain = np.array([energy.drain(name) for name in names], dtype=float)
+    enough = battery[None, :] - drain[None, :] * (distance + to_charger) >= BATTERY_RESERVE
+    feasible &= enough | ~known[None, :]  # without a pose only the threshold above applies
+    return np.where(feasible, cost, np.inf)
+
+
+def assign(cost):
+    """Minimum-cost one-to-one assignment of tasks (rows) to robots (columns).
+
+    Uses the Hungarian algorithm when scipy is installed, otherwise a greedy pass over the
+    cheapest pairs. Returns [(task index, robot index)] for feasible pairs only.
+    """
+    if cost.size == 0:
+        return []
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(np.where(np.isfinite(cost), cost, _INFEASIBLE_COST))
+        return [(int(i), int(j)) for i, j in zip(rows, cols) if np.isfinite(cost[i, j])]
+
+    pairs = []
+    used_tasks, used_robots = set(), set()
+    order = np.argsort(cost, axis=None)
+    for flat in order:
+        i, j = np.unravel_index(flat, cost.shape)
+        if not np.isfinite(cost[i, j]):
+            break
+        if i in used_tasks or j in used_robots:
+            continue
+        pairs.append((int(i), int(j)))
+        used_tasks.add(i)
+        used_robots.add(j)
+        if len(used_tasks) == cost.shape[0] or len(used_robots) == cost.shape[1]:
+            break
+    return pairs
+
+
+def allocate(tasks, robots, poses, fmap=facility_map, energy=energy_model):
+    """Assign a window of tasks to available robots in one pass.
+
+    Returns ([(task, robot reply)], [tasks none of the robots could take at all]); the tasks in
+    neither only lost out to others for a robot.
+    """
+    cost = cost_matrix(tasks, robots, poses, fmap, energy)
+    infeasible = [task for task, row in zip(tasks, cost) if not np.isfinite(row).any()]
+    return [(tasks[i], robots[j]) for i, j in assign(cost)], infeasible
@@ -0,0 +1,78 @@
+import math
+import time
+from common.config import TOP_UP_THRESHOLD, TOP_UP_TARGET, CHARGE_RATE, CHARGE_SPARE_ROBOTS, DEMAND_HORIZON
+from services.mapService import facility_map
+
+
+class ArrivalRate:
+    """Task arrival rate (tasks per second), exponentially weighted over `horizon` seconds.
+
+    Each arrival adds 1/horizon and the rate decays by exp(-dt/horizon) in between, so a burst
+    raises it at once and a quiet spell brings it back towards zero within a few horizons.
+    record() also takes numpy vectors (e.g. demand vectors), making the rate a vector per type.
+    """
+
+    def __init__(self, horizon=DEMAND_HORIZON):
+        self.horizon = horizon
+        self._rate = 0.0
+        self._updated = None
+
+    def _decay(self, now):
+        if self._updated is not None:
+            self._rate *= math.exp(-(now - self._updated) / self.horizon)
+        self._updated = now
+
+    def record(self, count=1, now=None):
+        self._decay(time.monotonic() if now is None else now)
+        self._rate += count / self.horizon
+
+    def rate(self, now=None):
+        self._decay(time.monotonic() if now is None else now)
+        return self._rate
+
+
+def robots_needed(arrival_rate, service_time, backlog=0, spare=CHARGE_SPARE_ROBOTS):
+    """Robots that must stay available: the forecast load (Little's law: rate x time per task),
+    every queued task, and `spare` on top."""
+    return math.ceil(arrival_rate * service_time) + backlog + spare
+
+
+def plan_top_ups(states, arrival_rate, service_time, backlog=0, fmap=facility_map,
+                 threshold=TOP_UP_THRESHOLD, target=TOP_UP_TARGET, spare=CHARGE_SPARE_ROBOTS):
+    """Pick idle robots to top up now, while the forecast says they won't be missed.
+
+    states: robot name -> fleet-state entry ({"status", "battery", "x", "y", ...}).
+    Robots beyond robots_needed() are sent, lowest battery first, each to the nearest charger
+    that no charging robot is parked at and nobody else was sent to.
+    Returns [(robot name, charger {"x", "y"}, target percent)].
+    """
+    available = [name for name, s in states.items() if s.get("status") == "available"]
+    spare_robots = len(available) - robots_needed(arrival_rate, service_time, backlog, spare)
+    if spare_robots <= 0:
+        return []
+
+    occupied = set()
+    for state in states.values():
+        if state.get("status") == "charging" and state.get("x") is not None:
+            nearest = fmap.nearest_free_charger((state["x"], state["y"]))
+            if nearest is not None:
+                occupied.add(nearest[0])
+
+    low = sorted((name for name in available
+                  if states[name].get("battery") is not None and states[name]["battery"] < threshold
+                  and states[name].get("x") is not None),
+                 key=lambda name: states[name]["battery"])
+    plan = []
+    for name in low[:spare_robots]:
+        state = states[name]
+        charger = fmap.nearest_free_charger((state["x"], state["y"]), occupied)
+        if charger is None:
+            break  # every charger is taken
+        occupied.add(charger[0])
+        plan.append((name, charger[1], target))
+    return plan
+
+
+def charge_time(battery, target=TOP_UP_TARGET, rate=CHARGE_RATE):
+    """Seconds parked at a charger to go from `battery` to `target` percent."""
+    return max(0.0, target - battery) / rate
@@ -0,0 +1,86 @@
+import itertools
+import time
+from common.config import CHARGE_RATE, NAV_SPEED
+from services.mapService import facility_map
+from services.chargeScheduler import charge_time
+from services.taskScheduler import percentile
+
+
+class ChargerSlots:
+    """Bookings of every charger as back-to-back time slots.
+
+    A booking goes to the charger where the robot can start charging soonest: when the charger's
+    last booking ends or when the robot gets there (at NAV_SPEED), whichever is later. The slot
+    lasts as long as charging from the robot's battery to its target takes at CHARGE_RATE, so
+    the queue at each charger is known in seconds, not just in robots. Times are time.monotonic().
+    """
+
+    def __init__(self, fmap=facility_map, charge_rate=CHARGE_RATE, speed=NAV_SPEED):
+        self.fmap = fmap
+        self.chargers = [{"x": float(x), "y": float(y)} for x, y in fmap.coords[fmap.chargers]]
+        self.charge_rate = charge_rate
+        self.speed = speed
+        self._ids = itertools.count(1)
+        self._bookings = {i: [] for i in range(len(self.chargers))}  # charger -> bookings by start
+        self._by_id = {}
+        self.waits = []  # seconds each booked robot waits at its charger before its slot starts
+
+    def _expire(self, now):
+        for charger, bookings in self._bookings.items():
+            while bookings and bookings[0]["end"] <= now:
+                self._by_id.pop(bookings.pop(0)["slot_id"], None)
+
+    def free_at(self, charger, now=None):
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        bookings = self._bookings[charger]
+        return bookings[-1]["end"] if bookings else now
+
+    def book(self, robot, battery, target, position=None, max_wait=None, now=None):
+        """Book the charger where `robot` starts charging soonest. Returns the booking
+        {"slot_id", "robot", "charger", "x", "y", "start", "end", "wait"}, or None when every
+        charger would make it wait longer than max_wait seconds. A robot holds one booking at a time."""
+        now = time.monotonic() if now is None else now
+        for booking in [b for b in self._by_id.values() if b["robot"] == robot]:
+            self.release(booking["slot_id"])
+        if not self.chargers:
+            return None
+        travel = self.fmap.distances_from(position)[self.fmap.chargers] / self.speed if position is not None \
+            else [0.0] * len(self.chargers)
+        best = None
+        for charger in range(len(self.chargers)):
+            arrive = now + float(travel[charger])
+            start = max(arrive, self.free_at(charger, now))
+            if best is None or (start, arrive) < (best[1], best[2]):
+                best = (charger, start, arrive)
+        charger, start, arrive = best
+        wait = start - arrive
+        if max_wait is not None and wait > max_wait:
+            return None
+        booking = {"slot_id": f"slot-{next(self._ids)}", "robot": robot, "charger": charger,
+                   "x": self.chargers[charger]["x"], "y": self.chargers[charger]["y"],
+                   "start": start, "end": start + charge_time(battery, target, self.charge_rate), "wait": wait}
+        self._bookings[charger].append(booking)
+        self._by_id[booking["slot_id"]] = booking
+        self.waits.append(wait)
+        del self.waits[:-1000]
+        return booking
+
+    def release(self, slot_id):
+        """The robot left its charger or gave up the slot. Later bookings keep their times; if none
+        follow, the charger is free for new ones straight away."""
+        booking = self._by_id.pop(slot_id, None)
+        if booking is None:
+            return False
+        self._bookings[booking["charger"]].remove(booking)
+        return True
+
+    def stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        return {
+            "booked": {i: len(b) for i, b in self._bookings.items()},
+            "backlog_s": {i: max(0.0, self.free_at(i, now) - now) for i in self._bookings},
+            "wait_p50_s": percentile(self.waits, 50),
+            "wait_p95_s": percentile(self.waits, 95),
+        }
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from spade.behaviour import CyclicBehaviour
+from spade.message import Message
+from common.config import ROBOT_LEASE_DURATION
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_SENT = metrics.counter("agent_messages_sent_total", "XMPP messages sent",
+                                ("agent", "performative", "task_type"))
+MESSAGES_RECEIVED = metrics.counter("agent_messages_received_total", "XMPP messages received",
+                                    ("agent", "performative", "task_type"))
+RECEIVE_WAIT = metrics.histogram("agent_receive_wait_seconds", "Time spent waiting in receive()",
+                                 ("agent", "outcome"))
+
+
+def new_thread_id(prefix="conv"):
+    return f"{prefix}-{uuid.uuid4().hex[:12]}"
+
+
+def bare_jid(jid):
+    return str(jid).split("/")[0]
+
+
+class Lease:
+    """A robot's single reservation slot: held by one requester until released or expired.
+
+    Granting and checking happen on the robot's own behaviour, one message at a time, so a
+    grant is atomic: two dispatchers can never both hold the same robot.
+    """
+
+    def __init__(self):
+        self.holder = None
+        self.lease_id = None
+        self.expires = 0.0
+
+    def active(self):
+        return self.lease_id is not None and time.monotonic() < self.expires
+
+    def grant(self, holder, lease_id, duration):
+        """Take the lease, or extend it when the same lease is proposed again."""
+        if self.active() and (self.holder, self.lease_id) != (holder, lease_id):
+            return False
+        self.holder, self.lease_id, self.expires = holder, lease_id, time.monotonic() + duration
+        return True
+
+    def matches(self, lease_id):
+        return self.active() and self.lease_id == lease_id
+
+    def release(self, lease_id=None):
+        if lease_id is None or lease_id == self.lease_id:
+            self.holder, self.lease_id, self.expires = None, None, 0.0
+
+
+class ConversationBehaviour(CyclicBehaviour):
+    """CyclicBehaviour with correlated request/response over the behaviour's mailbox.
+
+    request_all() tags every request with one `thread` id and collects the replies that
+    echo it (repliers use msg.make_reply(), which keeps the thread). Several conversations
+    may be open at once (e.g. dispatches running as separate tasks): whichever coroutine
+    reads a reply hands it to the conversation it belongs to. Anything else that arrives
+    meanwhile is kept for next_message(), so run() never loses a message.
+
+    Every message sent and received is counted per performative and task type, and the time
+    spent waiting in receive() is recorded (services.metrics).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.deferred = deque()
+        self.closed_threads = deque(maxlen=200)
+        self.reply_latency = {}  # bare jid -> deque of reply times in seconds (timeouts not included)
+        self._inboxes = {}  # thread of an open conversation -> asyncio.Queue of its replies
+
+    async def send(self, msg):
+        MESSAGES_SENT.inc(agent=self.agent.name, performative=msg.get_metadata("performative"),
+                          task_type=msg.get_metadata("task_type"))
+        await super().send(msg)
+
+    async def receive(self, timeout=None):
+        start = time.perf_counter()
+        msg = await super().receive(timeout=timeout)
+        RECEIVE_WAIT.observe(time.perf_counter() - start, agent=self.agent.name,
+                             outcome="timeout" if msg is None else "message")
+        if msg is not None:
+            MESSAGES_RECEIVED.inc(agent=self.agent.name, performative=msg.get_metadata("performative"),
+                                  task_type=msg.get_metadata("task_type"))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[%s] <- %s %s/%s thread=%s", self.agent.name, bare_jid(msg.sender),
+                             msg.get_metadata("performative"), msg.get_metadata("task_type"), msg.thread)
+        return msg
+
+    async def _route(self, msg):
+        """File msg under its open conversation, drop it if the conversation is over, else defer it."""
+        if msg.thread and msg.thread in self._inboxes:
+            self._inboxes[msg.thread].put_nowait(msg)
+        elif msg.thread and msg.thread in self.closed_threads:
+            await self._late_reply(msg)
+        else:
+            self.deferred.append(msg)
+
+    async def _late_reply(self, msg):
+        # A lease granted after we stopped waiting would hold the robot until it expires
+        if msg.get_metadata("performative") == "accept-proposal" and msg.get_metadata("task_type") == "reservation":
+            await self.release(bare_jid(msg.sender), json.loads(msg.body).get("lease_id"))
+
+    async def next_message(self, timeout=None):
+        if self.deferred:
+            return self.deferred.popleft()
+        while True:
+            msg = await self.receive(timeout=timeout)
+            if msg is not None and msg.thread:
+                if msg.thread in self._inboxes:
+                    self._inboxes[msg.thread].put_nowait(msg)
+                    continue
+                # Late answer to a conversation that already hit its deadline
+                if msg.thread in self.closed_threads:
+                    await self._late_reply(msg)
+                    continue
+            return msg
+
+    async def _next_reply(self, thread, deadline):
+        """Next reply for `thread` before deadline, reading the mailbox ourselves meanwhile."""
+        inbox = self._inboxes[thread]
+        while True:
+            if not inbox.empty():
+                return inbox.get_nowait()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            getter = asyncio.ensure_future(inbox.get())
+            receiver = asyncio.ensure_future(self.receive(timeout=remaining))
+            await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                msg = receiver.result()
+                if msg is not None:
+                    await self._route(msg)
+            else:
+                receiver.cancel()
+            if getter.done():
+                inbox.put_nowait(getter.result())
+            else:
+                getter.cancel()
+
+    async def request_all(self, recipients, build_message, timeout):
+        """Send build_message(jid) to every recipient and wait for their replies.
+
+        Returns {bare jid: reply} as soon as everyone answered, or whatever arrived
+        before the single overall deadline of `timeout` seconds.
+        """
+        recipients = [bare_jid(jid) for jid in recipients]
+        thread = new_thread_id()
+        messages = []
+        for jid in recipients:
+            msg = build_message(jid)
+            msg.thread = thread
+            messages.append(msg)
+        self._inboxes[thread] = asyncio.Queue()
+        start = time.monotonic()
+        replies = {}
+        waiting = set(recipients)
+        try:
+            await asyncio.gather(*(self.send(msg) for msg in messages))
+            deadline = start + timeout
+            while waiting:
+                msg = await self._next_reply(thread, deadline)
+                if msg is None:
+                    break
+                sender = bare_jid(msg.sender)
+                if sender in waiting:
+                    waiting.discard(sender)
+                    replies[sender] = msg
+                    self.reply_latency.setdefault(sender, deque(maxlen=100)).append(time.monotonic() - start)
+        finally:
+            del self._inboxes[thread]
+            self.closed_threads.append(thread)
+        if waiting:
+            logger.warning("[%s] No reply from %s within %ss", self.agent.name, sorted(waiting), timeout)
+        return replies
+
+    async def reserve(self, recipients, duration=ROBOT_LEASE_DURATION, timeout=2):
+        """Ask robots for a lease of `duration` seconds, all at once (propose -> accept/reject-proposal).
+
+        Returns {bare jid: lease id} for the robots that granted one. Work sent under a lease
+        carries its id in the "lease_id" metadata; unused leases can be given back with release().
+        """
+        lease_ids = {}
+
+        def proposal(jid):
+            lease_ids[jid] = new_thread_id("lease")
+            msg = Message(to=jid)
+            msg.set_metadata("performative", "propose")
+            msg.set_metadata("task_type", "reservation")
+            msg.body = json.dumps({"lease_id": lease_ids[jid], "duration": duration})
+            return msg
+
+        replies = await self.request_all(recipients, proposal, timeout)
+        return {jid: lease_ids[jid] for jid, reply in replies.items()
+                if reply.get_metadata("performative") == "accept-proposal"}
+
+    async def release(self, jid, lease_id):
+        msg = Message(to=jid)
+        msg.set_metadata("performative", "cancel")
+        msg.set_metadata("task_type", "reservation")
+        msg.body = json.dumps({"lease_id": lease_id})
+        await self.send(msg)
+
+    def mean_reply_latency(self, jid):
+        samples = self.reply_latency.get(bare_jid(jid))
+        if not samples:
+            return None
+        return sum(samples) / len(samples)
@@ -0,0 +1,76 @@
+import time
+import numpy as np
+from common.config import MEDICATION_TYPES, FORECAST_SMOOTHING
+from services.stockVector import to_vector
+
+HOURS = 24
+# Below this much of the current hour, its running count is scaled up from at least this many seconds
+_MIN_ELAPSED = 300.0
+
+
+def hour_of_day(timestamp):
+    return time.localtime(timestamp).tm_hour
+
+
+class RoomDemandForecast:
+    """Tasks and medication units requested per room, for each hour of the day, learned online.
+
+    Every room has a 24 x (1 + types) table: column 0 is tasks per hour, the others units per hour
+    of each type. Tasks of the running hour are counted in a bucket; when the hour is over the
+    bucket is folded into that hour's row as an EWMA across days (weight `smoothing`), so each
+    task costs O(1) and a daily pattern settles within a few days. Until an hour of the day has
+    history its rate is read from the running bucket alone.
+    """
+
+    def __init__(self, smoothing=FORECAST_SMOOTHING):
+        self.smoothing = smoothing
+        self._history = {}  # room -> HOURS x (1 + types) rates
+        self._seen = np.zeros(HOURS, dtype=bool)  # hours of the day folded in at least once
+        self._bucket = {}  # room -> (1 + types) counts of the running hour
+        self._bucket_hour = None  # epoch hour (timestamp // 3600) the bucket belongs to
+
+    def record(self, task, now=None):
+        now = time.time() if now is None else now
+        self._roll(now)
+        counts = self._bucket.setdefault(task.get("room"), np.zeros(1 + len(MEDICATION_TYPES)))
+        counts[0] += 1
+        counts[1:] += to_vector(task.get("medications", {}))
+
+    def _roll(self, now):
+        hour = int(now // 3600)
+        if self._bucket_hour is None:
+            self._bucket_hour = hour
+            return
+        # Fold the finished hour, then any empty hours since, at most a day's worth
+        for past in range(self._bucket_hour, min(hour, self._bucket_hour + HOURS)):
+            h = hour_of_day(past * 3600)
+            for room in set(self._history) | set(self._bucket):
+                table = self._history.setdefault(room, np.zeros((HOURS, 1 + len(MEDICATION_TYPES))))
+                counts = self._bucket.get(room, np.zeros(1 + len(MEDICATION_TYPES)))
+                table[h] = (1 - self.smoothing) * table[h] + self.smoothing * counts if self._seen[h] else counts
+            self._seen[h] = True
+            self._bucket = {}
+        self._bucket_hour = hour
+
+    def rates(self, now=None):
+        """{room: (1 + types) per-hour rates} expected for the hour of `now`."""
+        now = time.time() if now is None else now
+        self._roll(now)
+        elapsed = max(now - self._bucket_hour * 3600, _MIN_ELAPSED)
+        running = {room: counts * 3600 / elapsed for room, counts in self._bucket.items()}
+        h = hour_of_day(now)
+        if not self._seen[h]:
+            return running
+        rates = {room: table[h].copy() for room, table in self._history.items()}
+        for room, rate in running.items():
+            rates[room] = (1 - self.smoothing) * rates.get(room, 0) + self.smoothing * rate
+        return rates
+
+    def room_weights(self, now=None):
+        """{room: expected tasks per hour}, rooms with none left out."""
+        return {room: float(rate[0]) for room, rate in self.rates(now).items() if rate[0] > 0}
+
+    def medication_rates(self, room, now=None):
+        """Expected units per hour of each type for `room`, as a vector over MEDICATION_TYPES."""
+        rate = self.rates(now).get(room)
+        return np.zeros(len(MEDICATION_TYPES)) if rate is None else rate[1:]
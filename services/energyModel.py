@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from common.config import LOCATION_TOPIC, ENERGY_DRAIN_PER_METRE, BATTERY_RESERVE, ENERGY_SMOOTHING
+from services.mqttService import hub
+from services.mapService import facility_map
+
+STATUS_TOPIC = "123/meia/+/status"
+# Shorter moves are too noisy to learn the drain from (battery is reported to 0.1 %)
+_MIN_SAMPLE_METRES = 1.0
+
+
+class EnergyModel:
+    """Live battery level of every robot and how much battery it uses per metre.
+
+    Battery readings come from the robots' own /status payloads and /location fixes, whichever
+    arrived last. Between two location fixes where the robot moved and its battery dropped, the
+    drop per metre updates that robot's drain estimate (EWMA, starting at ENERGY_DRAIN_PER_METRE),
+    so a robot with a worn battery is planned with what it really uses.
+    """
+
+    def __init__(self, mqtt_hub=hub, drain_per_metre=ENERGY_DRAIN_PER_METRE, smoothing=ENERGY_SMOOTHING):
+        self.hub = mqtt_hub
+        self.default_drain = drain_per_metre
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._battery = {}  # robot name -> (percent, time.time())
+        self._last_fix = {}  # robot name -> (x, y, percent) of the last location fix with a battery
+        self._drain = {}  # robot name -> percent per metre
+        self._subscribed = False
+
+    def start(self):
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        self.hub.subscribe(STATUS_TOPIC, self._on_status)
+        self.hub.subscribe(LOCATION_TOPIC, self._on_location)
+
+    def stop(self):
+        with self._lock:
+            subscribed, self._subscribed = self._subscribed, False
+        if subscribed:
+            self.hub.unsubscribe(STATUS_TOPIC, self._on_status)
+            self.hub.unsubscribe(LOCATION_TOPIC, self._on_location)
+
+    def battery(self, robot_name):
+        """Last reported battery percent of robot_name, or None if it never reported one."""
+        self.start()
+        with self._lock:
+            reading = self._battery.get(robot_name.lower())
+        return None if reading is None else reading[0]
+
+    def drain(self, robot_name):
+        """Estimated battery percent robot_name uses per metre."""
+        with self._lock:
+            return self._drain.get(robot_name.lower(), self.default_drain)
+
+    def trip_energy(self, robot_name, metres):
+        return self.drain(robot_name) * metres
+
+    def can_afford(self, robot_name, battery, metres, to_charger=0.0, reserve=BATTERY_RESERVE):
+        """Whether `battery` covers a trip of `metres` plus the drive on to a charger, keeping `reserve`."""
+        return battery - self.trip_energy(robot_name, metres + to_charger) >= reserve
+
+    def _record(self, robot, percent):
+        with self._lock:
+            self._battery[robot] = (percent, time.time())
+
+    def _on_status(self, msg):
+        robot = msg.topic.split("/")[2].lower()
+        try:
+            data = json.loads(msg.payload.decode())
+        except ValueError:
+            return  # plain status strings carry no battery
+        if isinstance(data, dict) and data.get("battery") is not None:
+            self._record(robot, float(data["battery"]))
+
+    def _on_location(self, msg):
+        robot = msg.topic.split("/")[2].lower()
+        try:
+            data = json.loads(msg.payload.decode())
+            x, y = float(data["x"]), float(data["y"])
+        except Exception:
+            return
+        if data.get("battery") is None:
+            return
+        percent = float(data["battery"])
+        self._record(robot, percent)
+        with self._lock:
+            last = self._last_fix.get(robot)
+            if last is not None:
+                moved = ((x - last[0]) ** 2 + (y - last[1]) ** 2) ** 0.5
+                used = last[2] - percent
+                if moved < _MIN_SAMPLE_METRES:
+                    return  # keep the old fix until the robot has driven far enough
+                if used > 0:  # a charge in between would make the sample meaningless
+                    old = self._drain.get(robot, self.default_drain)
+                    self._drain[robot] = (1 - self.smoothing) * old + self.smoothing * used / moved
+            self._last_fix[robot] = (x, y, percent)
+
+
+def distance_to_charger(point_name, fmap=facility_map):
+    """Cost from a map point to the nearest charger."""
+    if len(fmap.chargers) == 0:
+        return 0.0
+    return float(fmap.cost[fmap.index[point_name], fmap.chargers].min())
+
+
+energy_model = EnergyModel()
@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+from services.mqttService import topic_matches
+
+logger = logging.getLogger(__name__)
+
+
+class FakeMessage:
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+class InProcessBroker:
+    """Minimal broker living in this process, so agents and the simulator can run without a network.
+
+    Messages are delivered in publish order on one dispatcher thread, like paho's network thread,
+    so callbacks never run inside the publisher's call. Retained messages are replayed to new
+    subscriptions that match them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # client -> set of topic filters
+        self._retained = {}  # topic -> last message published with retain=True
+        self._queue = queue.Queue()
+        self.published = 0
+        self.delivered = 0
+        self._thread = threading.Thread(target=self._dispatch_loop, name="InProcessBroker", daemon=True)
+        self._thread.start()
+
+    def attach(self, client):
+        with self._lock:
+            self._subscriptions.setdefault(client, set())
+
+    def detach(self, client):
+        with self._lock:
+            self._subscriptions.pop(client, None)
+
+    def subscribe(self, client, topic):
+        with self._lock:
+            self._subscriptions.setdefault(client, set()).add(topic)
+            retained = [msg for msg in self._retained.values() if topic_matches(topic, msg.topic)]
+        for msg in retained:
+            self._queue.put((msg, client))
+
+    def unsubscribe(self, client, topic):
+        with self._lock:
+            self._subscriptions.get(client, set()).discard(topic)
+
+    def publish(self, topic, payload, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        msg = FakeMessage(topic, payload, retain=retain)
+        with self._lock:
+            self.published += 1
+            if retain:
+                self._retained[topic] = msg
+        self._queue.put((msg, None))
+
+    def _dispatch_loop(self):
+        while True:
+            msg, target = self._queue.get()
+            with self._lock:
+                if target is not None:
+                    targets = [target] if target in self._subscriptions else []
+                else:
+                    targets = [client for client, subs in self._subscriptions.items()
+                               if any(topic_matches(sub, msg.topic) for sub in subs)]
+                self.delivered += len(targets)
+            for client in targets:
+                client._deliver(msg)
+
+
+broker = InProcessBroker()
+
+
+class FakeMqttClient:
+    """Drop-in for the parts of paho.mqtt.client.Client this project uses, backed by InProcessBroker."""
+
+    def __init__(self, *args, **kwargs):
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self._connected = False
+
+    def connect(self, host=None, port=None, keepalive=60):
+        broker.attach(self)
+        self._connected = True
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+        return 0
+
+    def connect_async(self, host=None, port=None, keepalive=60):
+        return self.connect(host, port, keepalive)
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self, force=False):
+        pass
+
+    def loop_forever(self):
+        threading.Event().wait()
+
+    def disconnect(self):
+        broker.detach(self)
+        self._connected = False
+        if self.on_disconnect:
+            self.on_disconnect(self, None, 0)
+
+    def is_connected(self):
+        return self._connected
+
+    def subscribe(self, topic, qos=0):
+        broker.subscribe(self, topic)
+        return 0, 0
+
+    def unsubscribe(self, topic):
+        broker.unsubscribe(self, topic)
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        broker.publish(topic, payload if payload is not None else b"", retain=retain)
+        return None
+
+    def _deliver(self, msg):
+        if self.on_message:
+            try:
+                self.on_message(self, None, msg)
+            except Exception as e:
+                logger.exception("Error in on_message for %s: %s", msg.topic, e)
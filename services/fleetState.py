@@ -0,0 +1,148 @@
+import json
+import logging
+import threading
+import time
+from common.config import FLEET_STATE_TOPIC, FLEET_STATE_MAX_AGE
+from services.mqttService import hub
+
+logger = logging.getLogger(__name__)
+
+
+def state_topic(robot_name):
+    return f"123/meia/{robot_name}/state"
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def state_error(state):
+    """Why a state update can't be stored, or None if it is well formed.
+
+    Readers index status, stock, battery, x and y directly, so every update carries all of them;
+    battery and the pose may be None (not reported yet), the pose only as a pair.
+    """
+    if not isinstance(state, dict) or not isinstance(state.get("robot"), str) or not state["robot"]:
+        return "no robot name"
+    missing = [key for key in ("status", "stock", "battery", "x", "y") if key not in state]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    if not isinstance(state["status"], str):
+        return "status is not a string"
+    stock = state["stock"]
+    amounts = stock.values() if isinstance(stock, dict) else stock if isinstance(stock, list) else None
+    if amounts is None or not all(_is_number(amount) for amount in amounts):
+        return "stock is not a list of amounts"
+    if state["battery"] is not None and not _is_number(state["battery"]):
+        return "battery is not a number"
+    if (state["x"] is None) != (state["y"] is None) or \
+            (state["x"] is not None and not (_is_number(state["x"]) and _is_number(state["y"]))):
+        return "pose is not a pair of numbers"
+    if not all(_is_number(state[key]) for key in ("epoch", "version", "sent_at") if key in state):
+        return "epoch, version or sent_at is not a number"
+    return None
+
+
+class FleetStateTable:
+    """Latest state of every robot, kept locally from their versioned updates on FLEET_STATE_TOPIC.
+
+    Each robot publishes {"robot", "epoch", "version", "sent_at", "status", "stock", "battery",
+    "x", "y", "eta"} when its state changes and on a heartbeat; age is measured from sent_at,
+    so a retained update from a robot that has since died reads as stale. Updates are retained, so an agent that
+    starts later gets the whole table at once. An update only replaces the stored one if
+    (epoch, version) is newer, so reordered or duplicate messages are harmless; epoch is the
+    publisher's start time, so a restarted robot is not stuck behind its old version counter.
+    Updates that fail state_error() are dropped, so readers can index the fields directly.
+    Reads never leave the process: one message per robot change reaches every agent instead
+    of every agent asking every peer.
+    """
+
+    def __init__(self, mqtt_hub=hub, max_age=FLEET_STATE_MAX_AGE):
+        self.hub = mqtt_hub
+        self.max_age = max_age
+        self.epoch = time.time()
+        self._lock = threading.Lock()
+        self._states = {}  # robot name -> latest state dict
+        self._versions = {}  # robot name -> last version this process published
+        self._listeners = []
+        self._subscribed = False
+
+    def start(self):
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        self.hub.subscribe(FLEET_STATE_TOPIC, self._on_message)
+
+    def add_listener(self, callback):
+        """Call callback(state, previous) for every update that replaces a robot's state;
+        previous is None for a robot not seen before. Runs on the publishing or the MQTT thread."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def publish(self, robot_name, **state):
+        """Publish a new version of robot_name's state and apply it locally straight away."""
+        self.start()
+        with self._lock:
+            version = self._versions.get(robot_name, 0) + 1
+            self._versions[robot_name] = version
+        state.update(robot=robot_name, epoch=self.epoch, version=version, sent_at=time.time())
+        self._apply(state)
+        self.hub.publish(state_topic(robot_name), state, retain=True)
+        return state
+
+    def get(self, robot_name, max_age=None):
+        """Latest state of robot_name, or None if unknown or not refreshed within max_age."""
+        self.start()
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            state = self._states.get(robot_name)
+        if state is None or time.time() - state.get("sent_at", 0) > max_age:
+            return None
+        return state
+
+    def snapshot(self, robot_names=None, max_age=None):
+        """{robot name: state} for the fresh entries (of robot_names, if given)."""
+        self.start()
+        max_age = self.max_age if max_age is None else max_age
+        now = time.time()
+        with self._lock:
+            names = list(self._states) if robot_names is None else robot_names
+            return {name: self._states[name] for name in names
+                    if name in self._states and now - self._states[name].get("sent_at", 0) <= max_age}
+
+    def _apply(self, state):
+        error = state_error(state)
+        if error:
+            logger.warning("Dropped state update %r: %s", state, error)
+            return
+        robot_name = state["robot"]
+        key = (state.get("epoch", 0), state.get("version", 0))
+        with self._lock:
+            current = self._states.get(robot_name)
+            # Older, or our own update echoed back by the broker
+            if current is not None and (current.get("epoch", 0), current.get("version", 0)) >= key:
+                return
+            self._states[robot_name] = state
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(state, current)
+            except Exception as e:
+                logger.exception("Error handling the state of %s: %s", robot_name, e)
+
+    def _on_message(self, msg):
+        try:
+            state = json.loads(msg.payload.decode())
+        except ValueError as e:
+            logger.warning("Invalid state on %s: %s", msg.topic, e)
+            return
+        self._apply(state)
+
+
+fleet_state = FleetStateTable()
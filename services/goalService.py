@@ -0,0 +1,167 @@
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from common.config import GOAL_TIMEOUT
+from services.mqttService import hub
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+GOAL_SUCCEEDED = "goal_succeeded"
+GOAL_ABORTED = "goal_aborted"
+# Progress update while driving: {"status": "goal_active", "goal_id", "eta": seconds, "remaining": metres}
+GOAL_ACTIVE = "goal_active"
+# Outcomes produced locally, never sent by a robot
+GOAL_TIMEOUT_STATUS = "goal_timeout"
+GOAL_PREEMPTED = "goal_preempted"
+GOAL_CANCELLED = "goal_cancelled"
+
+TERMINAL_STATUSES = {GOAL_SUCCEEDED, GOAL_ABORTED}
+
+# Buckets up to GOAL_TIMEOUT: trips take seconds to minutes
+GOAL_DURATION = metrics.histogram("goal_duration_seconds", "Time from sending a goal to its outcome", ("status",),
+                                  buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 240, 300))
+GOALS_IN_FLIGHT = metrics.gauge("goals_in_flight", "Navigation goals awaiting an outcome")
+
+
+def goal_topic(robot_name):
+    return f"123/meia/{robot_name.lower()}/goal"
+
+
+def status_topic(robot_name):
+    return f"123/meia/{robot_name.lower()}/status"
+
+
+class GoalTracker:
+    """Publishes navigation goals and awaits their outcome as asyncio futures.
+
+    Each goal is published as {"x", "y", "goal_id", "deadline"} and gets a future on the caller's
+    loop. Robots echo goal_id in every /status message; those arrive on the MQTT network thread
+    and resolve the matching future through call_soon_threadsafe, so any number of trips can be
+    in flight without holding a thread each, and a late status for an older goal is ignored.
+    Statuses without goal_id (older robots) resolve the robot's current goal. A robot only
+    drives to its latest goal: sending a new one resolves the previous one as GOAL_PREEMPTED.
+    """
+
+    def __init__(self, mqtt_hub=hub):
+        self.hub = mqtt_hub
+        self._lock = threading.Lock()
+        # Goal IDs carry the process's start time, so a late status for a goal sent before a restart
+        # can't resolve a new goal that reused its counter value
+        self.epoch = f"{int(time.time() * 1000):x}"
+        self._ids = itertools.count(1)
+        self._goals = {}    # goal id -> (robot topic name, loop, future)
+        self._current = {}  # robot topic name -> id of the goal it is driving to
+        self._progress = {}  # goal id -> (last GOAL_ACTIVE status, time.monotonic() it arrived)
+        self._subscribed = set()
+
+    def send(self, robot_name, target, deadline=None):
+        """Publish a goal for robot_name. Returns (goal id, future resolved with the status dict).
+
+        deadline: time.time() after which the robot should give up and report GOAL_ABORTED.
+        """
+        robot = robot_name.lower()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            goal_id = f"{robot}-{self.epoch}-{next(self._ids)}"
+            previous = self._current.get(robot)
+            self._goals[goal_id] = (robot, loop, future)
+            GOALS_IN_FLIGHT.set(len(self._goals))
+            self._current[robot] = goal_id
+            subscribe = robot not in self._subscribed
+            self._subscribed.add(robot)
+        if previous is not None:
+            self._finish(previous, {"status": GOAL_PREEMPTED})
+        if subscribe:
+            self.hub.subscribe(status_topic(robot), self._on_status)
+        goal = {"x": target["x"], "y": target["y"], "goal_id": goal_id}
+        if deadline is not None:
+            goal["deadline"] = deadline
+        self.hub.publish(goal_topic(robot), goal)
+        return goal_id, future
+
+    async def run(self, robot_name, target, timeout=GOAL_TIMEOUT):
+        """Send a goal and wait for its outcome: the robot's status dict, or GOAL_TIMEOUT_STATUS
+        once `timeout` seconds pass. Cancelling the awaiting task cancels the goal."""
+        start = time.perf_counter()
+        goal_id, future = self.send(robot_name, target, deadline=time.time() + timeout)
+        result = {"status": GOAL_CANCELLED}
+        try:
+            result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            result = {"status": GOAL_TIMEOUT_STATUS}
+        finally:
+            self._forget(goal_id)
+            elapsed = time.perf_counter() - start
+            GOAL_DURATION.observe(elapsed, status=result.get("status"))
+            logger.debug("Goal %s ended with %s after %.1fs", goal_id, result.get("status"), elapsed)
+        return result
+
+    def cancel(self, goal_id):
+        """Stop waiting for a goal; its awaiter gets GOAL_CANCELLED. The robot itself is not stopped."""
+        self._finish(goal_id, {"status": GOAL_CANCELLED})
+
+    def pending(self, robot_name=None):
+        with self._lock:
+            if robot_name is None:
+                return len(self._goals)
+            return sum(1 for robot, _, _ in self._goals.values() if robot == robot_name.lower())
+
+    def eta(self, robot_name):
+        """Seconds until the robot reaches its current goal, from its last progress update, or None."""
+        with self._lock:
+            goal_id = self._current.get(robot_name.lower())
+            progress = self._progress.get(goal_id)
+        if progress is None or progress[0].get("eta") is None:
+            return None
+        status, received = progress
+        return max(0.0, float(status["eta"]) - (time.monotonic() - received))
+
+    def _forget(self, goal_id):
+        with self._lock:
+            entry = self._goals.pop(goal_id, None)
+            GOALS_IN_FLIGHT.set(len(self._goals))
+            self._progress.pop(goal_id, None)
+            if entry is not None and self._current.get(entry[0]) == goal_id:
+                del self._current[entry[0]]
+        return entry
+
+    def _finish(self, goal_id, status):
+        entry = self._forget(goal_id)
+        if entry is not None:
+            _, loop, future = entry
+            loop.call_soon_threadsafe(_resolve, future, status)
+
+    def _on_status(self, msg):
+        # Topic is 123/meia/<robot>/status; robots send a JSON object or just the status string
+        robot = msg.topic.split("/")[2]
+        payload = msg.payload.decode()
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            data = payload
+        if not isinstance(data, dict):
+            data = {"status": data}
+        status = data.get("status")
+        if status != GOAL_ACTIVE and status not in TERMINAL_STATUSES:
+            return
+        with self._lock:
+            goal_id = data.get("goal_id") or self._current.get(robot)
+            if goal_id not in self._goals:
+                return  # finished, timed out or preempted already
+            if status == GOAL_ACTIVE:
+                self._progress[goal_id] = (data, time.monotonic())
+                return
+        self._finish(goal_id, data)
+
+
+def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+goal_tracker = GoalTracker()
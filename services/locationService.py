@@ -1,9 +1,18 @@
-import paho.mqtt.client as mqtt
+import asyncio
 import json
+import logging
 import time
 import threading
 import math
 import random
+from common.config import LOCATION_TOPIC, LOCATION_MAX_AGE
+from services.mqttService import hub
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# result: "cached" (fresh pose on hand), "fix" (waited for the next one) or "timeout"
+LOCATION_LOOKUP = metrics.histogram("location_lookup_seconds", "Time to get a robot's pose", ("result",))
 
 def get_location_mock():
     x = random.randint(0, 250)
@@ -11,53 +20,152 @@ def get_location_mock():
     z = 0
     return x, y, z
 
-def get_location(robot_name, timeout=5):
-    location_topic = f"123/meia/{robot_name}/location"
-    location_data = {}
-    event = threading.Event()
 
-    def on_connect(client, userdata, flags, rc):
-        client.subscribe(location_topic)
+class LocationTracker:
+    """Keeps the latest pose of every robot from a single shared MQTT subscription."""
+
+    def __init__(self, mqtt_hub=hub, max_age=LOCATION_MAX_AGE):
+        self.hub = mqtt_hub
+        self.max_age = max_age
+        self._poses = {}  # robot_name -> (x, y, timestamp)
+        self._waiters = {}  # robot_name -> [(loop, future)] for aget()
+        self._condition = threading.Condition()
+        self._subscribed = False
+
+    def start(self):
+        # Subscribe lazily on the process-wide MQTT connection
+        with self._condition:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        self.hub.subscribe(LOCATION_TOPIC, self._on_message)
 
-    def on_message(client, userdata, msg):
+    def stop(self):
+        with self._condition:
+            subscribed, self._subscribed = self._subscribed, False
+        if subscribed:
+            self.hub.unsubscribe(LOCATION_TOPIC, self._on_message)
+
+    def _on_message(self, msg):
+        # Topic is 123/meia/<robot>/location
+        robot_name = msg.topic.split("/")[2]
         try:
-            payload = msg.payload.decode()
-            location = json.loads(payload)
-            location_data.update(location)
-            event.set()  # Notify main thread that we have the data
+            location = json.loads(msg.payload.decode())
+            pose = (location["x"], location["y"], time.time())
         except Exception as e:
-            print("Error parsing message:", e)
+            logger.warning("Invalid location on %s: %s", msg.topic, e)
+            return
+        with self._condition:
+            self._poses[robot_name] = pose
+            waiters = self._waiters.pop(robot_name, [])
+            self._condition.notify_all()
+        # Runs on the paho network thread, hand the result back to each waiting loop
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, (pose[0], pose[1]))
+
+    def _fresh_pose(self, robot_name, max_age):
+        pose = self._poses.get(robot_name)
+        if pose is None:
+            return None
+        if max_age is None:
+            max_age = self.max_age
+        if time.time() - pose[2] > max_age:
+            return None
+        return pose[0], pose[1]
 
-    client = mqtt.Client()
-    client.on_connect = on_connect
-    client.on_message = on_message
+    def get(self, robot_name, max_age=None):
+        """Return the cached (x, y) for robot_name, or None if unknown or older than max_age. Never blocks."""
+        self.start()
+        with self._condition:
+            return self._fresh_pose(robot_name, max_age)
 
-    client.connect("broker.hivemq.com", 1883, 60)
-    client.loop_start()
+    def age(self, robot_name):
+        with self._condition:
+            pose = self._poses.get(robot_name)
+        return None if pose is None else time.time() - pose[2]
 
-    # Wait for a message or timeout
-    got_message = event.wait(timeout=timeout)
+    def wait_for(self, robot_name, timeout=5, max_age=None):
+        """Block until a pose no older than max_age is available, or timeout expires."""
+        self.start()
+        start = time.perf_counter()
+        with self._condition:
+            location = self._fresh_pose(robot_name, max_age)
+            if location is not None:
+                result = "cached"
+            elif self._condition.wait_for(lambda: self._fresh_pose(robot_name, max_age) is not None, timeout):
+                location, result = self._fresh_pose(robot_name, max_age), "fix"
+            else:
+                result = "timeout"
+        LOCATION_LOOKUP.observe(time.perf_counter() - start, result=result)
+        return location
+
+    async def aget(self, robot_name, max_age=None, timeout=5):
+        """Async get(): returns the cached pose if fresh, otherwise awaits the next fix without blocking the loop."""
+        self.start()
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            location = self._fresh_pose(robot_name, max_age)
+            if location is not None:
+                LOCATION_LOOKUP.observe(time.perf_counter() - start, result="cached")
+                return location
+            future = loop.create_future()
+            self._waiters.setdefault(robot_name, []).append((loop, future))
+        result = "error"
+        try:
+            location = await asyncio.wait_for(future, timeout)
+            result = "fix"
+            return location
+        except asyncio.TimeoutError:
+            result = "timeout"
+            return None
+        except asyncio.CancelledError:
+            result = "cancelled"  # the caller gave up; not a robot that failed to report
+            raise
+        finally:
+            LOCATION_LOOKUP.observe(time.perf_counter() - start, result=result)
+            with self._condition:
+                waiters = self._waiters.get(robot_name)
+                if waiters and (loop, future) in waiters:
+                    waiters.remove((loop, future))
 
-    client.loop_stop()
-    client.disconnect()
+    async def aget_many(self, robot_names, max_age=None, timeout=5):
+        """Fetch several poses concurrently. Returns {robot_name: (x, y) or None}."""
+        robot_names = list(robot_names)
+        locations = await asyncio.gather(*(self.aget(name, max_age, timeout) for name in robot_names))
+        return dict(zip(robot_names, locations))
 
-    if got_message:
-        location= location_data["x"], location_data["y"]
-        print(f"[[LOCATION]] {robot_name} IS {location}.")
+
+def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+location_service = LocationTracker()
+
+
+def get_location(robot_name, timeout=5):
+    location = location_service.get(robot_name)
+    if location is None:
+        location = location_service.wait_for(robot_name, timeout=timeout)
+
+    if location:
+        logger.debug("%s is at %s", robot_name, location)
         return location
     else:
-        print(f"No location message received for {robot_name} within {timeout} seconds.")
+        logger.warning("No location message received for %s within %s seconds.", robot_name, timeout)
         return None
-    
+
 
 
 def distance_between_points(x1, y1, x2, y2):
     return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
 
-# Example usage:
-xy = get_location("robot1")
-if xy:
-    x, y = xy
-    print(f"robot1 location: x = {x}, y = {y}")
-else:
-    print("Could not get location.")
\ No newline at end of file
+if __name__ == "__main__":
+    # Example usage:
+    xy = get_location("robot1")
+    if xy:
+        x, y = xy
+        print(f"robot1 location: x = {x}, y = {y}")
+    else:
+        print("Could not get location.")
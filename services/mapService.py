@@ -0,0 +1,168 @@
+import heapq
+import math
+import numpy as np
+from common.config import ROBOT_LOCATIONS, CHARGING_STATIONS, WAREHOUSES
+
+
+class OccupancyGrid:
+    """Grid of free/blocked cells used for path-length costs instead of straight lines.
+
+    blocked: 2D bool array indexed [row, col], row 0 at origin y. resolution is metres per cell.
+    """
+
+    def __init__(self, blocked, origin=(0.0, 0.0), resolution=0.25):
+        self.blocked = np.asarray(blocked, dtype=bool)
+        self.origin = origin
+        self.resolution = resolution
+
+    @classmethod
+    def from_text(cls, lines, origin=(0.0, 0.0), resolution=0.25):
+        """'#' is a wall, anything else is free. The first line is the row at origin y."""
+        lines = [line.rstrip("\n") for line in lines]
+        width = max(len(line) for line in lines)
+        return cls([[c == "#" for c in line.ljust(width)] for line in lines], origin, resolution)
+
+    def cell(self, x, y):
+        rows, cols = self.blocked.shape
+        col = int(round((x - self.origin[0]) / self.resolution))
+        row = int(round((y - self.origin[1]) / self.resolution))
+        return min(max(row, 0), rows - 1), min(max(col, 0), cols - 1)
+
+    def distance_field(self, x, y):
+        """Path length in metres from (x, y) to every cell (8-connected Dijkstra), inf if unreachable."""
+        rows, cols = self.blocked.shape
+        dist = np.full((rows, cols), np.inf)
+        start = self.cell(x, y)
+        dist[start] = 0.0
+        heap = [(0.0, start)]
+        steps = [(dr, dc, math.hypot(dr, dc)) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc]
+        while heap:
+            d, (r, c) = heapq.heappop(heap)
+            if d > dist[r, c]:
+                continue
+            for dr, dc, step in steps:
+                nr, nc = r + dr, c + dc
+                if 0 <= nr < rows and 0 <= nc < cols and not self.blocked[nr, nc]:
+                    nd = d + step * self.resolution
+                    if nd < dist[nr, nc]:
+                        dist[nr, nc] = nd
+                        heapq.heappush(heap, (nd, (nr, nc)))
+        return dist
+
+
+class FacilityMap:
+    """Every fixed point (rooms per robot, chargers, warehouses) with a precomputed pairwise cost matrix.
+
+    Points are named "<robot>/<room>", "charger:<i>" and "warehouse:<i>". Costs are straight-line
+    metres, or path lengths over `grid` when one is given.
+    """
+
+    def __init__(self, robot_locations=ROBOT_LOCATIONS, charging_stations=CHARGING_STATIONS,
+                 warehouses=WAREHOUSES, grid=None):
+        self.robot_locations = robot_locations
+        self.default_robot = next(iter(robot_locations), None)
+        self.names = []
+        coords = []
+        for robot_name, rooms in robot_locations.items():
+            for room, xy in rooms.items():
+                self.names.append(f"{robot_name}/{room}")
+                coords.append((xy["x"], xy["y"]))
+        for i, xy in enumerate(charging_stations):
+            self.names.append(f"charger:{i}")
+            coords.append((xy["x"], xy["y"]))
+        for i, xy in enumerate(warehouses):
+            self.names.append(f"warehouse:{i}")
+            coords.append((xy["x"], xy["y"]))
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.coords = np.array(coords, dtype=float).reshape(-1, 2)
+        self.chargers = np.array([self.index[f"charger:{i}"] for i in range(len(charging_stations))], dtype=int)
+        self.warehouses = np.array([self.index[f"warehouse:{i}"] for i in range(len(warehouses))], dtype=int)
+        self.grid = grid
+
+        if grid is None:
+            self._fields = None
+            diff = self.coords[:, None, :] - self.coords[None, :, :]
+            self.cost = np.linalg.norm(diff, axis=2)
+        else:
+            # One distance field per fixed point; a robot's cost to it is a lookup at its cell
+            self._fields = np.stack([grid.distance_field(x, y) for x, y in self.coords])
+            cells = [grid.cell(x, y) for x, y in self.coords]
+            self.cost = np.array([[self._fields[i][cell] for cell in cells] for i in range(len(cells))])
+
+    def rooms_for(self, robot_name):
+        """Room coordinates for a robot, falling back to the first robot's layout for unknown robots."""
+        return self.robot_locations.get(robot_name) or self.robot_locations.get(self.default_robot, {})
+
+    def room_point(self, robot_name, room):
+        if robot_name not in self.robot_locations:
+            robot_name = self.default_robot
+        return f"{robot_name}/{room}"
+
+    def room_coords(self, robot_name, room):
+        return self.rooms_for(robot_name).get(room)
+
+    def distances_from(self, position):
+        """Cost from an arbitrary (x, y) to every fixed point, as an array aligned with self.names."""
+        if self._fields is None:
+            return np.linalg.norm(self.coords - np.asarray(position, dtype=float), axis=1)
+        row, col = self.grid.cell(*position)
+        return self._fields[:, row, col]
+
+    def distances_from_many(self, positions):
+        """distances_from() for several positions at once: N x points array."""
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        if self._fields is None:
+            return np.linalg.norm(self.coords[None, :, :] - positions[:, None, :], axis=2)
+        return np.array([self.distances_from(p) for p in positions]).reshape(len(positions), len(self.names))
+
+    def distance(self, position, point_name):
+        return float(self.distances_from(position)[self.index[point_name]])
+
+    def nearest_point(self, position):
+        """Name of the fixed point at (or closest to) `position`, given as (x, y) or {"x", "y"}."""
+        if isinstance(position, dict):
+            position = (position["x"], position["y"])
+        offsets = np.linalg.norm(self.coords - np.asarray(position, dtype=float), axis=1)
+        return self.names[int(np.argmin(offsets))]
+
+    def distance_between(self, point_a, point_b):
+        return float(self.cost[self.index[point_a], self.index[point_b]])
+
+    def nearest_robot(self, room, poses):
+        """(robot name, cost) of the robot closest to `room`, from {robot name: (x, y) or None}."""
+        known = [(name, pose) for name, pose in poses.items() if pose is not None]
+        if not known:
+            return None, math.inf
+        targets = np.array([self.index.get(self.room_point(name, room), -1) for name, _ in known])
+        if self._fields is None:
+            positions = np.array([pose for _, pose in known], dtype=float)
+            valid = targets >= 0
+            costs = np.full(len(known), np.inf)
+            costs[valid] = np.linalg.norm(self.coords[targets[valid]] - positions[valid], axis=1)
+        else:
+            costs = np.array([self.distances_from(pose)[t] if t >= 0 else np.inf
+                              for (_, pose), t in zip(known, targets)])
+        best = int(np.argmin(costs))
+        return known[best][0], float(costs[best])
+
+    def _nearest(self, position, candidates, taken):
+        if len(candidates) == 0:
+            return None
+        costs = self.distances_from(position)[candidates].copy()
+        costs[[i for i in range(len(candidates)) if i in taken]] = np.inf
+        best = int(np.argmin(costs))
+        if not np.isfinite(costs[best]):
+            return None
+        x, y = self.coords[candidates[best]]
+        return best, {"x": float(x), "y": float(y)}, float(costs[best])
+
+    def nearest_free_charger(self, position, occupied=()):
+        """(charger index, {"x", "y"}, cost) of the closest charger not in `occupied`, or None."""
+        return self._nearest(position, self.chargers, set(occupied))
+
+    def nearest_warehouse(self, position):
+        """(warehouse index, {"x", "y"}, cost) of the closest warehouse, or None."""
+        return self._nearest(position, self.warehouses, set())
+
+
+facility_map = FacilityMap()
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import threading
+import paho.mqtt.client as mqtt
+from common.config import MQTT_BROKER, MQTT_PORT, MQTT_QOS
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Labelled by the last topic level (location, status, state, goal, new, ...) so robots don't add series
+MQTT_RECEIVED = metrics.counter("mqtt_messages_received_total", "MQTT messages received", ("kind",))
+MQTT_PUBLISHED = metrics.counter("mqtt_messages_published_total", "MQTT messages published", ("kind",))
+
+# Set MQTT_BROKER to this to run everything against services.fakeBroker inside one process
+IN_PROCESS_BROKER = "inprocess"
+
+
+def create_mqtt_client(broker=MQTT_BROKER):
+    """New MQTT client for `broker`: a paho client, or a fake one when running in-process."""
+    if broker == IN_PROCESS_BROKER:
+        from services.fakeBroker import FakeMqttClient
+        return FakeMqttClient()
+    return mqtt.Client()
+
+
+def topic_matches(subscription, topic):
+    """MQTT topic filter match with '+' (one level) and '#' (rest of the topic) wildcards."""
+    sub_parts = subscription.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(sub_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != "+" and part != topic_parts[i]:
+            return False
+    return len(sub_parts) == len(topic_parts)
+
+
+class MqttHub:
+    """One MQTT connection per process, shared by every agent and service in it.
+
+    Handlers register per topic filter and are called with the paho message on the network
+    thread; exact topics are found with a dict lookup, wildcard filters are matched in turn.
+    The connection reconnects on its own and every filter is subscribed again on reconnect.
+    """
+
+    def __init__(self, broker=MQTT_BROKER, port=MQTT_PORT, qos=MQTT_QOS):
+        self.broker = broker
+        self.port = port
+        self.qos = qos
+        self._lock = threading.RLock()
+        self._exact = {}     # topic -> [callback]
+        self._wildcard = {}  # filter with + or # -> [callback]
+        self._client = None
+        self.connected = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._client is not None:
+                return
+            self._client = create_mqtt_client(self.broker)
+            self._client.on_connect = self._on_connect
+            self._client.on_disconnect = self._on_disconnect
+            self._client.on_message = self._on_message
+            self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+        # connect_async + loop_start: paho's network thread connects and keeps reconnecting
+        self._client.connect_async(self.broker, self.port, 60)
+        self._client.loop_start()
+
+    def stop(self):
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.loop_stop()
+            client.disconnect()
+        self.connected.clear()
+
+    def subscribe(self, topic_filter, callback):
+        """Call callback(msg) for every message matching topic_filter."""
+        self.start()
+        handlers = self._wildcard if ("+" in topic_filter or "#" in topic_filter) else self._exact
+        with self._lock:
+            first = topic_filter not in handlers
+            handlers.setdefault(topic_filter, []).append(callback)
+            client = self._client
+        if first and self.connected.is_set():
+            client.subscribe(topic_filter, self.qos)
+
+    def unsubscribe(self, topic_filter, callback):
+        handlers = self._wildcard if ("+" in topic_filter or "#" in topic_filter) else self._exact
+        with self._lock:
+            callbacks = handlers.get(topic_filter, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            last = not callbacks and topic_filter in handlers
+            if last:
+                del handlers[topic_filter]
+            client = self._client
+        if last and client is not None and self.connected.is_set():
+            client.unsubscribe(topic_filter)
+
+    def subscribe_queue(self, topic_filter, loop=None):
+        """asyncio.Queue that receives every matching message, for use from coroutines."""
+        loop = loop or asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        self.subscribe(topic_filter, lambda msg: loop.call_soon_threadsafe(queue.put_nowait, msg))
+        return queue
+
+    def publish(self, topic, payload, qos=None, retain=False):
+        """Publish str/bytes as-is, anything else as JSON."""
+        self.start()
+        if not isinstance(payload, (str, bytes, bytearray)):
+            payload = json.dumps(payload)
+        MQTT_PUBLISHED.inc(kind=topic.rsplit("/", 1)[-1])
+        return self._client.publish(topic, payload, qos=self.qos if qos is None else qos, retain=retain)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.error("Connection to %s:%s refused (rc=%s)", self.broker, self.port, rc)
+            return
+        self.connected.set()
+        with self._lock:
+            filters = list(self._exact) + list(self._wildcard)
+        for topic_filter in filters:
+            client.subscribe(topic_filter, self.qos)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected.clear()
+        if rc != 0:
+            logger.warning("Lost connection to %s:%s (rc=%s), reconnecting...", self.broker, self.port, rc)
+
+    def _on_message(self, client, userdata, msg):
+        MQTT_RECEIVED.inc(kind=msg.topic.rsplit("/", 1)[-1])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("<- %s %s", msg.topic, msg.payload[:200])
+        with self._lock:
+            callbacks = list(self._exact.get(msg.topic, ()))
+            for topic_filter, handlers in self._wildcard.items():
+                if topic_matches(topic_filter, msg.topic):
+                    callbacks.extend(handlers)
+        for callback in callbacks:
+            try:
+                callback(msg)
+            except Exception as e:
+                logger.exception("Error handling %s: %s", msg.topic, e)
+
+
+hub = MqttHub()
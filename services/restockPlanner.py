@@ -0,0 +1,50 @@
+import numpy as np
+from common.config import MEDICATION_TYPES, ROBOT_MAX_MEDICATION, RESTOCK_HORIZON
+from services.mapService import facility_map
+from services.stockVector import to_vector, stock_matrix
+from services.energyModel import energy_model, distance_to_charger
+
+
+def forecast_shortfall(stocks, demand_rate, fleet_size, horizon=RESTOCK_HORIZON):
+    """Units each robot is forecast to lack within `horizon` seconds: robots x types array.
+
+    stocks: robots x types matrix. demand_rate: units per second of each type for the whole
+    fleet (e.g. ArrivalRate fed with demand vectors), shared evenly between fleet_size robots.
+    Capped at ROBOT_MAX_MEDICATION: a full robot can't carry more, so it never falls short.
+    """
+    expected = np.zeros(len(MEDICATION_TYPES)) + demand_rate * horizon / max(fleet_size, 1)
+    expected = np.minimum(expected, to_vector(ROBOT_MAX_MEDICATION))
+    return np.maximum(expected[None, :] - stocks, 0)
+
+
+def plan_restocks(states, demand_rate, fleet_size, horizon=RESTOCK_HORIZON, fmap=facility_map, energy=energy_model):
+    """Pick idle robots to refill now, before they run short of what the forecast says they'll be asked for.
+
+    states: robot name -> fleet-state entry. A robot goes when its stock of some type won't last
+    `horizon` seconds of its share of the demand, or when a type it holds is gone entirely.
+    Robots short on the most units go first, each to its nearest warehouse, if their battery lasts
+    the drive there and on to a charger (otherwise they wait for a top-up first).
+    Returns [(robot name, warehouse {"x", "y"})].
+    """
+    names = [name for name, s in states.items() if s.get("status") == "available" and s.get("x") is not None]
+    if not names:
+        return []
+    stocks = stock_matrix([states[name].get("stock") for name in names])
+    full = to_vector(ROBOT_MAX_MEDICATION)
+    shortfall = forecast_shortfall(stocks, demand_rate, fleet_size, horizon).sum(axis=1)
+    empty = ((stocks == 0) & (full > 0)[None, :]).any(axis=1)
+
+    plan = []
+    for i in np.argsort(-shortfall, kind="stable"):
+        if shortfall[i] <= 0 and not empty[i]:
+            continue
+        state = states[names[i]]
+        warehouse = fmap.nearest_warehouse((state["x"], state["y"]))
+        if warehouse is None:
+            continue
+        index, coords, metres = warehouse
+        if state.get("battery") is not None and not energy.can_afford(
+                names[i], state["battery"], metres, distance_to_charger(f"warehouse:{index}", fmap)):
+            continue
+        plan.append((names[i], coords))
+    return plan
@@ -0,0 +1,164 @@
+import json
+import logging
+import math
+import random
+import threading
+import time
+from common.config import CHARGING_STATIONS
+from services.mqttService import hub
+from services.goalService import GOAL_SUCCEEDED, GOAL_ABORTED, GOAL_ACTIVE
+from services.mapService import facility_map
+
+logger = logging.getLogger(__name__)
+
+GOAL_TOPIC = "123/meia/+/goal"
+
+
+class SimulatedRobot:
+    """Point robot that drives in a straight line to its goal and drains battery per metre."""
+
+    def __init__(self, name, x, y, speed=0.5, battery=100.0, drain_per_metre=0.5, charge_rate=5.0):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.speed = speed
+        self.battery = battery
+        self.drain_per_metre = drain_per_metre
+        self.charge_rate = charge_rate  # percent per second while parked at a charger
+        self.goal = None
+        self.charging = False
+
+    def set_goal(self, goal):
+        self.goal = goal
+        self.charging = False
+
+    def _status(self, status, **extra):
+        payload = {"status": status, "battery": round(self.battery, 1), **extra}
+        if self.goal is not None and "goal_id" in self.goal:
+            payload["goal_id"] = self.goal["goal_id"]
+        return payload
+
+    def progress(self):
+        """GOAL_ACTIVE status with the ETA to the current goal, or None when idle."""
+        if self.goal is None:
+            return None
+        remaining = math.hypot(self.goal["x"] - self.x, self.goal["y"] - self.y)
+        return self._status(GOAL_ACTIVE, remaining=round(remaining, 2),
+                            eta=round(remaining / self.speed, 1) if self.speed > 0 else None)
+
+    def step(self, dt, now=None):
+        """Advance dt seconds. Returns the status payload to publish, if the goal finished."""
+        if self.goal is None:
+            if self.charging:
+                self.battery = min(100.0, self.battery + self.charge_rate * dt)
+                self.charging = self.battery < 100.0
+            return None
+
+        dx, dy = self.goal["x"] - self.x, self.goal["y"] - self.y
+        remaining = math.hypot(dx, dy)
+        travel = min(remaining, self.speed * dt)
+        if self.drain_per_metre > 0:
+            travel = min(travel, self.battery / self.drain_per_metre)
+        if remaining > 0:
+            self.x += dx / remaining * travel
+            self.y += dy / remaining * travel
+        self.battery = max(0.0, self.battery - travel * self.drain_per_metre)
+
+        if travel >= remaining:
+            status = self._status(GOAL_SUCCEEDED)
+            self.goal = None
+            self.charging = any(math.hypot(s["x"] - self.x, s["y"] - self.y) < 0.3 for s in CHARGING_STATIONS)
+            return status
+        if self.battery <= 0:
+            status = self._status(GOAL_ABORTED, reason="battery")
+            self.goal = None
+            return status
+        deadline = self.goal.get("deadline")
+        if deadline is not None and (now or time.time()) > deadline:
+            status = self._status(GOAL_ABORTED, reason="deadline")
+            self.goal = None
+            return status
+        return None
+
+
+class FleetSimulator:
+    """Stands in for the physical robots: takes goals from 123/meia/<robot>/goal, publishes /location and /status.
+
+    Statuses echo the goal's goal_id; goal_active ETA updates go out with every location fix.
+    All robots share the process-wide MQTT hub and one stepping thread, so hundreds can run on one machine.
+    """
+
+    def __init__(self, robot_names, speed=0.5, tick=0.1, location_interval=0.5, drain_per_metre=0.5,
+                 seed=0, mqtt_hub=hub):
+        rng = random.Random(seed)
+        (min_x, min_y), (max_x, max_y) = facility_map.coords.min(axis=0), facility_map.coords.max(axis=0)
+        self.robots = {
+            name: SimulatedRobot(name, rng.uniform(min_x, max_x), rng.uniform(min_y, max_y),
+                                 speed=speed, drain_per_metre=drain_per_metre)
+            for name in robot_names
+        }
+        self._by_topic_name = {name.lower(): robot for name, robot in self.robots.items()}
+        self.tick = tick
+        self.location_interval = location_interval
+        self.hub = mqtt_hub
+        self.goals_received = 0
+        self.goals_succeeded = 0
+        self.goals_aborted = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.hub.subscribe(GOAL_TOPIC, self._on_message)
+        self._thread = threading.Thread(target=self._run, name="FleetSimulator", daemon=True)
+        self._thread.start()
+        logger.info("%d robots running against %s", len(self.robots), self.hub.broker)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.hub.unsubscribe(GOAL_TOPIC, self._on_message)
+
+    def _on_message(self, msg):
+        robot = self._by_topic_name.get(msg.topic.split("/")[2])
+        if robot is None:
+            return
+        try:
+            goal = json.loads(msg.payload.decode())
+            float(goal["x"]), float(goal["y"])
+        except Exception as e:
+            logger.warning("Invalid goal on %s: %s", msg.topic, e)
+            return
+        with self._lock:
+            robot.set_goal(goal)
+            self.goals_received += 1
+
+    def _run(self):
+        last = time.monotonic()
+        last_location = 0.0
+        while not self._stop.wait(self.tick):
+            now = time.monotonic()
+            dt, last = now - last, now
+            publish_locations = now - last_location >= self.location_interval
+            if publish_locations:
+                last_location = now
+            with self._lock:
+                updates = []
+                wall_time = time.time()
+                for robot in self.robots.values():
+                    status = robot.step(dt, wall_time)
+                    if status is not None:
+                        if status["status"] == GOAL_SUCCEEDED:
+                            self.goals_succeeded += 1
+                        else:
+                            self.goals_aborted += 1
+                    elif publish_locations:
+                        status = robot.progress()  # ETA update while driving
+                    if status is not None:
+                        updates.append((f"123/meia/{robot.name.lower()}/status", status))
+                    if publish_locations:
+                        updates.append((f"123/meia/{robot.name}/location",
+                                        {"x": round(robot.x, 3), "y": round(robot.y, 3), "battery": round(robot.battery, 1)}))
+            for topic, payload in updates:
+                self.hub.publish(topic, payload)
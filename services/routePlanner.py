@@ -0,0 +1,108 @@
+import numpy as np
+from common.config import MAX_ROUTE_STOPS
+from services.mapService import facility_map
+from services.stockVector import demand_vector, unpack, covers
+from services.energyModel import energy_model, distance_to_charger
+
+
+def order_stops(start, points, fmap=facility_map):
+    """Visiting order for `points` (map point names) as indices into it.
+
+    Starts from `start` (x, y), or from the first point when the pose is unknown. The tour is
+    built by nearest neighbour over fmap.cost and then improved with 2-opt until no segment
+    reversal shortens it. The route is open: it ends at the last stop.
+    """
+    n = len(points)
+    if n <= 1:
+        return list(range(n))
+    idx = np.array([fmap.index[p] for p in points])
+    cost = fmap.cost[np.ix_(idx, idx)]
+    from_start = fmap.distances_from(start)[idx] if start is not None else cost[0]
+
+    order = []
+    left = set(range(n))
+    current = from_start
+    while left:
+        nxt = min(left, key=lambda j: current[j])
+        order.append(nxt)
+        left.remove(nxt)
+        current = cost[nxt]
+
+    def leg(a, b):
+        return from_start[b] if a is None else cost[a, b]
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 1):
+            prev = order[i - 1] if i > 0 else None
+            for j in range(i + 1, n):
+                after_j = order[j + 1] if j + 1 < n else None
+                tail_before = cost[order[j], after_j] if after_j is not None else 0.0
+                tail_after = cost[order[i], after_j] if after_j is not None else 0.0
+                if leg(prev, order[j]) + tail_after < leg(prev, order[i]) + tail_before - 1e-9:
+                    order[i:j + 1] = order[i:j + 1][::-1]
+                    improved = True
+    return order
+
+
+def route_cost(start, points, order=None, fmap=facility_map):
+    """Travel cost of visiting `points` in `order` (default: as given) from `start`."""
+    if not points:
+        return 0.0
+    order = list(range(len(points))) if order is None else order
+    idx = [fmap.index[points[i]] for i in order]
+    total = fmap.distances_from(start)[idx[0]] if start is not None else 0.0
+    return float(total + sum(fmap.cost[a, b] for a, b in zip(idx, idx[1:])))
+
+
+def plan_routes(assignments, leftovers, poses, fmap=facility_map, max_stops=MAX_ROUTE_STOPS, energy=energy_model):
+    """Extend one-task assignments into multi-stop routes.
+
+    assignments: [(task, robot reply)], as returned first by allocator.allocate. Each leftover task is added to
+    the route whose cost grows least, among robots whose stock still covers it after the tasks
+    they already carry, that have fewer than max_stops stops and whose battery still lasts the
+    longer trip plus the drive on to a charger.
+    Returns ({robot jid: [tasks in visiting order]}, [tasks still unassigned]).
+    """
+    routes = {}
+    for task, robot in assignments:
+        name = robot["jid"].split("@")[0]
+        stock = unpack(robot.get("stock")) - demand_vector(task["medications"])
+        routes[robot["jid"]] = {"name": name, "tasks": [task], "stock": stock, "battery": robot.get("battery")}
+
+    def points_for(route, tasks):
+        return [fmap.room_point(route["name"], task.get("room")) for task in tasks]
+
+    unassigned = []
+    for task in leftovers:
+        best, best_added = None, np.inf
+        demand = demand_vector(task["medications"])
+        for route in routes.values():
+            if len(route["tasks"]) >= max_stops or not covers(route["stock"], demand):
+                continue
+            points = points_for(route, route["tasks"] + [task])
+            if any(point not in fmap.index for point in points):
+                continue
+            start = poses.get(route["name"])
+            before = route_cost(start, points[:-1], order_stops(start, points[:-1], fmap), fmap)
+            order = order_stops(start, points, fmap)
+            after = route_cost(start, points, order, fmap)
+            if start is not None and route["battery"] is not None and not energy.can_afford(
+                    route["name"], route["battery"], after, distance_to_charger(points[order[-1]], fmap)):
+                continue
+            added = after - before
+            if added < best_added:
+                best, best_added = route, added
+        if best is None:
+            unassigned.append(task)
+            continue
+        best["tasks"].append(task)
+        best["stock"] = best["stock"] - demand
+
+    ordered = {}
+    for jid, route in routes.items():
+        points = points_for(route, route["tasks"])
+        order = order_stops(poses.get(route["name"]), points, fmap)
+        ordered[jid] = [route["tasks"][i] for i in order]
+    return ordered, unassigned
@@ -0,0 +1,68 @@
+import itertools
+import numpy as np
+from common.config import SPLIT_EXACT_MAX_PEERS
+from services.stockVector import STOCK_DTYPE, split
+
+
+def _exact_subset(useful, demand, travel):
+    """Smallest set of robots whose offers cover demand, cheapest travel among equally small sets.
+
+    Subsets are searched by size, so the first size with any feasible subset is optimal and the
+    rest of the tree is pruned; within a size all combinations are checked in one array op.
+    """
+    n = len(useful)
+    for size in range(1, n + 1):
+        combos = np.array(list(itertools.combinations(range(n), size)), dtype=int)
+        feasible = (useful[combos].sum(axis=1) >= demand).all(axis=1)
+        if feasible.any():
+            costs = np.where(feasible, travel[combos].sum(axis=1), np.inf)
+            return list(combos[int(np.argmin(costs))])
+    return None
+
+
+def _greedy_subset(useful, demand, travel):
+    """Greedy set cover: repeatedly add the robot covering most of what is still missing,
+    breaking ties by travel."""
+    chosen = []
+    remaining = demand.copy()
+    available = np.ones(len(useful), dtype=bool)
+    while remaining.any():
+        gain = np.minimum(useful, remaining).sum(axis=1).astype(float)
+        gain[~available] = -1
+        best = np.flatnonzero(gain == gain.max())
+        pick = int(best[np.argmin(travel[best])])
+        if gain[pick] <= 0:
+            return None
+        chosen.append(pick)
+        available[pick] = False
+        remaining = np.maximum(remaining - useful[pick], 0)
+    return chosen
+
+
+def plan_split(offers, demand, travel=None, exact_max=SPLIT_EXACT_MAX_PEERS):
+    """Split demand across peers with the fewest robots, then the least total travel.
+
+    offers: peers x types matrix of what each peer can give; demand: types vector;
+    travel: cost for each peer to reach the room (zeros when unknown). Exact for up to
+    exact_max offering peers, greedy set cover above that. Returns a peers x types
+    contribution matrix (zero rows for peers left out), or None if the offers can't cover it.
+    """
+    if demand is None:
+        return None
+    offers = np.asarray(offers, dtype=STOCK_DTYPE).reshape(-1, len(demand))
+    if (offers.sum(axis=0) < demand).any():
+        return None
+    travel = np.zeros(len(offers)) if travel is None else np.nan_to_num(np.asarray(travel, dtype=float), posinf=1e9)
+    useful = np.minimum(offers, demand)
+    candidates = np.flatnonzero(useful.any(axis=1))
+
+    search = _exact_subset if len(candidates) <= exact_max else _greedy_subset
+    chosen = search(useful[candidates], demand, travel[candidates])
+    if chosen is None:
+        return None
+    chosen = candidates[chosen]
+    # Nearest chosen peers carry as much as they can
+    order = chosen[np.argsort(travel[chosen], kind="stable")]
+    contribution = np.zeros_like(offers)
+    contribution[order] = split(offers[order], demand, order=np.arange(len(order)))
+    return contribution
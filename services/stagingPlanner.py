@@ -0,0 +1,53 @@
+import numpy as np
+from common.config import STAGING_MIN_MOVE
+from services.mapService import facility_map
+from services.allocator import assign
+
+# Stand-in for "no spot covers this room yet"; larger than any real travel cost
+_UNCOVERED = 1e6
+
+
+def plan_staging(idle, weights, fmap=facility_map, min_move=STAGING_MIN_MOVE):
+    """Where idle robots should wait so the next request is as close as possible to one of them.
+
+    idle: {robot name: (x, y)}. weights: {room: expected tasks per hour} from RoomDemandForecast.
+    Candidate spots are the room points of the map (never chargers or warehouses, which robots
+    must be able to reach). Up to one spot per idle robot is picked greedily, each lowering the
+    demand-weighted distance from every room to its nearest spot the most, so the busiest rooms
+    get covered first and later spots spread out to the rest; once no spot helps, the rest of
+    the robots stay put. Robots are matched to the spots with the least total travel (allocator.assign).
+    Returns [(robot name, {"x", "y"})] for robots more than min_move from their spot.
+    """
+    rooms = [room for room, weight in weights.items() if weight > 0]
+    if not rooms or not idle:
+        return []
+    w = np.array([weights[room] for room in rooms], dtype=float)
+    w /= w.sum()
+    spots = np.array([i for i, name in enumerate(fmap.names) if "/" in name], dtype=int)
+
+    # Spot -> room cost, to whichever of the idle robots' coordinates for the room is nearest
+    to_rooms = np.full((len(spots), len(rooms)), _UNCOVERED)
+    for name in idle:
+        targets = np.array([fmap.index.get(fmap.room_point(name, room), -1) for room in rooms])
+        valid = targets >= 0
+        to_rooms[:, valid] = np.minimum(to_rooms[:, valid], fmap.cost[np.ix_(spots, targets[valid])])
+
+    chosen = []
+    covered = np.full(len(rooms), _UNCOVERED)
+    for _ in range(min(len(idle), len(spots))):
+        expected = (np.minimum(covered[None, :], to_rooms) * w).sum(axis=1)
+        expected[chosen] = np.inf
+        best = int(np.argmin(expected))
+        if chosen and expected[best] >= (covered * w).sum() - 1e-9:
+            break
+        chosen.append(best)
+        covered = np.minimum(covered, to_rooms[best])
+
+    names = list(idle)
+    travel = fmap.distances_from_many([idle[name] for name in names])[:, spots[chosen]]
+    plan = []
+    for robot, spot in assign(travel):
+        if travel[robot, spot] > min_move:
+            x, y = fmap.coords[spots[chosen[spot]]]
+            plan.append((names[robot], {"x": float(x), "y": float(y)}))
+    return plan
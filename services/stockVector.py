@@ -0,0 +1,77 @@
+import numpy as np
+from common.config import MEDICATION_TYPES
+
+# Position of each medication type in every stock/demand vector
+MED_INDEX = {med: i for i, med in enumerate(MEDICATION_TYPES)}
+STOCK_DTYPE = np.int32
+
+
+def to_vector(meds):
+    """{type: amount} -> int vector over MEDICATION_TYPES. Types that aren't stocked are dropped."""
+    vector = np.zeros(len(MEDICATION_TYPES), dtype=STOCK_DTYPE)
+    for med, amount in meds.items():
+        i = MED_INDEX.get(med)
+        if i is not None:
+            vector[i] = amount
+    return vector
+
+
+def demand_vector(meds):
+    """Demand vector for a task's medications, or None if it asks for a type no robot stocks."""
+    if any(med not in MED_INDEX and amount > 0 for med, amount in meds.items()):
+        return None
+    return to_vector(meds)
+
+
+def to_dict(vector, skip_zero=False):
+    return {med: int(amount) for med, amount in zip(MEDICATION_TYPES, vector) if amount or not skip_zero}
+
+
+def pack(vector):
+    """Wire format: plain list of amounts in MEDICATION_TYPES order."""
+    return [int(amount) for amount in vector]
+
+
+def unpack(value):
+    """Inverse of pack(); also accepts the older {type: amount} dicts."""
+    if value is None:
+        return np.zeros(len(MEDICATION_TYPES), dtype=STOCK_DTYPE)
+    if isinstance(value, dict):
+        return to_vector(value)
+    vector = np.zeros(len(MEDICATION_TYPES), dtype=STOCK_DTYPE)
+    values = np.asarray(value, dtype=STOCK_DTYPE)[:len(MEDICATION_TYPES)]
+    vector[:len(values)] = values
+    return vector
+
+
+def stock_matrix(stocks):
+    """Packed or dict stocks of several robots -> robots x types matrix."""
+    return np.array([unpack(stock) for stock in stocks], dtype=STOCK_DTYPE).reshape(-1, len(MEDICATION_TYPES))
+
+
+def covers(stock, demand):
+    """Whether stock covers demand. stock may be one vector or a robots x types matrix (bool per robot)."""
+    if demand is None:
+        return np.zeros(np.shape(stock)[:-1], dtype=bool) if np.ndim(stock) > 1 else False
+    return (np.asarray(stock) >= demand).all(axis=-1)
+
+
+def split(stocks, demand, order=None):
+    """Split demand across robots (rows of stocks), using as few robots as the greedy order allows.
+
+    Robots are taken in `order` (default: how much of the demand they cover alone); each takes
+    what is still missing, computed for all robots at once with a cumulative sum. Returns a
+    robots x types contribution matrix, or None if the fleet together can't cover the demand.
+    """
+    stocks = np.asarray(stocks, dtype=STOCK_DTYPE).reshape(-1, len(MEDICATION_TYPES))
+    if demand is None or (stocks.sum(axis=0) < demand).any():
+        return None
+    useful = np.minimum(stocks, demand)
+    if order is None:
+        order = np.argsort(-useful.sum(axis=1), kind="stable")
+    ordered = useful[order]
+    before = np.cumsum(ordered, axis=0) - ordered  # already given by robots earlier in the order
+    take = np.clip(demand - before, 0, ordered)
+    contribution = np.zeros_like(stocks)
+    contribution[order] = take
+    return contribution
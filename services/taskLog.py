@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def _drop_torn_tail(path, chunk=4096):
+    """Cut a partial last line (crash mid-write) so the next append starts on a line of its own."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            pos = start
+        else:
+            keep = 0
+        if keep < end:
+            f.truncate(keep)
+
+
+class TaskLog:
+    """Append-only JSON-lines journal of task adds/removes, used to rebuild a task queue after a restart.
+
+    Each append is flushed to the OS straight away, so it survives a crash of this process.
+    fsync, which makes it survive an OS crash or power loss too, happens in groups: at most every
+    `fsync_interval` seconds, or as soon as `fsync_batch` records are waiting. Such a crash can
+    therefore lose at most the last interval. Once removed tasks dominate the file it is
+    rewritten with only the live tasks (see needs_compaction/compact).
+    """
+
+    def __init__(self, path, fsync_interval=0.05, fsync_batch=256, compact_min_records=10000):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.compact_min_records = compact_min_records
+        self._lock = threading.Lock()
+        _drop_torn_tail(path)
+        self._file = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._records = 0  # records in the file
+        self._live = 0     # adds minus removes, roughly the number of tasks a replay would return
+        self._closed = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_loop, name=f"TaskLog-{os.path.basename(path)}", daemon=True)
+        self._syncer.start()
+
+    def iter_records(self):
+        """Stream records from disk one line at a time. A torn last line (crash mid-write) is skipped;
+        it is cut from the file when the log is opened, before anything is appended."""
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def replay(self):
+        """Rebuild the live tasks as an ID -> task OrderedDict, in original insertion order."""
+        tasks = OrderedDict()
+        records = 0
+        for record in self.iter_records():
+            records += 1
+            if record.get("op") == "add":
+                task = record["task"]
+                tasks[task["ID"]] = task
+            elif record.get("op") == "remove":
+                tasks.pop(record.get("id"), None)
+        with self._lock:
+            self._records = records
+            self._live = len(tasks)
+        return tasks
+
+    def append_add(self, task):
+        self._append({"op": "add", "task": task}, live_delta=1)
+
+    def append_remove(self, task_id):
+        self._append({"op": "remove", "id": task_id}, live_delta=-1)
+
+    def _append(self, record, live_delta):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._records += 1
+            self._live += live_delta
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_batch:
+                self._sync_locked()
+
+    def needs_compaction(self):
+        with self._lock:
+            return self._records >= self.compact_min_records and self._records > 2 * max(self._live, 1)
+
+    def compact(self, live_tasks):
+        """Rewrite the log so it only holds `live_tasks`. The caller must stop appending meanwhile."""
+        tmp_path = self.path + ".compact"
+        count = 0
+        with open(tmp_path, "w", encoding="utf-8") as tmp:
+            for task in live_tasks:
+                tmp.write(json.dumps({"op": "add", "task": task}, separators=(",", ":")) + "\n")
+                count += 1
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        with self._lock:
+            self._sync_locked()
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._records = count
+            self._live = count
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def close(self):
+        self._closed.set()
+        self._syncer.join()
+        with self._lock:
+            self._sync_locked()
+            self._file.close()
+
+    def _sync_locked(self):
+        if self._unsynced == 0:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if not self._file.closed:
+                    self._sync_locked()
@@ -0,0 +1,191 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from common.config import (TASK_PRIORITIES, DEFAULT_TASK_PRIORITY, PRIORITY_AGING, DEADLINE_LEAD,
+                           RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX, MAX_TASK_ATTEMPTS)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def task_error(task):
+    """Why `task` can't be queued, or None if it is well formed.
+
+    Required: ID (str or int), room (str) and medications ({type: non-negative int}).
+    Optional: priority (one of TASK_PRIORITIES), deadline and created_at (epoch seconds).
+    """
+    if not isinstance(task, dict):
+        return "Invalid task format. Expected a JSON object."
+    if not isinstance(task.get("ID"), (str, int)) or isinstance(task.get("ID"), bool) \
+            or not isinstance(task.get("room"), str) or not isinstance(task.get("medications"), dict):
+        return "Invalid task format. Required: ID, medications, room."
+    if not all(isinstance(med, str) and isinstance(amount, int) and not isinstance(amount, bool) and amount >= 0
+               for med, amount in task["medications"].items()):
+        return "Invalid medications. Expected {type: quantity} with non-negative integer quantities."
+    priority = task.get("priority", DEFAULT_TASK_PRIORITY)
+    if not isinstance(priority, str) or priority not in TASK_PRIORITIES:
+        return f"Invalid priority. Expected one of: {', '.join(TASK_PRIORITIES)}."
+    if "deadline" in task and task["deadline"] is not None and not _is_number(task["deadline"]):
+        return "Invalid deadline. Expected epoch seconds."
+    if "created_at" in task and not _is_number(task["created_at"]):
+        return "Invalid created_at. Expected epoch seconds."
+    return None
+
+
+def task_rank(task):
+    """Heap key of a task: lower is dispatched first.
+
+    Arrival time shifted by PRIORITY_AGING seconds per priority level, so a task's effective
+    priority improves the longer it waits (aging) without re-keying the heap. A deadline pulls
+    the key forward to DEADLINE_LEAD seconds before it, whichever is earlier.
+    """
+    level = TASK_PRIORITIES.get(task.get("priority", DEFAULT_TASK_PRIORITY), TASK_PRIORITIES[DEFAULT_TASK_PRIORITY])
+    key = task["created_at"] + level * PRIORITY_AGING
+    if task.get("deadline") is not None:
+        key = min(key, task["deadline"] - DEADLINE_LEAD)
+    return key
+
+
+def retry_delay(attempts):
+    return min(RETRY_BACKOFF_BASE * 2 ** max(attempts - 1, 0), RETRY_BACKOFF_MAX)
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class TaskScheduler:
+    """The TaskManager's pending tasks: a priority heap of ready tasks plus a heap of retries.
+
+    Failed tasks come back through retry(), which counts the attempt in task["attempts"] and
+    holds the task back with exponential backoff, so an undeliverable task no longer spins.
+    After MAX_TASK_ATTEMPTS a task is moved to dead_letters instead, so one that can never
+    succeed (an unknown room, say) doesn't retry forever.
+    Tasks that only lacked a free robot come back through defer() instead: no attempt is
+    counted and they wait, at their old rank, for wake() when a robot frees up.
+    Every change is journaled when a TaskLog is given, like services.taskStore.TaskStore.
+    Not thread-safe: used from the TaskManager's event loop only.
+    """
+
+    def __init__(self, tasks=(), journal=None):
+        self.journal = journal
+        self._ready = []    # heap of (task_rank, seq, task)
+        self._delayed = []  # heap of (time.monotonic() when due, seq, task)
+        self._waiting = []  # deferred until a robot frees up
+        self.wakes = 0  # wake() calls so far
+        self._seq = itertools.count()
+        self.wait_times = deque(maxlen=1000)  # seconds from created_at to leaving the queue
+        self.dead_letters = deque(maxlen=1000)  # tasks given up on, newest last
+        for task in tasks:
+            self._push_ready(task)
+
+    def __len__(self):
+        return len(self._ready) + len(self._delayed) + len(self._waiting)
+
+    def push(self, task):
+        """Queue a task for dispatch as soon as possible."""
+        task.setdefault("created_at", time.time())
+        self._journal_add(task)
+        self._push_ready(task)
+
+    def retry(self, task):
+        """Queue a task whose dispatch or delivery failed, after its backoff delay.
+
+        Returns False if the task has failed MAX_TASK_ATTEMPTS times: it is dead-lettered, not queued.
+        """
+        task.setdefault("created_at", time.time())
+        task["attempts"] = task.get("attempts", 0) + 1
+        if task["attempts"] >= MAX_TASK_ATTEMPTS:
+            self.dead_letters.append(task)
+            return False
+        self._journal_add(task)
+        due = time.monotonic() + retry_delay(task["attempts"])
+        heapq.heappush(self._delayed, (due, next(self._seq), task))
+        return True
+
+    def defer(self, task, since=None):
+        """Queue a task that no robot was free to take, until wake().
+
+        since: the `wakes` count when its dispatch pass started. If a robot freed up in the
+        meantime the task is ready again at once, so it is not left waiting for the next one.
+        """
+        self._journal_add(task)
+        if since is not None and since != self.wakes:
+            self._push_ready(task)
+        else:
+            self._waiting.append(task)
+
+    def wake(self):
+        """A robot may be free: the deferred tasks are ready again."""
+        self.wakes += 1
+        for task in self._waiting:
+            self._push_ready(task)
+        self._waiting.clear()
+
+    def pop_ready(self, limit):
+        """Up to `limit` most urgent tasks whose backoff has passed."""
+        self._promote()
+        tasks = []
+        now = time.time()
+        while self._ready and len(tasks) < limit:
+            _, _, task = heapq.heappop(self._ready)
+            tasks.append(task)
+            self.wait_times.append(now - task["created_at"])
+        if tasks and self.journal is not None:
+            for task in tasks:
+                self.journal.append_remove(task["ID"])
+            if self.journal.needs_compaction():
+                self.journal.compact(self.tasks())
+        return tasks
+
+    def has_ready(self):
+        self._promote()
+        return bool(self._ready)
+
+    def next_due_in(self):
+        """Seconds until the next retry becomes ready, or None if none is waiting."""
+        if not self._delayed:
+            return None
+        return max(0.0, self._delayed[0][0] - time.monotonic())
+
+    def tasks(self):
+        return [task for _, _, task in self._ready] + [task for _, _, task in self._delayed] + list(self._waiting)
+
+    def depth(self):
+        """Tasks ready for dispatch, backing off before a retry and waiting for a free robot; O(1)."""
+        return {"ready": len(self._ready), "backing_off": len(self._delayed), "waiting": len(self._waiting)}
+
+    def stats(self):
+        """Queue depth and wait-time metrics."""
+        now = time.time()
+        queued = self.tasks()
+        waits = list(self.wait_times)
+        return {
+            **self.depth(),
+            "by_priority": {level: sum(1 for t in queued if t.get("priority", DEFAULT_TASK_PRIORITY) == level)
+                            for level in TASK_PRIORITIES},
+            "overdue": sum(1 for t in queued if t.get("deadline") is not None and t["deadline"] < now),
+            "oldest_wait_s": max((now - t["created_at"] for t in queued), default=0.0),
+            "wait_p50_s": percentile(waits, 50),
+            "wait_p95_s": percentile(waits, 95),
+            "dead_letters": len(self.dead_letters),
+        }
+
+    def _push_ready(self, task):
+        task.setdefault("created_at", time.time())
+        heapq.heappush(self._ready, (task_rank(task), next(self._seq), task))
+
+    def _promote(self):
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, task = heapq.heappop(self._delayed)
+            self._push_ready(task)
+
+    def _journal_add(self, task):
+        if self.journal is not None:
+            self.journal.append_add(task)
@@ -0,0 +1,147 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class TaskStore:
+    """Thread-safe store of pending tasks with O(1) add/get/remove and room/medication indexes.
+
+    Tasks stay in insertion order. Claimed tasks are hidden from claim() until they are
+    acked or their lease expires, after which they go back to the front of the queue.
+    With a `journal` (services.taskLog.TaskLog) every add/remove is logged and the store
+    starts from the journal's contents; leases are not logged, so replayed tasks start unclaimed.
+    """
+
+    def __init__(self, tasks=(), journal=None):
+        self._lock = threading.RLock()
+        self._tasks = OrderedDict()      # ID -> task, everything not yet acked
+        self._unclaimed = OrderedDict()  # ID -> None, FIFO of tasks claim() can hand out
+        self._leases = {}                # ID -> lease expiry (time.time())
+        self._lease_heap = []            # (expiry, ID), stale entries are skipped
+        self._by_room = defaultdict(dict)
+        self._by_medication = defaultdict(dict)
+        self._journal = None
+        if journal is not None:
+            for task in journal.replay().values():
+                self.add(task)
+            self._journal = journal
+        for task in tasks:
+            self.add(task)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
+
+    def __contains__(self, task_id):
+        with self._lock:
+            return task_id in self._tasks
+
+    def add(self, task):
+        """Queue a task. Returns False if a task with the same ID is already stored."""
+        task_id = task['ID']
+        with self._lock:
+            if task_id in self._tasks:
+                return False
+            self._tasks[task_id] = task
+            self._unclaimed[task_id] = None
+            self._by_room[task.get('room')][task_id] = None
+            for med in task.get('medications', {}):
+                self._by_medication[med][task_id] = None
+            if self._journal is not None:
+                self._journal.append_add(task)
+            return True
+
+    def get(self, task_id):
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def remove(self, task_id):
+        """Delete a task whether or not it is claimed. Returns the task, or None if unknown."""
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            if task is None:
+                return None
+            self._unclaimed.pop(task_id, None)
+            self._leases.pop(task_id, None)
+            self._drop_index(self._by_room, task.get('room'), task_id)
+            for med in task.get('medications', {}):
+                self._drop_index(self._by_medication, med, task_id)
+            if self._journal is not None:
+                self._journal.append_remove(task_id)
+                if self._journal.needs_compaction():
+                    self._journal.compact(self._tasks.values())
+            return task
+
+    def clear(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.compact([])
+            self._tasks.clear()
+            self._unclaimed.clear()
+            self._leases.clear()
+            self._lease_heap.clear()
+            self._by_room.clear()
+            self._by_medication.clear()
+
+    def list(self, room=None, medication=None):
+        """Tasks in insertion order, optionally only those for a room and/or needing a medication type."""
+        with self._lock:
+            if room is None and medication is None:
+                return list(self._tasks.values())
+            candidates = []
+            if room is not None:
+                candidates.append(self._by_room.get(room, {}))
+            if medication is not None:
+                candidates.append(self._by_medication.get(medication, {}))
+            candidates.sort(key=len)
+            smallest, others = candidates[0], candidates[1:]
+            return [self._tasks[task_id] for task_id in smallest
+                    if all(task_id in other for other in others)]
+
+    def claim(self, limit, lease):
+        """Lease up to `limit` unclaimed tasks for `lease` seconds."""
+        now = time.time()
+        expiry = now + lease
+        claimed = []
+        with self._lock:
+            self._expire_leases(now)
+            while self._unclaimed and len(claimed) < limit:
+                task_id, _ = self._unclaimed.popitem(last=False)
+                self._leases[task_id] = expiry
+                heapq.heappush(self._lease_heap, (expiry, task_id))
+                claimed.append(self._tasks[task_id])
+        return claimed
+
+    def ack(self, task_ids):
+        """Remove finished tasks. Returns (acked IDs, unknown IDs)."""
+        acked, missing = [], []
+        with self._lock:
+            for task_id in task_ids:
+                if self.remove(task_id) is not None:
+                    acked.append(task_id)
+                else:
+                    missing.append(task_id)
+        return acked, missing
+
+    def _expire_leases(self, now):
+        expired = []
+        while self._lease_heap and self._lease_heap[0][0] <= now:
+            expiry, task_id = heapq.heappop(self._lease_heap)
+            if self._leases.get(task_id) != expiry:
+                continue  # acked or re-claimed since
+            del self._leases[task_id]
+            expired.append(task_id)
+        # Back to the front of the queue, oldest claim first
+        for task_id in reversed(expired):
+            self._unclaimed[task_id] = None
+            self._unclaimed.move_to_end(task_id, last=False)
+
+    @staticmethod
+    def _drop_index(index, key, task_id):
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        bucket.pop(task_id, None)
+        if not bucket:
+            del index[key]
@@ -0,0 +1,81 @@
+"""Headless robot fleet for offline load testing.
+
+    python simulate_fleet.py --robots 100 --broker localhost
+    python simulate_fleet.py --robots 50 --broker inprocess --with-agents
+
+--with-agents also starts the TaskManager and one MedicationRobotAgent per simulated robot in this
+process (needs an XMPP server on localhost, like start_agents.py). With --broker inprocess nothing
+leaves the process except XMPP; main.py's task push then can't reach the manager, which falls
+back to its reconciliation poll.
+"""
+import argparse
+import asyncio
+import logging
+import os
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulated robot fleet")
+    parser.add_argument("--robots", type=int, default=50)
+    parser.add_argument("--speed", type=float, default=0.5, help="metres per second")
+    parser.add_argument("--drain", type=float, default=0.5, help="battery percent per metre")
+    parser.add_argument("--tick", type=float, default=0.1, help="simulation step in seconds")
+    parser.add_argument("--broker", default=None, help="MQTT broker host, or 'inprocess'")
+    parser.add_argument("--with-agents", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+async def run_agents(robot_names):
+    from agents.TaskManagementAgent import TaskManagerAgent
+    from agents.MedicationRobotAgent import MedicationRobotAgent
+    from agents.BatteryStation import BatteryStationAgent
+    from common.config import BATTERY_STATION_JID, METRICS_PORT
+    from services.metrics import start_metrics_server
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    all_ids = [f"{name}@localhost" for name in robot_names]
+    task_manager = TaskManagerAgent("taskmanager@localhost", "managerpassword", all_ids)
+    battery_station = BatteryStationAgent(BATTERY_STATION_JID, "stationpassword", robot_names)
+    robots = [
+        MedicationRobotAgent(jid, "robotpassword", [p for p in all_ids if p != jid], name, 100, BATTERY_STATION_JID)
+        for name, jid in zip(robot_names, all_ids)
+    ]
+    await asyncio.gather(task_manager.start(), battery_station.start(), *(robot.start() for robot in robots))
+    return [task_manager, battery_station] + robots
+
+
+async def main(args):
+    from common.config import LOG_LEVEL, LOG_FORMAT
+    from services.robotSimulator import FleetSimulator
+
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    robot_names = [f"robot{i}" for i in range(1, args.robots + 1)]
+    simulator = FleetSimulator(robot_names, speed=args.speed, tick=args.tick,
+                               drain_per_metre=args.drain, seed=args.seed)
+    simulator.start()
+    agents = await run_agents(robot_names) if args.with_agents else []
+
+    print("Simulator running. Press Ctrl+C to stop.")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"[Simulator] goals received={simulator.goals_received} "
+                  f"succeeded={simulator.goals_succeeded} aborted={simulator.goals_aborted}")
+    finally:
+        for agent in agents:
+            await agent.stop()
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.broker:
+        # Must be set before common.config is imported
+        os.environ["MQTT_BROKER"] = args.broker
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        print("Simulator stopped.")
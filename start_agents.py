@@ -1,7 +1,10 @@
 import asyncio
+import logging
 from agents.TaskManagementAgent import TaskManagerAgent
 from agents.MedicationRobotAgent import MedicationRobotAgent
 from agents.BatteryStation import BatteryStationAgent
+from common.config import BATTERY_STATION_JID, LOG_LEVEL, LOG_FORMAT, METRICS_PORT
+from services.metrics import start_metrics_server
 
 
 
@@ -10,6 +13,11 @@ from agents.BatteryStation import BatteryStationAgent
 if __name__ == "__main__":
 
     async def main():
+        logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
+            print(f"Metrics at http://localhost:{METRICS_PORT}/metrics")
+        print("Starting agents...")
 
         all_ids = ["robot1@localhost", "robot2@localhost", "robot3@localhost"]
         # all_ids = ["robot1@localhost", "robot2@localhost", "robot3@localhost","robot4@localhost"]
@@ -18,14 +26,16 @@ if __name__ == "__main__":
             return [jid for jid in all_ids if jid != my_id]
         
         task_manager = TaskManagerAgent("taskmanager@localhost", "managerpassword", all_ids)
+        battery_station = BatteryStationAgent(BATTERY_STATION_JID, "stationpassword", [jid.split("@")[0] for jid in all_ids])
     
-        robot1 = MedicationRobotAgent("robot1@localhost", "robotpassword", get_peers("robot1@localhost"),"robot1",100)
-        robot2 = MedicationRobotAgent("robot2@localhost", "robotpassword", get_peers("robot2@localhost"),"robot2",19)
-        robot3 = MedicationRobotAgent("robot3@localhost", "robotpassword", get_peers("robot3@localhost"),"robot3",100)
+        robot1 = MedicationRobotAgent("robot1@localhost", "robotpassword", get_peers("robot1@localhost"),"robot1",100, BATTERY_STATION_JID)
+        robot2 = MedicationRobotAgent("robot2@localhost", "robotpassword", get_peers("robot2@localhost"),"robot2",19, BATTERY_STATION_JID)
+        robot3 = MedicationRobotAgent("robot3@localhost", "robotpassword", get_peers("robot3@localhost"),"robot3",100, BATTERY_STATION_JID)
         # robot4 = MedicationRobotAgent("robot4@localhost", "robotpassword", get_peers("robot4@localhost"))
 
         await asyncio.gather(
             task_manager.start(),
+            battery_station.start(),
             robot1.start(),
             robot2.start(),
             robot3.start(),
@@ -40,6 +50,7 @@ if __name__ == "__main__":
         except KeyboardInterrupt:
             print("Stopping agents...")
             await task_manager.stop()
+            await battery_station.stop()
             await robot1.stop()
             await robot2.stop()
             await robot3.stop()